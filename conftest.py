@@ -0,0 +1,4 @@
+import os
+
+# s3.pitr creates boto3 clients at import, tests use local stand-ins and never call AWS
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
@@ -0,0 +1,369 @@
+"""
+Offline benchmarks of S3 PITR manifest generation.
+
+Benchmarks run on synthetic Athena results generated in a temporary folder, no AWS call is done.
+
+Usage:
+    python -m s3.benchmark --help
+    python -m s3.benchmark split-csv --buckets 5000 --rows 1000000 --max-open-files 256
+    python -m s3.benchmark restore-dedup --rows 1000000 --keys 200000
+    python -m s3.benchmark suite --buckets 50 --keys 200000 --versions-per-key 3 --collision-rate 0.01
+"""
+import csv
+import inspect
+import json
+import logging
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List, Set, Tuple
+from urllib.parse import quote_plus
+
+import typer
+
+from s3 import pitr
+from s3.benchmark_aws import install_local_clients
+from s3.pitr import (build_restore_index, get_sequencer_value, split_csv_rows, _select_row_to_write,
+                     BUCKET_COLUMN_NAME, MAX_OPEN_MANIFEST_FILES, SEQUENCER_COLUMN_NAME)
+from s3.pitr_local import RowsReader
+
+app = typer.Typer(no_args_is_help=True)
+
+
+@app.callback()
+def main():
+    """Offline benchmarks of S3 PITR manifest generation."""
+
+
+@contextmanager
+def working_directory(path: str):
+    """PITR functions write manifests in the current folder, so benchmarks run inside a temporary one."""
+    previous_path = os.getcwd()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(previous_path)
+
+
+def generate_athena_results_csv(file_path: str, buckets: int, rows: int, seed: int = 0, keys: int = 0):
+    """
+    Writes a CSV with the same columns of get_files_to_restore.sql results and rows spread over buckets.
+    If keys is greater than 0 rows are spread over this number of keys, so keys are seen again.
+    """
+    rnd = random.Random(seed)
+    with open(file_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([BUCKET_COLUMN_NAME, 'key', 'version', 'sequencer'])
+        for i in range(rows):
+            key_index = rnd.randrange(keys) if keys else i
+            bucket_index = key_index % buckets if keys else rnd.randrange(buckets)
+            writer.writerow([f"bucket-{bucket_index:05d}", f"folder-{key_index % 100}/object-{key_index}.json",
+                             f"{rnd.getrandbits(64):016x}", f"{rnd.getrandbits(72):018X}"])
+
+
+def _report(name: str, rows: int, elapsed: float, extra: str = ""):
+    typer.echo(f"{name}: {rows:,} rows in {elapsed:.2f}s ({rows / elapsed:,.0f} rows/s){extra}")
+
+
+@app.command()
+def split_csv(
+        buckets: int = typer.Option(1000, help="Number of distinct buckets in results."),
+        rows: int = typer.Option(500_000, help="Number of rows in results."),
+        max_open_files: int = typer.Option(MAX_OPEN_MANIFEST_FILES, help="Max open manifest files."),
+        work_dir: str = typer.Option(None, help="Folder for temporary files, default system temp folder.")
+):
+    """
+    Measures split_csv_rows throughput, with buckets greater than max_open_files writers are evicted and reopened.
+    """
+    with tempfile.TemporaryDirectory(dir=work_dir, prefix='pitr-benchmark-') as tmp, working_directory(tmp):
+        generate_athena_results_csv('athena_results.csv', buckets, rows)
+        input_size = os.path.getsize('athena_results.csv')
+
+        start = time.perf_counter()
+        with open('athena_results.csv', 'r') as infile:
+            files = split_csv_rows(csv.DictReader(infile), BUCKET_COLUMN_NAME, extra_name_suffix='benchmark',
+                                   max_open_files=max_open_files)
+        elapsed = time.perf_counter() - start
+
+        _report("split_csv_rows", rows, elapsed,
+                f", {len(files)} manifests, {input_size / elapsed / 1024 / 1024:.1f} MB/s")
+
+
+def _build_rows_index(reader, skip_duplicated_versions_at_same_time: bool,
+                      duplicated_version_at_same_time_rows: dict) -> dict:
+    """Restore dedup index before build_restore_index: full rows kept, sequencer of selected row parsed again."""
+    row_to_write_by_bucket_name_key = {}
+    for row in reader:
+        rows_to_write = row_to_write_by_bucket_name_key.setdefault(row[BUCKET_COLUMN_NAME], {})
+        last_written_row = rows_to_write.get(row["key"])
+        if _select_row_to_write(row, get_sequencer_value(row), last_written_row and last_written_row["version"],
+                                get_sequencer_value(last_written_row or {}), skip_duplicated_versions_at_same_time,
+                                duplicated_version_at_same_time_rows):
+            rows_to_write[row["key"]] = row
+    return row_to_write_by_bucket_name_key
+
+
+@app.command()
+def restore_dedup(
+        buckets: int = typer.Option(10, help="Number of distinct buckets in results."),
+        keys: int = typer.Option(100_000, help="Number of distinct keys in results."),
+        rows: int = typer.Option(500_000, help="Number of rows in results."),
+        work_dir: str = typer.Option(None, help="Folder for temporary files, default system temp folder.")
+):
+    """
+    Compares the restore dedup index of build_restore_index with the previous one of full rows. Throughput is
+    measured on rows already parsed, so CSV parsing isn't counted, memory is the size of the index built while
+    reading the CSV (key strings included, they are the same in both indexes).
+    """
+    pitr.logger.setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory(dir=work_dir, prefix='pitr-benchmark-') as tmp, working_directory(tmp):
+        generate_athena_results_csv('athena_results.csv', buckets, rows, keys=keys)
+        with open('athena_results.csv', 'r') as infile:
+            reader = csv.DictReader(infile)
+            parsed_rows = RowsReader(reader.fieldnames, list(reader))
+
+        for name, build_index in [("rows index", _build_rows_index), ("build_restore_index", build_restore_index)]:
+            # Best of 3 runs
+            elapsed = None
+            for _ in range(3):
+                start = time.perf_counter()
+                index = build_index(parsed_rows, True, {})
+                run_elapsed = time.perf_counter() - start
+                elapsed = min(elapsed or run_elapsed, run_elapsed)
+                selected = sum(len(v) for v in index.values())
+                del index
+
+            with open('athena_results.csv', 'r') as infile:
+                tracemalloc.start()
+                index = build_index(csv.DictReader(infile), True, {})
+                size, _ = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            del index
+            _report(name, rows, elapsed, f", {selected:,} keys, index {size / 1024 / 1024:.1f} MB "
+                                         f"({size / selected:.0f} B/key)")
+
+
+SUITE_STAGES = ["restore", "restore-external-sort", "split", "pipeline-download", "pipeline-s3-stream",
+                "pipeline-query-results"]
+RESTORE_RESULTS_FILE = 'athena_results_restore.csv'
+DELETE_RESULTS_FILE = 'athena_results_delete.csv'
+SUITE_TEMP_BUCKET = 'pitr-benchmark-temp'
+
+
+def _benchmark_key(rnd: random.Random, key_index: int, url_encoded_rate: float) -> str:
+    """Key of synthetic results, with url_encoded_rate probability it has chars URL encoded by S3 events."""
+    if rnd.random() < url_encoded_rate:
+        return quote_plus(f"folder {key_index % 100}/report ({key_index}), été+copy.json", safe='/')
+    return f"folder-{key_index % 100}/object-{key_index}.json"
+
+
+def generate_restore_results(file_path: str, buckets: int, keys: int, versions_per_key: int, collision_rate: float,
+                             url_encoded_rate: float, seed: int = 0, shuffle_window: int = 10_000) \
+        -> Tuple[int, Dict[Tuple[str, str], str], Set[str]]:
+    """
+    Writes results of get_files_to_restore.sql: keys spread over buckets, each one with versions_per_key versions
+    with distinct sequencers. With collision_rate probability a key has one more version with the same sequencer of
+    its most recent one. Rows of shuffle_window keys are shuffled, so versions of a key aren't adjacent.
+
+    Returns rows count, expected version by (bucket name, key) with skip of duplicated versions (first row with the
+    highest sequencer in file order) and keys with duplicated versions.
+    """
+    rnd = random.Random(seed)
+    expected = {}
+    duplicated_keys = set()
+    rows_count = 0
+    with open(file_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([BUCKET_COLUMN_NAME, 'key', 'version', SEQUENCER_COLUMN_NAME])
+        for window_start in range(0, keys, shuffle_window):
+            rows = []
+            for key_index in range(window_start, min(window_start + shuffle_window, keys)):
+                bucket_name = f"bucket-{key_index % buckets:05d}"
+                key = _benchmark_key(rnd, key_index, url_encoded_rate)
+                sequencers = sorted(rnd.sample(range(1, 2 ** 40), versions_per_key))
+                key_rows = [[bucket_name, key, f"{rnd.getrandbits(64):016x}", f"{s:018X}"] for s in sequencers]
+                if rnd.random() < collision_rate:
+                    key_rows.append([bucket_name, key, f"{rnd.getrandbits(64):016x}", key_rows[-1][3]])
+                    duplicated_keys.add(key)
+                rows.extend(key_rows)
+            rnd.shuffle(rows)
+            for bucket_name, key, version, sequencer in rows:
+                max_sequencer = expected.get((bucket_name, key), ("", ""))
+                if int(sequencer, 16) > int(max_sequencer[1] or "0", 16):
+                    expected[(bucket_name, key)] = (version, sequencer)
+            writer.writerows(rows)
+            rows_count += len(rows)
+    return rows_count, {k: v[0] for k, v in expected.items()}, duplicated_keys
+
+
+def generate_delete_results(file_path: str, buckets: int, keys: int, url_encoded_rate: float, seed: int = 0) \
+        -> Tuple[int, Set[Tuple[str, str]]]:
+    """Writes results of get_files_to_delete.sql, returns rows count and expected (bucket name, key) rows."""
+    rnd = random.Random(seed)
+    expected = set()
+    with open(file_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([BUCKET_COLUMN_NAME, 'key'])
+        for key_index in range(keys):
+            row = (f"bucket-{rnd.randrange(buckets):05d}", _benchmark_key(rnd, key_index, url_encoded_rate))
+            writer.writerow(row)
+            expected.add(row)
+    return keys, expected
+
+
+def _command_defaults(command) -> dict:
+    """Default values of typer options of a command, to call it as a function."""
+    return {name: getattr(parameter.default, 'default', parameter.default)
+            for name, parameter in inspect.signature(command).parameters.items()}
+
+
+def _max_rss_mb() -> float:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return max_rss / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+def _run_stage(stage: str, data_dir: str, rows: int) -> dict:
+    """Runs a stage in its own folder and returns its elapsed time, peak RSS and written manifests."""
+    # pitr logs skipped rows at info level, also on root logger
+    logging.disable(logging.INFO)
+    stage_dir = os.path.join(data_dir, stage)
+    os.makedirs(stage_dir)
+    restore_results = os.path.join(data_dir, RESTORE_RESULTS_FILE)
+    with working_directory(stage_dir):
+        rss_before = _max_rss_mb()
+        start = time.perf_counter()
+        if stage == "restore":
+            manifests = pitr.parse_athena_csv_for_restore(restore_results, "restore",
+                                                          skip_duplicated_versions_at_same_time=True)
+        elif stage == "restore-external-sort":
+            manifests = pitr.parse_athena_csv_for_restore(restore_results, "restore",
+                                                          skip_duplicated_versions_at_same_time=True,
+                                                          max_rows_in_memory=max(1, rows // 8), spill_dir=stage_dir)
+        elif stage == "split":
+            manifests = pitr.split_csv_file(os.path.join(data_dir, DELETE_RESULTS_FILE), BUCKET_COLUMN_NAME,
+                                            extra_name_suffix="delete")
+        else:
+            clients = install_local_clients(os.path.join(stage_dir, 's3'), restore_results)
+            parameters = _command_defaults(pitr.do_action)
+            parameters.update(athena_database='benchmark', athena_table='events', action='restore',
+                              s3_temp_bucket=SUITE_TEMP_BUCKET, snapshot_end_time='2025-05-30T04:00:00Z',
+                              restore_iam_role_arn='arn:aws:iam::000000000000:role/benchmark',
+                              batch_lambda_delete_arn='arn:aws:lambda:eu-west-1:000000000000:function:benchmark',
+                              confirmation_required=True, skip_duplicated_versions_at_same_time=True,
+                              results_source=stage.removeprefix("pipeline-"))
+            pitr.do_action(**parameters)
+            with open('batch_operations_restore.json', 'r') as f:
+                jobs = json.load(f)
+            if len(jobs) != len(clients['s3control_client'].jobs) or any('error' in j for j in jobs):
+                raise RuntimeError(f"Batch operations not created for every manifest: {jobs}")
+            manifests = [os.path.basename(j['manifest']) for j in jobs]
+        elapsed = time.perf_counter() - start
+    return {'stage': stage, 'rows': rows, 'elapsed': elapsed, 'rss_before_mb': rss_before,
+            'peak_rss_mb': _max_rss_mb(), 'manifests': [os.path.join(stage_dir, m) for m in manifests],
+            'duplicated_rows_file': os.path.join(stage_dir, 'duplicated_version_at_same_time.csv')}
+
+
+def _read_manifests(paths: List[str]) -> List[tuple]:
+    rows = []
+    for path in paths:
+        with open(path, 'r', newline='') as f:
+            rows.extend(tuple(row) for row in csv.reader(f))
+    return rows
+
+
+def check_stage_output(result: dict, expected_restore: Dict[Tuple[str, str], str], duplicated_keys: Set[str],
+                       expected_delete: Set[Tuple[str, str]]) -> List[str]:
+    """Compares manifests written by a stage with expected rows, returns a list of errors."""
+    rows = _read_manifests(result['manifests'])
+    errors = []
+    if result['stage'] == "split":
+        if len(rows) != len(expected_delete) or set(rows) != expected_delete:
+            errors.append(f"{len(set(rows) ^ expected_delete)} delete rows differ from expected")
+        return errors
+
+    restored = {(bucket_name, key): version for bucket_name, key, version in rows}
+    if len(restored) != len(rows):
+        errors.append(f"{len(rows) - len(restored)} keys written more than once")
+    different = [k for k in expected_restore.keys() | restored.keys() if restored.get(k) != expected_restore.get(k)]
+    if different:
+        errors.append(f"{len(different)} restore rows differ from expected, e.g. {different[:3]}")
+    with open(result['duplicated_rows_file'], 'r', newline='') as f:
+        found_duplicated_keys = {row[1] for row in csv.reader(f)}
+    if found_duplicated_keys != duplicated_keys:
+        errors.append(f"{len(found_duplicated_keys ^ duplicated_keys)} keys with duplicated versions differ")
+    return errors
+
+
+@app.command()
+def suite(
+        buckets: int = typer.Option(20, help="Number of distinct buckets in results."),
+        keys: int = typer.Option(100_000, help="Number of distinct keys in results."),
+        versions_per_key: int = typer.Option(2, help="Versions of each key in restore results."),
+        collision_rate: float = typer.Option(0.01, help="Fraction of keys with two versions with same sequencer."),
+        url_encoded_rate: float = typer.Option(0.1, help="Fraction of keys with URL encoded chars."),
+        stages: str = typer.Option(','.join(SUITE_STAGES), help="Comma separated list of stages to run."),
+        work_dir: str = typer.Option(None, help="Folder for temporary files, default system temp folder."),
+        output: str = typer.Option(None, help="If set, results are written to this JSON file.")
+):
+    """
+    Runs manifest generation stages on synthetic Athena results and checks their output.
+    Every stage runs in a new process, so peak RSS is measured for the stage only (imports included).
+    Pipeline stages run do_action with local stand-ins of S3, Athena and S3 Control, reading results with each
+    results source.
+    Exits with code 1 if a stage writes wrong manifests.
+    """
+    selected_stages = [s for s in stages.split(',') if s]
+    invalid_stages = set(selected_stages) - set(SUITE_STAGES)
+    if invalid_stages:
+        raise typer.BadParameter(f"Invalid stages {invalid_stages}, allowed values: {', '.join(SUITE_STAGES)}")
+
+    # Stages run in processes forked by a fork server started while this process is small, so they don't inherit
+    # RSS of expected results
+    context = multiprocessing.get_context('forkserver')
+    multiprocessing.forkserver.ensure_running()
+
+    results = []
+    failed = False
+    with tempfile.TemporaryDirectory(dir=work_dir, prefix='pitr-benchmark-') as tmp:
+        restore_rows, expected_restore, duplicated_keys = generate_restore_results(
+            os.path.join(tmp, RESTORE_RESULTS_FILE), buckets, keys, versions_per_key, collision_rate,
+            url_encoded_rate)
+        delete_rows, expected_delete = generate_delete_results(os.path.join(tmp, DELETE_RESULTS_FILE), buckets, keys,
+                                                               url_encoded_rate)
+        typer.echo(f"Generated {restore_rows:,} restore rows and {delete_rows:,} delete rows, "
+                   f"{len(duplicated_keys):,} keys with duplicated versions")
+
+        for stage in selected_stages:
+            rows = delete_rows if stage == "split" else restore_rows
+            with context.Pool(1) as pool:
+                result = pool.apply(_run_stage, (stage, tmp, rows))
+            errors = check_stage_output(result, expected_restore, duplicated_keys, expected_delete)
+            failed = failed or bool(errors)
+            _report(stage, rows, result['elapsed'],
+                    f", peak RSS {result['peak_rss_mb']:.0f} MB "
+                    f"(+{result['peak_rss_mb'] - result['rss_before_mb']:.0f} MB), "
+                    f"{len(result['manifests'])} manifests, {'FAILED: ' + '; '.join(errors) if errors else 'OK'}")
+            results.append({k: v for k, v in result.items() if k not in ['manifests', 'duplicated_rows_file']}
+                           | {'manifests': len(result['manifests']), 'rows_per_second': rows / result['elapsed'],
+                              'errors': errors})
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'parameters': {'buckets': buckets, 'keys': keys, 'versions_per_key': versions_per_key,
+                                      'collision_rate': collision_rate, 'url_encoded_rate': url_encoded_rate},
+                       'stages': results}, f, indent=2)
+    if failed:
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
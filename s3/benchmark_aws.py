@@ -0,0 +1,134 @@
+"""
+Local stand-ins of the AWS clients used by s3.pitr, so the manifest generation path runs offline in benchmarks.
+
+S3 objects are files under a root folder (root/bucket/key). Athena queries don't run, every query succeeds
+immediately with the content of a local results CSV.
+"""
+import csv
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+from typing import Dict, Iterator, List
+
+from s3 import pitr
+
+
+class LocalS3Client:
+    """Subset of S3 client API used by pitr, backed by files under root."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, key)
+
+    def put_object(self, Bucket: str, Key: str, Body) -> Dict[str, str]:
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        md5 = hashlib.md5()
+        with open(path, 'wb') as f:
+            for chunk in iter(lambda: Body.read(1024 * 1024), b''):
+                md5.update(chunk)
+                f.write(chunk)
+        return {'ETag': f'"{md5.hexdigest()}"'}
+
+    def upload_file(self, file_path: str, bucket: str, key: str):
+        with open(file_path, 'rb') as f:
+            self.put_object(Bucket=bucket, Key=key, Body=f)
+
+    def head_object(self, Bucket: str, Key: str) -> Dict[str, str]:
+        md5 = hashlib.md5()
+        with open(self._path(Bucket, Key), 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                md5.update(chunk)
+        return {'ETag': f'"{md5.hexdigest()}"'}
+
+    def download_file(self, bucket: str, key: str, local_path: str):
+        shutil.copyfile(self._path(bucket, key), local_path)
+
+    def get_object(self, Bucket: str, Key: str) -> Dict[str, object]:
+        return {'Body': open(self._path(Bucket, Key), 'rb')}
+
+
+class _LocalQueryResultsPaginator:
+    def __init__(self, athena_client: 'LocalAthenaClient'):
+        self.athena_client = athena_client
+
+    def paginate(self, QueryExecutionId: str, PaginationConfig: Dict[str, int] = None) -> Iterator[dict]:
+        """Yields pages of results CSV in GetQueryResults format, first row of first page contains column names."""
+        page_size = (PaginationConfig or {}).get('PageSize', 1000)
+        with open(self.athena_client.results_path, 'r', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            column_info = [{'Name': name} for name in header]
+            rows = [header]
+            for row in reader:
+                rows.append(row)
+                if len(rows) == page_size:
+                    yield self._page(column_info, rows)
+                    rows = []
+            if rows:
+                yield self._page(column_info, rows)
+
+    @staticmethod
+    def _page(column_info: List[dict], rows: List[list]) -> dict:
+        return {'ResultSet': {'ResultSetMetadata': {'ColumnInfo': column_info},
+                              'Rows': [{'Data': [{'VarCharValue': v} for v in row]} for row in rows]}}
+
+
+class LocalAthenaClient:
+    """Athena client whose queries succeed immediately, results are copied from results_path to output location."""
+
+    def __init__(self, s3_client: LocalS3Client, results_path: str):
+        self.s3_client = s3_client
+        self.results_path = results_path
+        self.query_execution_ids = []
+
+    def start_query_execution(self, QueryString: str, QueryExecutionContext: dict, ResultConfiguration: dict,
+                              **kwargs) -> Dict[str, str]:
+        query_execution_id = str(uuid.uuid4())
+        output_location = f"{ResultConfiguration['OutputLocation']}{query_execution_id}.csv"
+        bucket, _, key = output_location.removeprefix('s3://').partition('/')
+        with open(self.results_path, 'rb') as f:
+            self.s3_client.put_object(Bucket=bucket, Key=key, Body=f)
+        self.query_execution_ids.append((query_execution_id, output_location))
+        return {'QueryExecutionId': query_execution_id}
+
+    def get_query_execution(self, QueryExecutionId: str) -> dict:
+        output_location = dict(self.query_execution_ids)[QueryExecutionId]
+        return {'QueryExecution': {'Status': {'State': 'SUCCEEDED'},
+                                   'ResultConfiguration': {'OutputLocation': output_location},
+                                   'Statistics': {}}}
+
+    def get_paginator(self, operation_name: str) -> _LocalQueryResultsPaginator:
+        return _LocalQueryResultsPaginator(self)
+
+
+class LocalS3ControlClient:
+    """Records created S3 Batch Operations jobs."""
+
+    def __init__(self):
+        self.jobs = []
+        self._lock = threading.Lock()
+
+    def create_job(self, **kwargs) -> Dict[str, str]:
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self.jobs.append({'JobId': job_id, **kwargs})
+        return {'JobId': job_id}
+
+
+def install_local_clients(root: str, results_path: str) -> Dict[str, object]:
+    """Replaces AWS clients of s3.pitr with local stand-ins, returns the installed clients by name."""
+    s3_client = LocalS3Client(root)
+    clients = {
+        's3_client': s3_client,
+        'athena_client': LocalAthenaClient(s3_client, results_path),
+        's3control_client': LocalS3ControlClient()
+    }
+    for name, client in clients.items():
+        setattr(pitr, name, client)
+    pitr.get_account_id = lambda: '000000000000'
+    return clients
@@ -0,0 +1,125 @@
+"""
+Parallel audit of S3 bucket settings.
+
+The region of each bucket is resolved once and cached, and settings are read through a client of that region, so that
+buckets outside the default region don't pay a redirect for every call. Results are written to a JSON Lines or CSV
+file as soon as each bucket is audited.
+"""
+import csv
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional
+
+from botocore.exceptions import ClientError
+
+from utils.aws import AWSHelper
+from utils.logger import get_logger
+from utils.retry import call_with_retry
+
+logger = get_logger(__name__)
+
+OUTPUT_FORMATS = ["json", "csv"]
+AUDIT_FIELDNAMES = ["bucket", "region", "versioning", "mfa_delete", "lifecycle_rules", "eventbridge",
+                    "queue_notifications", "topic_notifications", "lambda_notifications", "error"]
+
+_bucket_regions: Dict[str, str] = {}
+_bucket_regions_lock = threading.Lock()
+
+
+def get_bucket_region(bucket_name: str, known_region: Optional[str] = None) -> str:
+    """Returns the region of a bucket, cached for the process. known_region is cached as is, e.g. the BucketRegion
+    returned by list_buckets."""
+    region = _bucket_regions.get(bucket_name)
+    if region:
+        return region
+    if not known_region:
+        response = call_with_retry(AWSHelper.get_client('s3').get_bucket_location, Bucket=bucket_name)
+        # Buckets in us-east-1 have no location constraint, EU is the legacy name of eu-west-1
+        location = response.get('LocationConstraint')
+        known_region = {None: 'us-east-1', '': 'us-east-1', 'EU': 'eu-west-1'}.get(location, location)
+    with _bucket_regions_lock:
+        _bucket_regions[bucket_name] = known_region
+    return known_region
+
+
+def _get_optional(function, missing_error_code: str, **kwargs) -> Optional[Dict]:
+    try:
+        return call_with_retry(function, **kwargs)
+    except ClientError as e:
+        if e.response['Error']['Code'] == missing_error_code:
+            return None
+        raise
+
+
+def audit_bucket(bucket_name: str, known_region: Optional[str] = None) -> Dict:
+    """Returns versioning, MFA delete, lifecycle and notification settings of a bucket, with the error if they
+    couldn't be read. Errors are never raised, so they don't stop the audit of other buckets."""
+    result = {'bucket': bucket_name, 'region': None, 'error': None}
+    try:
+        region = get_bucket_region(bucket_name, known_region)
+        result['region'] = region
+        s3_client = AWSHelper.get_client('s3', region_name=region)
+
+        versioning = call_with_retry(s3_client.get_bucket_versioning, Bucket=bucket_name)
+        result['versioning'] = versioning.get('Status', 'NotEnabled')
+        result['mfa_delete'] = versioning.get('MFADelete', 'Disabled')
+
+        lifecycle = _get_optional(s3_client.get_bucket_lifecycle_configuration, 'NoSuchLifecycleConfiguration',
+                                  Bucket=bucket_name)
+        result['lifecycle_rules'] = len(lifecycle['Rules']) if lifecycle else 0
+
+        notifications = call_with_retry(s3_client.get_bucket_notification_configuration, Bucket=bucket_name)
+        result['eventbridge'] = 'EventBridgeConfiguration' in notifications
+        result['queue_notifications'] = len(notifications.get('QueueConfigurations', []))
+        result['topic_notifications'] = len(notifications.get('TopicConfigurations', []))
+        result['lambda_notifications'] = len(notifications.get('LambdaFunctionConfigurations', []))
+    except ClientError as e:
+        result['error'] = f"{e.response['Error']['Code']}: {e}"
+    except Exception as e:
+        # e.g. EndpointConnectionError or ReadTimeoutError, a bucket failure must not stop the audit of the others
+        result['error'] = str(e)
+    return result
+
+
+def audit_buckets(buckets: List[Dict], max_workers: int = 20) -> Iterator[Dict]:
+    """
+    Audits buckets in parallel, yielding results in completion order.
+
+    Args:
+        buckets: Buckets as returned by list_buckets, BucketRegion is used when present.
+        max_workers: Max number of buckets audited in parallel.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(audit_bucket, bucket['Name'], bucket.get('BucketRegion')) for bucket in buckets]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+class AuditWriter:
+    """Writes audit results to a JSON Lines or CSV file, one line per bucket as soon as it is written."""
+
+    def __init__(self, path: str, output_format: str):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Invalid output format '{output_format}', allowed values: {', '.join(OUTPUT_FORMATS)}")
+        self.file = open(path, 'w', newline='')
+        self.csv_writer = None
+        if output_format == "csv":
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=AUDIT_FIELDNAMES)
+            self.csv_writer.writeheader()
+
+    def write(self, result: Dict):
+        if self.csv_writer:
+            self.csv_writer.writerow(result)
+        else:
+            self.file.write(json.dumps(result) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
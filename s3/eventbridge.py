@@ -1,12 +1,16 @@
+import json
+from datetime import datetime
+from typing import Dict, List, Optional
+
 import typer
-from botocore.exceptions import ClientError
 from utils.aws import AWSHelper
+from utils.bulk import bulk_apply
 from utils.s3 import get_buckets_by_tag
 
 
 def set_eventbridge_notification(bucket_name: str, enable: bool):
     """
-    Enables or disables EventBridge notifications for a specific bucket.
+    Enables or disables EventBridge notifications for a specific bucket, raises ClientError on failure.
 
     Args:
         bucket_name: The S3 bucket name.
@@ -14,9 +18,6 @@ def set_eventbridge_notification(bucket_name: str, enable: bool):
     """
     s3_client = AWSHelper.get_client("s3")
 
-    action_text = "enabled" if enable else "disabled"
-    human_action = "Enabling" if enable else "Disabling"
-
     if enable:
         # To enable, we add an EventBridgeConfiguration. This sends all events.
         notification_config = {'EventBridgeConfiguration': {}}
@@ -25,29 +26,92 @@ def set_eventbridge_notification(bucket_name: str, enable: bool):
         # which removes ALL notification settings (SQS, SNS, Lambda, EventBridge).
         notification_config = {}
 
-    try:
-        s3_client.put_bucket_notification_configuration(
-            Bucket=bucket_name,
-            NotificationConfiguration=notification_config
-        )
-        typer.secho(f"👍 EventBridge integration {action_text} for bucket: {bucket_name}", fg=typer.colors.GREEN)
-    except ClientError as e:
-        typer.secho(f"👎 Failed {human_action.lower()} EventBridge integration for {bucket_name}: {e}", fg=typer.colors.RED)
+    s3_client.put_bucket_notification_configuration(
+        Bucket=bucket_name,
+        NotificationConfiguration=notification_config
+    )
+
+
+def get_notification_configuration(bucket_name: str) -> Dict:
+    """Returns the notification configuration of a bucket, without response metadata."""
+    s3_client = AWSHelper.get_client("s3")
+    response = s3_client.get_bucket_notification_configuration(Bucket=bucket_name)
+    return {key: value for key, value in response.items() if key != 'ResponseMetadata'}
+
+
+def put_notification_configuration(bucket_name: str, notification_config: Dict):
+    s3_client = AWSHelper.get_client("s3")
+    s3_client.put_bucket_notification_configuration(
+        Bucket=bucket_name,
+        NotificationConfiguration=notification_config,
+        # Only EventBridge is toggled, the other destinations were already validated when they were configured
+        SkipDestinationValidation=True
+    )
+
+
+def merge_eventbridge_notification(notification_config: Dict, enable: bool) -> Dict:
+    """Returns notification_config with EventBridge enabled or disabled, leaving SQS, SNS and Lambda targets as is."""
+    merged = {key: value for key, value in notification_config.items() if key != 'EventBridgeConfiguration'}
+    if enable:
+        merged['EventBridgeConfiguration'] = {}
+    return merged
+
+
+def set_eventbridge_notifications_merged(buckets: List[str], enable: bool, max_workers: int,
+                                         result_file: Optional[str], snapshot_file: Optional[str]):
+    """
+    Enables or disables EventBridge on buckets keeping their other notifications: configurations are read in
+    parallel, and only buckets whose configuration changes are written back, after saving the configuration before
+    and after the change to snapshot_file for rollback-notifications.
+    """
+    action = "Enabling" if enable else "Disabling"
+    outcomes = bulk_apply(get_notification_configuration, buckets, max_workers,
+                          "Reading notification configurations")
+    snapshot = {}
+    for outcome in outcomes:
+        if outcome['status'] != 'succeeded':
+            continue
+        before = outcome['result']
+        after = merge_eventbridge_notification(before, enable)
+        if after != before:
+            snapshot[outcome['resource']] = {'before': before, 'after': after}
+    typer.echo(f"{len(snapshot)} buckets to update, {len(buckets) - len(snapshot)} already up to date or unreadable.")
+    if not snapshot:
+        return
+
+    snapshot_file = snapshot_file or f"notifications_snapshot_{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+    with open(snapshot_file, 'w') as f:
+        json.dump({'buckets': snapshot}, f, indent=2)
+    typer.echo(f"Configurations before and after the change saved to {snapshot_file}, "
+               f"use rollback-notifications to restore them.")
+    bulk_apply(lambda bucket: put_notification_configuration(bucket, snapshot[bucket]['after']), list(snapshot),
+               max_workers, f"{action} EventBridge integration", result_file)
 
 
 def enable_notifications(
     tag_key: str = typer.Option(..., "--tag-key", "-k", help="The tag key to select buckets."),
-    tag_value: str = typer.Option(..., "--tag-value", "-v", help="The tag value to select buckets.")
+    tag_value: str = typer.Option(..., "--tag-value", "-v", help="The tag value to select buckets."),
+    max_workers: int = typer.Option(20, "--max-workers", help="Max number of buckets updated in parallel."),
+    result_file: str = typer.Option(None, "--result-file", help="JSON Lines file with the outcome for each bucket."),
+    merge: bool = typer.Option(True, "--merge/--overwrite",
+                               help="Only toggle EventBridge keeping the other notifications, or overwrite the "
+                                    "whole notification configuration."),
+    snapshot_file: str = typer.Option(None, "--snapshot-file",
+                                      help="With --merge, file where configurations before and after the change are "
+                                           "saved, default notifications_snapshot_{time}.json")
 ):
     """
-    Enables sending all bucket events to Amazon EventBridge.
+    Enables sending all bucket events to Amazon EventBridge, updating buckets in parallel.
     """
     typer.echo(f"▶️  Starting process to enable EventBridge integration...")
     buckets_to_update = get_buckets_by_tag(tag_key, tag_value)
 
     if buckets_to_update and typer.confirm(f"Are you sure you want to ENABLE EventBridge notifications for {len(buckets_to_update)} buckets?"):
-        for bucket in buckets_to_update:
-            set_eventbridge_notification(bucket, enable=True)
+        if merge:
+            set_eventbridge_notifications_merged(buckets_to_update, True, max_workers, result_file, snapshot_file)
+        else:
+            bulk_apply(lambda bucket: set_eventbridge_notification(bucket, enable=True), buckets_to_update,
+                       max_workers, "Enabling EventBridge integration", result_file)
         typer.echo("\n🎉 Process completed!")
     elif not buckets_to_update:
         typer.echo("🚫 No buckets to update. Operation finished.")
@@ -57,24 +121,41 @@ def enable_notifications(
 
 def disable_notifications(
     tag_key: str = typer.Option(..., "--tag-key", "-k", help="The tag key to select buckets."),
-    tag_value: str = typer.Option(..., "--tag-value", "-v", help="The tag value to select buckets.")
+    tag_value: str = typer.Option(..., "--tag-value", "-v", help="The tag value to select buckets."),
+    max_workers: int = typer.Option(20, "--max-workers", help="Max number of buckets updated in parallel."),
+    result_file: str = typer.Option(None, "--result-file", help="JSON Lines file with the outcome for each bucket."),
+    merge: bool = typer.Option(True, "--merge/--overwrite",
+                               help="Only toggle EventBridge keeping the other notifications, or overwrite the "
+                                    "whole notification configuration."),
+    snapshot_file: str = typer.Option(None, "--snapshot-file",
+                                      help="With --merge, file where configurations before and after the change are "
+                                           "saved, default notifications_snapshot_{time}.json")
 ):
     """
-    Disables EventBridge integration by removing ALL notification configurations from the bucket.
+    Disables EventBridge integration, updating buckets in parallel. With --overwrite, ALL notification
+    configurations are removed from the bucket.
     """
     typer.echo(f"▶️  Starting process to disable EventBridge integration...")
     buckets_to_update = get_buckets_by_tag(tag_key, tag_value)
 
     if buckets_to_update:
-        # The confirmation message includes a clear warning about the side effects.
-        warning_message = (
-            f"Are you sure you want to DISABLE EventBridge integration for {len(buckets_to_update)} buckets?\n"
-            f"{typer.style('WARNING', fg=typer.colors.YELLOW, bold=True)}: This action will remove ALL notification configurations "
-            f"(e.g., SQS, SNS, Lambda) from these buckets."
-        )
+        if merge:
+            warning_message = (
+                f"Are you sure you want to DISABLE EventBridge integration for {len(buckets_to_update)} buckets?"
+            )
+        else:
+            # The confirmation message includes a clear warning about the side effects.
+            warning_message = (
+                f"Are you sure you want to DISABLE EventBridge integration for {len(buckets_to_update)} buckets?\n"
+                f"{typer.style('WARNING', fg=typer.colors.YELLOW, bold=True)}: This action will remove ALL notification configurations "
+                f"(e.g., SQS, SNS, Lambda) from these buckets."
+            )
         if typer.confirm(warning_message):
-            for bucket in buckets_to_update:
-                set_eventbridge_notification(bucket, enable=False)
+            if merge:
+                set_eventbridge_notifications_merged(buckets_to_update, False, max_workers, result_file, snapshot_file)
+            else:
+                bulk_apply(lambda bucket: set_eventbridge_notification(bucket, enable=False), buckets_to_update,
+                           max_workers, "Disabling EventBridge integration", result_file)
             typer.echo("\n🎉 Process completed!")
         else:
             typer.echo("🚫 Operation cancelled.")
@@ -82,9 +163,33 @@ def disable_notifications(
         typer.echo("🚫 No buckets to update. Operation finished.")
 
 
+def rollback_notifications(
+    snapshot_file: str = typer.Argument(..., help="Snapshot file saved by enable-notifications or "
+                                                  "disable-notifications."),
+    max_workers: int = typer.Option(20, "--max-workers", help="Max number of buckets updated in parallel."),
+    result_file: str = typer.Option(None, "--result-file", help="JSON Lines file with the outcome for each bucket.")
+):
+    """
+    Restores the notification configurations of buckets saved in a snapshot file before a change.
+    """
+    with open(snapshot_file) as f:
+        snapshot = json.load(f)['buckets']
+
+    if snapshot and typer.confirm(f"Are you sure you want to restore the notification configuration of "
+                                  f"{len(snapshot)} buckets?"):
+        bulk_apply(lambda bucket: put_notification_configuration(bucket, snapshot[bucket]['before']), list(snapshot),
+                   max_workers, "Restoring notification configurations", result_file)
+        typer.echo("\n🎉 Process completed!")
+    elif not snapshot:
+        typer.echo("🚫 No buckets to restore. Operation finished.")
+    else:
+        typer.echo("🚫 Operation cancelled.")
+
+
 if __name__ == "__main__":
     app = typer.Typer()
 
     # Add commands here
     app.command()(enable_notifications)
     app.command()(disable_notifications)
+    app.command()(rollback_notifications)
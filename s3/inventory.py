@@ -2,8 +2,12 @@ import typer
 from botocore.exceptions import ClientError
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 from utils.s3 import get_buckets_by_tag
 from utils.aws import AWSHelper
+from utils.bulk import bulk_apply
+from utils.retry import call_with_retry
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -12,6 +16,7 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 def add_bucket_policy_for_inventory(destination_bucket: str, source_account_id: str):
     """
     Adds the required policy to the destination bucket to allow S3 to write inventory reports.
+    The policy isn't written again if the bucket already has it.
     """
     s3 = AWSHelper.get_client('s3')
     policy = {
@@ -34,6 +39,16 @@ def add_bucket_policy_for_inventory(destination_bucket: str, source_account_id:
             }
         ]
     }
+    try:
+        current_policy = json.loads(s3.get_bucket_policy(Bucket=destination_bucket)['Policy'])
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchBucketPolicy':
+            logging.error(f"Failed to read policy of bucket '{destination_bucket}': {e}")
+            raise typer.Exit(code=1)
+        current_policy = None
+    if current_policy == policy:
+        logging.info(f"Destination bucket '{destination_bucket}' already has the inventory policy.")
+        return
     try:
         s3.put_bucket_policy(Bucket=destination_bucket, Policy=json.dumps(policy))
         logging.info(f"Policy successfully applied to destination bucket '{destination_bucket}'.")
@@ -42,6 +57,87 @@ def add_bucket_policy_for_inventory(destination_bucket: str, source_account_id:
         raise typer.Exit(code=1)
 
 
+def get_inventory_configuration(bucket_name: str, inventory_id: str) -> Optional[Dict]:
+    """Returns the inventory configuration with id inventory_id of a bucket, or None if it doesn't exist."""
+    s3 = AWSHelper.get_client('s3')
+    try:
+        response = call_with_retry(s3.get_bucket_inventory_configuration, Bucket=bucket_name, Id=inventory_id)
+        return response['InventoryConfiguration']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchConfiguration':
+            return None
+        raise
+
+
+def normalize_inventory_configuration(configuration: Dict) -> Dict:
+    """Returns configuration in a form comparable with the one returned by S3, where optional fields have no order."""
+    normalized = dict(configuration)
+    normalized['OptionalFields'] = sorted(configuration.get('OptionalFields', []))
+    return normalized
+
+
+def read_inventory_configurations(bucket_names: List[str], inventory_id: str, max_workers: int) -> Dict:
+    """
+    Reads the inventory configuration of buckets in parallel.
+    Returns a dict of bucket name -> configuration, None if the bucket has no configuration, or the error raised.
+    """
+    def read(bucket_name: str):
+        try:
+            return get_inventory_configuration(bucket_name, inventory_id)
+        except ClientError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(bucket_names, executor.map(read, bucket_names)))
+
+
+def get_inventory_configuration_changes(current_configurations: Dict, desired_configurations: Dict) -> Dict:
+    """
+    Compares current and desired inventory configurations of buckets, a None desired configuration means removal.
+    Returns a dict of bucket name -> desired configuration for the buckets that need a change.
+    Buckets whose current configuration couldn't be read are logged and skipped.
+    """
+    changes = {}
+    for bucket_name, desired in desired_configurations.items():
+        current = current_configurations[bucket_name]
+        if isinstance(current, Exception):
+            logging.error(f"Failed to read inventory configuration of bucket '{bucket_name}', skipped: {current}")
+            continue
+        if desired is None:
+            if current is not None:
+                changes[bucket_name] = None
+        elif current is None or normalize_inventory_configuration(current) != \
+                normalize_inventory_configuration(desired):
+            changes[bucket_name] = desired
+    return changes
+
+
+def apply_inventory_configuration_changes(changes: Dict, inventory_id: str, max_workers: int,
+                                          result_file: Optional[str] = None) -> int:
+    """Writes, or removes for None configurations, the inventory configuration of buckets in parallel.
+    Returns the number of failed buckets."""
+    s3 = AWSHelper.get_client('s3')
+
+    def apply(bucket_name: str) -> str:
+        configuration = changes[bucket_name]
+        if configuration is not None:
+            s3.put_bucket_inventory_configuration(Bucket=bucket_name, Id=inventory_id,
+                                                  InventoryConfiguration=configuration)
+            return "enabled"
+        try:
+            s3.delete_bucket_inventory_configuration(Bucket=bucket_name, Id=inventory_id)
+            return "removed"
+        except ClientError as e:
+            # Removed since it was read
+            if e.response['Error']['Code'] == 'NoSuchConfiguration':
+                return "not found"
+            raise
+
+    label = "Updating inventory configurations"
+    outcomes = bulk_apply(apply, list(changes), max_workers, label, result_file)
+    return sum(outcome['status'] == 'failed' for outcome in outcomes)
+
+
 def add_inventory_configuration(
         inventory_destination_bucket: str = typer.Option(..., "--destination-bucket", "-d",
                                                help="The S3 bucket where inventory reports will be saved."),
@@ -54,13 +150,17 @@ def add_inventory_configuration(
         ),
         tag_key: str = typer.Option(..., "--tag-key", "-k", help="The tag key to select buckets."),
         tag_value: str = typer.Option(..., "--tag-value", "-v", help="The tag value to select buckets."),
-        inventory_id: str = typer.Option("aws-script", "-i", help="The id of inventory configuration.")
+        inventory_id: str = typer.Option("aws-script", "-i", help="The id of inventory configuration."),
+        max_workers: int = typer.Option(20, "--max-workers", help="Max number of buckets read or updated in parallel."),
+        result_file: str = typer.Option(None, "--result-file", help="JSON Lines file with the outcome for each bucket.")
 ):
     """
     Enables S3 Inventory on all buckets in the account, saving reports
     to the specified destination bucket.
+
+    Current configurations are read in parallel first, and only buckets without the configuration, or with a
+    different one, are updated: running the command again makes no writes.
     """
-    s3 = AWSHelper.get_client('s3')
     sts = AWSHelper.get_client('sts')
     logging.info(f"▶️ Starting process to enable inventory configuration...")
 
@@ -76,87 +176,80 @@ def add_inventory_configuration(
     logging.info(f"Object version mode: '{versions_to_include}'")
 
     source_buckets = get_buckets_by_tag(tag_key=tag_key, tag_value=tag_value)
+    if inventory_destination_bucket in source_buckets:
+        logging.warning(f"Skipping destination bucket '{inventory_destination_bucket}'.")
+        source_buckets.remove(inventory_destination_bucket)
 
-    if source_buckets and typer.confirm(f"Are you sure you want to add inventory configuration with id '{inventory_id}' for {len(source_buckets)} buckets?"):
-        add_bucket_policy_for_inventory(inventory_destination_bucket, account_id)
+    if not source_buckets:
+        typer.echo("🚫 No buckets to update. Operation finished.")
+        return
 
-        for bucket_name in source_buckets:
-            if bucket_name == inventory_destination_bucket:
-                logging.warning(f"Skipping destination bucket '{bucket_name}'.")
-                continue
-
-            logging.info(f"Enabling inventory for bucket: '{bucket_name}'...")
-
-            inventory_configuration = {
-                "Destination": {
-                    "S3BucketDestination": {"AccountId": account_id, "Bucket": f"arn:aws:s3:::{inventory_destination_bucket}",
-                                            "Format": "CSV", "Prefix": f"{prefix}/{bucket_name}"}},
-                "IsEnabled": True,
-                "Id": inventory_id,
-                "IncludedObjectVersions": versions_to_include,
-                "OptionalFields": ["LastModifiedDate"],
-                "Schedule": {"Frequency": "Weekly"}
-            }
+    desired_configurations = {
+        bucket_name: {
+            "Destination": {
+                "S3BucketDestination": {"AccountId": account_id, "Bucket": f"arn:aws:s3:::{inventory_destination_bucket}",
+                                        "Format": "CSV", "Prefix": f"{prefix}/{bucket_name}"}},
+            "IsEnabled": True,
+            "Id": inventory_id,
+            "IncludedObjectVersions": versions_to_include,
+            "OptionalFields": ["LastModifiedDate", "Size"],
+            "Schedule": {"Frequency": "Weekly"}
+        }
+        for bucket_name in source_buckets
+    }
+    logging.info(f"Reading inventory configuration '{inventory_id}' of {len(source_buckets)} buckets...")
+    current_configurations = read_inventory_configurations(source_buckets, inventory_id, max_workers)
+    changes = get_inventory_configuration_changes(current_configurations, desired_configurations)
+    created = sum(current_configurations[bucket_name] is None for bucket_name in changes)
+    logging.info(f"{created} buckets without the configuration, {len(changes) - created} with a different one, "
+                 f"{len(source_buckets) - len(changes)} up to date or unreadable.")
 
-            try:
-                s3.put_bucket_inventory_configuration(Bucket=bucket_name, Id=inventory_id,
-                                                      InventoryConfiguration=inventory_configuration)
-                typer.secho(f"👍 Inventory successfully enabled for bucket: {bucket_name}",
-                            fg=typer.colors.GREEN)
-
-                logging.info(f"Inventory successfully enabled for '{bucket_name}'.")
-            except ClientError as e:
-                if e.response['Error']['Code'] == 'InvalidRequest' and 'already exists' in str(e):
-                    typer.secho(f"An inventory configuration with ID '{inventory_id}' already exists for bucket '{bucket_name}'. Skipping.", fg=typer.colors.YELLOW)
-                else:
-                    typer.secho(f"👎 Error enabling inventory for '{bucket_name}': {e}", fg=typer.colors.RED)
-    elif not source_buckets:
-        typer.echo("🚫 No buckets to update. Operation finished.")
+    if not changes:
+        typer.echo("✅ All buckets are up to date. Operation finished.")
+        return
+    if typer.confirm(f"Are you sure you want to add inventory configuration with id '{inventory_id}' for "
+                     f"{len(changes)} buckets?"):
+        add_bucket_policy_for_inventory(inventory_destination_bucket, account_id)
+        failed = apply_inventory_configuration_changes(changes, inventory_id, max_workers, result_file)
+        typer.secho(f"\nEnable operation completed! 🚀 Updated {len(changes) - failed} buckets, {failed} failed.",
+                    fg=typer.colors.GREEN)
     else:
         typer.echo("🚫 Operation cancelled.")
 
-        typer.secho("\nEnable operation completed! 🚀", fg=typer.colors.GREEN)
-
 
 def remove_inventory_configuration(
         tag_key: str = typer.Option(..., "--tag-key", "-k", help="The tag key to select buckets."),
         tag_value: str = typer.Option(..., "--tag-value", "-v", help="The tag value to select buckets."),
-        inventory_id: str = typer.Option("aws-script", "-i", help="The id of inventory configuration.")
+        inventory_id: str = typer.Option("aws-script", "-i", help="The id of inventory configuration."),
+        max_workers: int = typer.Option(20, "--max-workers", help="Max number of buckets read or updated in parallel."),
+        result_file: str = typer.Option(None, "--result-file", help="JSON Lines file with the outcome for each bucket.")
     ):
     """
-    Removes the S3 Inventory configuration from all buckets in the account,
-    assuming the configuration ID follows the 'inventory-config-{bucket_name}' format.
-    """
-    s3 = AWSHelper.get_client('s3')
-
-    bucket_names = get_buckets_by_tag(tag_key=tag_key, tag_value=tag_value)
-    logging.info(f"Found {len(bucket_names)} buckets to check for inventory removal.")
+    Removes the S3 Inventory configuration with id inventory_id from all buckets with the tag.
 
+    Current configurations are read in parallel first, and only buckets that have the configuration are updated.
+    """
     source_buckets = get_buckets_by_tag(tag_key=tag_key, tag_value=tag_value)
+    logging.info(f"Found {len(source_buckets)} buckets to check for inventory removal.")
 
-    if source_buckets and typer.confirm(f"Are you sure you want to remove inventory configuration with id '{inventory_id}' for {len(source_buckets)} buckets?"):
-
-        for bucket_name in source_buckets:
-
-            logging.info(f"Attempting to remove configuration '{inventory_id}' from bucket '{bucket_name}'...")
-
-            try:
-                s3.delete_bucket_inventory_configuration(
-                    Bucket=bucket_name,
-                    Id=inventory_id
-                )
-                logging.info(f"Inventory configuration '{inventory_id}' successfully removed from '{bucket_name}'.")
-            except ClientError as e:
-                if e.response['Error']['Code'] == 'NoSuchConfiguration':
-                    logging.warning(
-                        f"No configuration with ID '{inventory_id}' found for bucket '{bucket_name}'. Skipping.")
-                else:
-                    logging.error(f"Error during inventory removal from bucket '{bucket_name}': {e}")
-    elif not source_buckets:
+    if not source_buckets:
         typer.echo("🚫 No buckets to update. Operation finished.")
+        return
+
+    current_configurations = read_inventory_configurations(source_buckets, inventory_id, max_workers)
+    changes = get_inventory_configuration_changes(current_configurations,
+                                                  {bucket_name: None for bucket_name in source_buckets})
+    logging.info(f"{len(changes)} buckets have configuration '{inventory_id}'.")
+
+    if not changes:
+        typer.echo("✅ No bucket has the configuration. Operation finished.")
+    elif typer.confirm(f"Are you sure you want to remove inventory configuration with id '{inventory_id}' for "
+                       f"{len(changes)} buckets?"):
+        failed = apply_inventory_configuration_changes(changes, inventory_id, max_workers, result_file)
+        typer.secho(f"\nRemove operation completed! ✨ Updated {len(changes) - failed} buckets, {failed} failed.",
+                    fg=typer.colors.GREEN)
     else:
         typer.echo("🚫 Operation cancelled.")
-    typer.secho("\nRemove operation completed! ✨", fg=typer.colors.GREEN)
 
 
 if __name__ == "__main__":
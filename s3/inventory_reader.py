@@ -0,0 +1,299 @@
+"""
+Reader of S3 Inventory reports and local index of object versions.
+
+Reports are found as configured by add-inventory-configuration: S3 delivers them under
+{prefix}/{bucket}/{bucket}/{inventory id}/{creation time}/ in the destination bucket, with a manifest.json listing the
+gzip CSV files of the report. The files are streamed in parallel into a SQLite index of key -> versions, with last
+modified time, size and delete marker flag, so that restores and audits query it locally instead of listing versions.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import unquote_plus
+
+import typer
+from botocore.exceptions import ClientError
+
+from utils.aws import AWSHelper
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Inventory reports are delivered under folders named after their creation time, e.g. 2025-05-30T01-00Z/
+_DATE_FOLDER_REGEX = re.compile(r".*/\d{4}-\d{2}-\d{2}T\d{2}-\d{2}Z/$")
+# LastModifiedDate of inventory reports (e.g. 2025-05-30T04:00:00.000Z) is stored as is in the index, since it sorts
+# as the time it represents
+INVENTORY_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+REQUIRED_COLUMNS = {'Key', 'VersionId', 'IsLatest', 'IsDeleteMarker', 'LastModifiedDate'}
+INSERT_BATCH_SIZE = 10000
+
+# Version tuple stored in the index
+VersionRow = Tuple[str, str, int, int, str, Optional[int]]
+
+
+class InventoryManifest:
+    __slots__ = ("bucket", "key", "columns", "files")
+
+    def __init__(self, bucket: str, key: str, columns: List[str], files: List[str]):
+        self.bucket = bucket
+        self.key = key
+        self.columns = columns
+        self.files = files
+
+
+def format_inventory_time(time: datetime) -> str:
+    return f"{time.strftime(INVENTORY_TIME_FORMAT)}.{time.microsecond // 1000:03d}Z"
+
+
+def get_reports_prefix(inventory_prefix: str, bucket_name: str, inventory_id: str) -> str:
+    return f"{inventory_prefix}/{bucket_name}/{bucket_name}/{inventory_id}/"
+
+
+def find_latest_manifest(s3_client, inventory_bucket: str, inventory_prefix: str, bucket_name: str,
+                         inventory_id: str) -> Optional[str]:
+    """Returns the key of the newest manifest.json of the inventory of bucket_name, or None if there isn't any."""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    date_folders = [
+        p['Prefix']
+        for page in paginator.paginate(Bucket=inventory_bucket, Delimiter='/',
+                                       Prefix=get_reports_prefix(inventory_prefix, bucket_name, inventory_id))
+        for p in page.get('CommonPrefixes', [])
+        if _DATE_FOLDER_REGEX.match(p['Prefix'])
+    ]
+    # A folder without manifest.json is a report still being delivered
+    for date_folder in sorted(date_folders, reverse=True):
+        manifest_key = f"{date_folder}manifest.json"
+        try:
+            s3_client.head_object(Bucket=inventory_bucket, Key=manifest_key)
+            return manifest_key
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+    return None
+
+
+def read_manifest(s3_client, inventory_bucket: str, manifest_key: str) -> InventoryManifest:
+    manifest = json.loads(s3_client.get_object(Bucket=inventory_bucket, Key=manifest_key)['Body'].read())
+    columns = [column.strip() for column in manifest['fileSchema'].split(',')]
+    missing_columns = REQUIRED_COLUMNS - set(columns)
+    if missing_columns:
+        raise ValueError(f"Inventory report {manifest_key} has no column {', '.join(sorted(missing_columns))}, "
+                         f"it must include all versions and the LastModifiedDate field")
+    return InventoryManifest(inventory_bucket, manifest_key, columns, [file['key'] for file in manifest['files']])
+
+
+def iter_inventory_file(s3_client, manifest: InventoryManifest, file_key: str) -> Iterator[VersionRow]:
+    """Streams a gzip CSV file of an inventory report, yielding (key, version id, is latest, is delete marker,
+    last modified, size) tuples."""
+    key_index = manifest.columns.index('Key')
+    version_index = manifest.columns.index('VersionId')
+    latest_index = manifest.columns.index('IsLatest')
+    delete_marker_index = manifest.columns.index('IsDeleteMarker')
+    last_modified_index = manifest.columns.index('LastModifiedDate')
+    size_index = manifest.columns.index('Size') if 'Size' in manifest.columns else None
+
+    body = s3_client.get_object(Bucket=manifest.bucket, Key=file_key)['Body']
+    with io.TextIOWrapper(gzip.GzipFile(fileobj=body), encoding='utf-8', newline='') as f:
+        for values in csv.reader(f):
+            size = values[size_index] if size_index is not None else None
+            yield (
+                # Keys in inventory reports are URL encoded
+                unquote_plus(values[key_index]),
+                values[version_index],
+                values[latest_index] == 'true',
+                values[delete_marker_index] == 'true',
+                values[last_modified_index],
+                int(size) if size else None
+            )
+
+
+def iter_inventory_batches(s3_client, manifest: InventoryManifest, max_workers: int = 10,
+                           batch_size: int = INSERT_BATCH_SIZE) -> Iterator[List[VersionRow]]:
+    """
+    Streams the files of an inventory report in parallel, yielding batches of rows in the caller's thread.
+    Batches are handed over through a bounded queue, so at most a few batches for each worker are in memory.
+    """
+    batches = queue.Queue(maxsize=max_workers * 2)
+    done = object()
+    stop = threading.Event()
+
+    def read_file(file_key: str):
+        try:
+            if stop.is_set():
+                return
+            batch = []
+            for row in iter_inventory_file(s3_client, manifest, file_key):
+                batch.append(row)
+                if len(batch) == batch_size:
+                    if stop.is_set():
+                        return
+                    batches.put(batch)
+                    batch = []
+            if batch:
+                batches.put(batch)
+            logger.debug(f"Read inventory file {file_key}")
+        finally:
+            batches.put(done)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(read_file, file_key) for file_key in manifest.files]
+        try:
+            pending = len(futures)
+            while pending:
+                batch = batches.get()
+                if batch is done:
+                    pending -= 1
+                    continue
+                yield batch
+        finally:
+            # Unblocks workers waiting on a full queue when the caller stops early or fails
+            stop.set()
+            while any(not future.done() for future in futures):
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        for future in futures:
+            future.result()
+
+
+class InventoryIndex:
+    """
+    SQLite index of the object versions of an inventory report.
+    The index remembers the manifest it was built from, build() is a no-op when the manifest didn't change.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_metadata(self, name: str) -> Optional[str]:
+        row = self.connection.execute("SELECT value FROM metadata WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def build(self, s3_client, manifest: InventoryManifest, max_workers: int = 10) -> int:
+        """Indexes all versions of manifest, replacing the ones of a previous report. Returns the indexed versions."""
+        manifest_uri = f"s3://{manifest.bucket}/{manifest.key}"
+        if self.get_metadata('manifest') == manifest_uri:
+            count = self.count()
+            logger.info(f"Index {self.path} is already built from {manifest_uri} ({count} versions)")
+            return count
+
+        connection = self.connection
+        # The index is rebuilt from scratch if interrupted, so durability is traded for speed
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("DROP TABLE IF EXISTS versions")
+        connection.execute("DELETE FROM metadata")
+        connection.execute("CREATE TABLE versions (key TEXT NOT NULL, version_id TEXT NOT NULL, is_latest INTEGER, "
+                           "is_delete_marker INTEGER, last_modified TEXT, size INTEGER)")
+        count = 0
+        logger.info(f"Indexing {len(manifest.files)} files of {manifest_uri} with {max_workers} workers")
+        for batch in iter_inventory_batches(s3_client, manifest, max_workers):
+            connection.executemany("INSERT INTO versions VALUES (?, ?, ?, ?, ?, ?)", batch)
+            count += len(batch)
+            if count % (INSERT_BATCH_SIZE * 100) < len(batch):
+                logger.info(f"Indexed {count} versions")
+        # Indexes are created after the bulk insert, that is faster than updating them row by row
+        connection.execute("CREATE INDEX versions_key ON versions (key, last_modified)")
+        connection.execute("CREATE INDEX versions_delete_markers ON versions (is_delete_marker, is_latest, key)")
+        connection.execute("INSERT INTO metadata VALUES ('manifest', ?)", (manifest_uri,))
+        connection.commit()
+        logger.info(f"Indexed {count} versions in {self.path}")
+        return count
+
+    def count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM versions").fetchone()[0]
+
+    def get_versions(self, key: str) -> List[Dict]:
+        """Returns the versions of key, newest first."""
+        cursor = self.connection.execute(
+            "SELECT version_id, is_latest, is_delete_marker, last_modified, size FROM versions WHERE key = ? "
+            "ORDER BY last_modified DESC", (key,))
+        return [
+            {'VersionId': version_id, 'IsLatest': bool(is_latest), 'IsDeleteMarker': bool(is_delete_marker),
+             'LastModified': last_modified, 'Size': size}
+            for version_id, is_latest, is_delete_marker, last_modified, size in cursor
+        ]
+
+    def iter_delete_markers(self, prefix: str = "", since: Optional[datetime] = None, until: Optional[datetime] = None,
+                            latest_only: bool = True) -> Iterator[Dict]:
+        """Yields delete markers under prefix created in [since, until), with the fields of list_object_versions."""
+        query = "SELECT key, version_id, is_latest, last_modified FROM versions WHERE is_delete_marker = 1"
+        args = []
+        if latest_only:
+            query += " AND is_latest = 1"
+        if prefix:
+            # Range on key instead of LIKE, that would treat % and _ in prefix as wildcards
+            query += " AND key >= ? AND key < ?"
+            args.extend([prefix, prefix + '\U0010ffff'])
+        if since:
+            query += " AND last_modified >= ?"
+            args.append(format_inventory_time(since))
+        if until:
+            query += " AND last_modified < ?"
+            args.append(format_inventory_time(until))
+        for key, version_id, is_latest, last_modified in self.connection.execute(query, args):
+            yield {'Key': key, 'VersionId': version_id, 'IsLatest': bool(is_latest), 'LastModified': last_modified}
+
+
+def build_inventory_index(s3_client, bucket_name: str, inventory_bucket: str, inventory_prefix: str = "inventory",
+                          inventory_id: str = "aws-script", index_path: Optional[str] = None,
+                          max_workers: int = 10) -> InventoryIndex:
+    """Builds, or reuses if up to date, the index of the latest inventory report of bucket_name."""
+    manifest_key = find_latest_manifest(s3_client, inventory_bucket, inventory_prefix, bucket_name, inventory_id)
+    if not manifest_key:
+        raise ValueError(f"No inventory report found for bucket '{bucket_name}' in "
+                         f"s3://{inventory_bucket}/{get_reports_prefix(inventory_prefix, bucket_name, inventory_id)}")
+    manifest = read_manifest(s3_client, inventory_bucket, manifest_key)
+    index = InventoryIndex(index_path or get_default_index_path(bucket_name))
+    index.build(s3_client, manifest, max_workers)
+    return index
+
+
+def get_default_index_path(bucket_name: str) -> str:
+    return os.path.join(os.getcwd(), f"inventory_{bucket_name}.sqlite3")
+
+
+def inventory_index(
+        bucket_name: str,
+        inventory_bucket: str = typer.Option(..., "--inventory-bucket", "-d",
+                                             help="The S3 bucket where inventory reports are saved."),
+        inventory_prefix: str = typer.Option("inventory", "--inventory-prefix", "-p",
+                                             help="The prefix of inventory reports in the inventory bucket."),
+        inventory_id: str = typer.Option("aws-script", "--inventory-id", "-i",
+                                         help="The id of inventory configuration."),
+        index_path: str = typer.Option(None, "--index-path",
+                                       help="Path of the SQLite index, default inventory_{bucket_name}.sqlite3"),
+        max_workers: int = typer.Option(10, "--max-workers", help="Max number of inventory files read in parallel."),
+):
+    """
+    Builds a local SQLite index of the object versions of a bucket from its latest S3 Inventory report.
+    """
+    s3_client = AWSHelper.get_client('s3')
+    try:
+        with build_inventory_index(s3_client, bucket_name, inventory_bucket, inventory_prefix, inventory_id,
+                                   index_path, max_workers) as index:
+            typer.secho(f"👍 Index {index.path} has {index.count()} versions", fg=typer.colors.GREEN)
+    except (ValueError, ClientError) as e:
+        logger.error(f"Failed to build inventory index of bucket '{bucket_name}': {e}")
+        raise typer.Exit(code=1)
@@ -1,24 +1,30 @@
 import typer
 
 from s3.inventory import add_inventory_configuration, remove_inventory_configuration
+from s3.inventory_reader import inventory_index
 from s3.pitr import pitr, pitr_ingest_existing_objects_with_multiple_versions_at_same_time
+from s3.pitr_local import pitr_local
 from s3.restore_deleted_objects import restore_all_deleted_objects
 from s3.versioning import enable_versioning, disable_versioning, check_buckets_versioning
-from s3.eventbridge import enable_notifications, disable_notifications
-from s3.s3_batch_operations import clean_batch_operation_pending_jobs
+from s3.eventbridge import enable_notifications, disable_notifications, rollback_notifications
+from s3.s3_batch_operations import clean_batch_operation_pending_jobs, batch_jobs_watch
 app = typer.Typer()
 
 # Add commands here
 app.command()(check_buckets_versioning)
 app.command()(pitr)
+app.command()(pitr_local)
 app.command()(enable_versioning)
 app.command()(disable_versioning)
 app.command()(enable_notifications)
 app.command()(disable_notifications)
+app.command()(rollback_notifications)
 app.command()(add_inventory_configuration)
 app.command()(remove_inventory_configuration)
+app.command()(inventory_index)
 app.command()(pitr_ingest_existing_objects_with_multiple_versions_at_same_time)
 app.command()(clean_batch_operation_pending_jobs)
+app.command()(batch_jobs_watch)
 app.command()(restore_all_deleted_objects)
 
 if __name__ == "__main__":
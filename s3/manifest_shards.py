@@ -0,0 +1,130 @@
+"""
+Sharding of S3 Batch Operations manifests.
+
+A manifest with many keys is split in shards, each one started as its own job, so the restore of a large bucket runs
+in parallel instead of behind a single job. Shards are made by line count (consecutive rows of the manifest) or by
+key range (contiguous ranges of the sorted key space, cut at quantiles of a sample of keys, optionally snapped to key
+prefixes so that every prefix belongs to exactly one shard).
+"""
+import bisect
+import csv
+import math
+import os
+import random
+import re
+from collections import Counter
+from typing import List
+
+from utils.logger import get_logger
+from utils.partitioned_writer import PartitionedCsvWriter
+
+logger = get_logger(__name__)
+
+SHARD_BY_VALUES = ["lines", "prefix"]
+SHARD_FILE_SUFFIX = "-shard"
+KEY_COLUMN_INDEX = 1
+# Keys sampled for each shard to find the cut points of key ranges
+SAMPLE_KEYS_PER_SHARD = 1000
+_SHARD_FILE_REGEX = re.compile(rf"^(.*){SHARD_FILE_SUFFIX}(\d+)\.csv$")
+
+
+def get_shard_file_name(file_path: str, shard: int) -> str:
+    return f"{file_path.removesuffix('.csv')}{SHARD_FILE_SUFFIX}{shard:04d}.csv"
+
+
+def parse_shard_file_name(file_path: str) -> tuple:
+    """Returns (manifest file path, shard number) of a shard file, shard number is None for a not sharded file."""
+    match = _SHARD_FILE_REGEX.match(file_path)
+    if not match:
+        return file_path, None
+    return f"{match.group(1)}.csv", int(match.group(2))
+
+
+def count_lines(file_path: str) -> int:
+    with open(file_path, 'rb') as f:
+        return sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1024 * 1024), b''))
+
+
+def sample_keys(file_path: str, sample_size: int, seed: int = 0) -> List[str]:
+    """Returns a uniform sample (reservoir sampling) of at most sample_size keys of a manifest, sorted."""
+    rng = random.Random(seed)
+    sample = []
+    with open(file_path, 'r', newline='') as f:
+        for seen, row in enumerate(csv.reader(f)):
+            if len(sample) < sample_size:
+                sample.append(row[KEY_COLUMN_INDEX])
+            else:
+                index = rng.randrange(seen + 1)
+                if index < sample_size:
+                    sample[index] = row[KEY_COLUMN_INDEX]
+    return sorted(sample)
+
+
+def get_key_range_cut_points(sorted_sample: List[str], shards: int, prefix_length: int = 0) -> List[str]:
+    """
+    Returns the sorted cut points splitting the key space in at most shards ranges with about the same number of keys:
+    the key of shard n is at least cut point n - 1 and lower than cut point n.
+    With prefix_length greater than 0 cut points are snapped to key prefixes of that length, a prefix holding more
+    than a shard of keys makes less shards, and a warning is logged.
+    """
+    cut_points = []
+    for shard in range(1, shards):
+        cut_point = sorted_sample[len(sorted_sample) * shard // shards]
+        if prefix_length:
+            cut_point = cut_point[:prefix_length]
+        if (cut_points and cut_point <= cut_points[-1]) or cut_point <= sorted_sample[0]:
+            continue
+        cut_points.append(cut_point)
+    if len(cut_points) < shards - 1:
+        logger.warning(f"Key range sharding made {len(cut_points) + 1} shards instead of {shards}: "
+                       + (f"a key prefix of {prefix_length} chars holds more than 1/{shards} of keys, use a "
+                          f"longer prefix length or 0" if prefix_length else "too few distinct keys"))
+    return cut_points
+
+
+def shard_manifest(file_path: str, shards: int, shard_by: str = "lines", min_lines: int = 0,
+                   prefix_length: int = 0) -> List[str]:
+    """
+    Splits a manifest in at most shards files, written next to it with suffix -shardNNNN.
+    Manifests with less than min_lines lines (or shards lower than 2) aren't sharded and [file_path] is returned.
+
+    Args:
+        file_path: CSV manifest without header, key in second column.
+        shards: Max number of shards.
+        shard_by: 'lines' splits consecutive rows in shards with the same number of rows, 'prefix' assigns contiguous
+            ranges of the sorted key space to shards, balanced by number of keys on a sample of keys.
+        min_lines: Min number of lines of a manifest to shard it.
+        prefix_length: If greater than 0, 'prefix' cuts key ranges only between key prefixes of this length, so all
+            keys with the same prefix are in the same shard.
+    Returns:
+        Paths of shards, in shard order.
+    """
+    if shard_by not in SHARD_BY_VALUES:
+        raise ValueError(f"Invalid shard by '{shard_by}', allowed values: {', '.join(SHARD_BY_VALUES)}")
+    if shards < 2:
+        return [file_path]
+    lines = count_lines(file_path)
+    if lines < max(min_lines, 2):
+        return [file_path]
+    shards = min(shards, lines)
+
+    if shard_by == "lines":
+        lines_per_shard = math.ceil(lines / shards)
+        shard_of_row = lambda row_index, row: row_index // lines_per_shard
+    else:
+        cut_points = get_key_range_cut_points(sample_keys(file_path, shards * SAMPLE_KEYS_PER_SHARD), shards,
+                                              prefix_length)
+        shard_of_row = lambda row_index, row: bisect.bisect_right(cut_points, row[KEY_COLUMN_INDEX])
+
+    rows_by_shard = Counter()
+    with open(file_path, 'r', newline='') as f, \
+            PartitionedCsvWriter(lambda shard: get_shard_file_name(file_path, shard)) as writer:
+        for row_index, row in enumerate(csv.reader(f)):
+            shard = shard_of_row(row_index, row)
+            rows_by_shard[shard] += 1
+            writer.writerow(shard, row)
+
+    shard_paths = [get_shard_file_name(file_path, shard) for shard in sorted(writer.partitions)]
+    logger.info(f"Sharded {os.path.basename(file_path)} ({lines} lines) by {shard_by} in {len(shard_paths)} shards, "
+                f"largest shard has {max(rows_by_shard.values())} lines")
+    return shard_paths
@@ -7,10 +7,24 @@ from botocore.exceptions import ClientError
 import logging
 import re
 import json
+import heapq
+import hashlib
+import codecs
+import tempfile
+from itertools import groupby
+from collections import deque
+from contextlib import contextmanager
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import unquote
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Iterable, Iterator, Callable
 from utils.aws import AWSHelper
+from utils.partitioned_writer import PartitionedCsvWriter
+from utils.waiter import Waiter, WaitTimeoutError
+from s3.pitr_journal import PitrJournal
+from s3.query_cache import QueryResultCache
+from s3.manifest_shards import parse_shard_file_name, shard_manifest, SHARD_BY_VALUES
+from s3.pitr_partitions import (PARTITION_MODES, configure_partition_projection, register_new_partitions,
+                                 render_date_filters)
 from pathlib import Path
 
 file_path = Path(__file__)
@@ -39,18 +53,28 @@ SEQUENCER_COLUMN_NAME = 'sequencer'
 TABLE_NAME = 'events-pitr_demo_wtzb6eiepe_7ihznpek1f_inventory'
 QUERIES_FOLDER = script_folder_path / 'queries/'
 
+MANIFEST_RESTORE_FIELDNAMES = ['bucketname', 'key', 'version']
+MAX_OPEN_MANIFEST_FILES = 256
+QUERY_RESULTS_SOURCES = ["download", "s3-stream", "query-results"]
+
 time_validation_regex = re.compile(r"(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z)")
 
 ACTION_CONFIGURATION = {
     "restore": {
         "athena_query_name": "get_files_to_restore.sql",
+        "athena_unload_query_name": "unload_restore_by_bucket.sql",
         "s3_batch_action": "copy"
     },
     "delete": {
         "athena_query_name": "get_files_to_delete.sql",
+        "athena_unload_query_name": "unload_delete_by_bucket.sql",
         "s3_batch_action": "delete"
     }
 }
+MANIFESTS_PREFIX = "manifests/"
+PUT_OBJECT_MAX_SIZE = 5 * 1024 ** 3
+UNLOAD_PARTITION_PREFIX = f"{BUCKET_COLUMN_NAME}="
+BATCH_REPORT_PREFIX = 'batch-operations-report'
 
 
 def get_sequencer_value(v: dict):
@@ -69,31 +93,26 @@ def start_crawler_glue(crawler_name: str, polling_interval: int = 10, timeout: i
 
     Args:
         crawler_name (str): Nome del crawler da avviare.
-        polling_interval (int): Intervallo in secondi tra i controlli dello stato.
+        polling_interval (int): Intervallo massimo in secondi tra i controlli dello stato.
         timeout (int): Tempo massimo di attesa in secondi (default: 15 minuti).
     Returns:
         bool: True se l'avvio è riuscito, False altrimenti.
     """
 
     try:
-        response = glue_client.start_crawler(Name=crawler_name)
+        glue_client.start_crawler(Name=crawler_name)
 
         logger.info(f"Crawler '{crawler_name}' started.")
-        elapsed = 0
-        while elapsed < timeout:
-            response = glue_client.get_crawler(Name=crawler_name)
-            state = response['Crawler']['State']
-
-            if state == "READY":
-                logger.info(f"Crawler '{crawler_name}' completed.")
-                return True
-            else:
-                logger.info(f"Actual state: {state}. Wait for {polling_interval} seconds...")
-                time.sleep(polling_interval)
-                elapsed += polling_interval
-
-        logger.info(f"Timeout reached after {timeout} seconds. Crowler not completed.")
-        return False
+        waiter = Waiter(initial_delay=min(1, polling_interval), max_delay=polling_interval, timeout=timeout)
+        try:
+            waiter.wait(lambda: glue_client.get_crawler(Name=crawler_name)['Crawler']['State'],
+                        lambda state: state == "READY",
+                        on_poll=lambda state: logger.debug(f"Actual state: {state}."))
+        except WaitTimeoutError:
+            logger.info(f"Timeout reached after {timeout} seconds. Crowler not completed.")
+            return False
+        logger.info(f"Crawler '{crawler_name}' completed in {waiter.elapsed:.1f} seconds.")
+        return True
 
     except ClientError as e:
         if e.response['Error']['Code'] == 'CrawlerRunningException':
@@ -104,8 +123,12 @@ def start_crawler_glue(crawler_name: str, polling_interval: int = 10, timeout: i
         return False
 
 
-def run_athena_query(database: str, query: str, output_location: str):
-    """Runs an Athena query and returns the query execution ID."""
+def run_athena_query(database: str, query: str, output_location: str, result_reuse_max_age: int = 0):
+    """
+    Runs an Athena query and returns the query execution ID.
+    If result_reuse_max_age is greater than 0, Athena reuses results of same query run in last result_reuse_max_age
+    minutes without scanning data again.
+    """
     response = athena_client.start_query_execution(
         QueryString=query,
         QueryExecutionContext={
@@ -113,19 +136,60 @@ def run_athena_query(database: str, query: str, output_location: str):
         },
         ResultConfiguration={
             'OutputLocation': output_location
-        }
+        },
+        **({'ResultReuseConfiguration': {
+            'ResultReuseByAgeConfiguration': {'Enabled': True, 'MaxAgeInMinutes': result_reuse_max_age}
+        }} if result_reuse_max_age > 0 else {})
     )
     return response['QueryExecutionId']
 
 
-def wait_for_query_completion(query_execution_id: str):
-    """Waits for an Athena query to complete."""
-    while True:
-        response = athena_client.get_query_execution(QueryExecutionId=query_execution_id)
-        state = response['QueryExecution']['Status']['State']
-        if state in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-            return state
-        time.sleep(5)
+def get_table_version(database: str, table: str, crawler_name: str = None) -> str:
+    """
+    Returns a string that changes when table metadata can be changed: table update time and, if crawler_name is set,
+    start time of last crawl. It doesn't change when new events are written to existing partitions, so the query
+    cache keyed on it is opt-in.
+    """
+    table_version = str(glue_client.get_table(DatabaseName=database, Name=table)['Table'].get('UpdateTime', ''))
+    if crawler_name:
+        last_crawl = glue_client.get_crawler(Name=crawler_name)['Crawler'].get('LastCrawl', {})
+        table_version += f"|{last_crawl.get('StartTime', '')}"
+    return table_version
+
+
+def get_query_state(query_execution_id: str) -> str:
+    response = athena_client.get_query_execution(QueryExecutionId=query_execution_id)
+    return response['QueryExecution']['Status']['State']
+
+
+def get_query_output_location(query_execution_id: str) -> str:
+    """Returns S3 URI of query results, with reused results it's the location of the original execution."""
+    response = athena_client.get_query_execution(QueryExecutionId=query_execution_id)
+    return response['QueryExecution']['ResultConfiguration']['OutputLocation']
+
+
+def wait_for_query_completion(query_execution_id: str, timeout: int = None, max_delay: float = 5) -> str:
+    """
+    Waits for an Athena query to complete and logs runtime and scanned bytes.
+    Polls start after 0.25 seconds with exponential backoff up to max_delay seconds. If timeout is reached the
+    query is left running and its current state is returned.
+    """
+    waiter = Waiter(initial_delay=0.25, max_delay=max_delay, timeout=timeout)
+    try:
+        query_execution = waiter.wait(
+            lambda: athena_client.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution'],
+            lambda q: q['Status']['State'] in ['SUCCEEDED', 'FAILED', 'CANCELLED'])
+    except WaitTimeoutError as e:
+        logger.error(f"Query {query_execution_id} not completed: {e}")
+        return e.last_result['Status']['State']
+
+    statistics = query_execution.get('Statistics', {})
+    logger.info(f"Query {query_execution_id} {query_execution['Status']['State']} after {waiter.attempts} polls: "
+                f"queue {statistics.get('QueryQueueTimeInMillis', 0)} ms, "
+                f"engine {statistics.get('EngineExecutionTimeInMillis', 0)} ms, "
+                f"total {statistics.get('TotalExecutionTimeInMillis', 0)} ms, "
+                f"scanned {statistics.get('DataScannedInBytes', 0) / 1024 ** 2:.1f} MB")
+    return query_execution['Status']['State']
 
 
 def download_s3_file(bucket: str, key: str, local_path: str):
@@ -133,116 +197,343 @@ def download_s3_file(bucket: str, key: str, local_path: str):
     s3_client.download_file(bucket, key, local_path)
 
 
+class AthenaQueryResultsReader:
+    """
+    Iterates rows of a completed Athena query using GetQueryResults pagination.
+    Like csv.DictReader it exposes fieldnames and yields one dict for each row, so it can be used in place of a reader
+    of the downloaded CSV result file.
+    """
+
+    def __init__(self, query_execution_id: str, page_size: int = 1000):
+        paginator = athena_client.get_paginator('get_query_results')
+        self._pages = iter(paginator.paginate(QueryExecutionId=query_execution_id,
+                                              PaginationConfig={'PageSize': page_size}))
+        first_page = next(self._pages)
+        self.fieldnames = [c['Name'] for c in first_page['ResultSet']['ResultSetMetadata']['ColumnInfo']]
+        # First row of first page contains column names
+        self._first_page_rows = first_page['ResultSet']['Rows'][1:]
+
+    def _to_dict(self, row: dict) -> dict:
+        return dict(zip(self.fieldnames, [d.get('VarCharValue', '') for d in row['Data']]))
+
+    def __iter__(self):
+        for row in self._first_page_rows:
+            yield self._to_dict(row)
+        for page in self._pages:
+            for row in page['ResultSet']['Rows']:
+                yield self._to_dict(row)
+
+
+def open_s3_csv_reader(bucket: str, key: str) -> csv.DictReader:
+    """Returns a csv.DictReader that streams a CSV object from S3 without downloading it."""
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    return csv.DictReader(codecs.getreader('utf-8')(body))
+
+
+@contextmanager
+def open_query_results(results_source: str, query_execution_id: str, bucket: str, key: str, local_csv_file: str):
+    """
+    Opens results of a completed Athena query as a csv.DictReader like object.
+    With 'download' the result file is downloaded to local_csv_file and read from disk, with 's3-stream' the result
+    object body is streamed from S3 and with 'query-results' rows are paged with GetQueryResults.
+    Streaming sources don't keep a local copy of results and rows are processed while they arrive.
+    """
+    if results_source == "download":
+        download_s3_file(bucket, key, local_csv_file)
+        logger.info(f"Downloaded to {local_csv_file}")
+        with open(local_csv_file, 'r') as f:
+            yield csv.DictReader(f)
+    elif results_source == "s3-stream":
+        yield open_s3_csv_reader(bucket, key)
+    elif results_source == "query-results":
+        yield AthenaQueryResultsReader(query_execution_id)
+    else:
+        raise ValueError(f"Invalid results source '{results_source}'")
+
+
 def split_csv_file(file_path: str, split_column_name: str, extra_name_suffix: str = ""):
     """Splits a CSV file based on a specified column."""
-    split_files = {}
     with open(file_path, 'r') as infile:
-        reader = csv.DictReader(infile)
-        if split_column_name not in reader.fieldnames:
-            raise ValueError(f"Split column '{split_column_name}' not found in CSV headers.")
+        return split_csv_rows(csv.DictReader(infile), split_column_name, extra_name_suffix=extra_name_suffix)
 
+
+def get_manifest_file_name(split_value: str, extra_name_suffix: str = "") -> str:
+    return f'{"_".join([split_value, extra_name_suffix])}.csv'
+
+
+def split_csv_rows(reader: Iterable[dict], split_column_name: str, extra_name_suffix: str = "",
+                   max_open_files: int = MAX_OPEN_MANIFEST_FILES):
+    """
+    Splits rows of a csv.DictReader like object (iterable of dict with fieldnames attribute) based on a specified
+    column. Rows are written as soon as they are read, keeping at most max_open_files files open.
+    """
+    if split_column_name not in reader.fieldnames:
+        raise ValueError(f"Split column '{split_column_name}' not found in CSV headers.")
+
+    with PartitionedCsvWriter(lambda v: get_manifest_file_name(v, extra_name_suffix), fieldnames=reader.fieldnames,
+                              max_open_files=max_open_files) as writer:
         for row in reader:
-            split_value = row[split_column_name]
-            if split_value not in split_files:
-                # Create a new file for this split value
-                split_files[split_value] = open(f'{"_".join([split_value, extra_name_suffix])}.csv', 'w', newline='')
-            writer = csv.DictWriter(split_files[split_value], fieldnames=reader.fieldnames)
-            writer.writerow(row)
+            writer.writerow(row[split_column_name], row)
 
-    # Close all split files
-    for f in split_files.values():
-        f.close()
+    return writer.paths
+
+
+def _select_row_to_write(row: dict, row_sequencer: int, last_written_version: str | None,
+                         last_written_row_sequencer: int, skip_duplicated_versions_at_same_time: bool,
+                         duplicated_version_at_same_time_rows: dict) -> bool:
+    """
+    Compare a row with the version currently selected for the same bucket/key and return True if the new row must
+    replace it. Rows with the same sequencer and a different version are collected in
+    duplicated_version_at_same_time_rows when skip_duplicated_versions_at_same_time is set, otherwise an exception
+    is raised.
+    """
+    if last_written_version is None:
+        return True
+
+    bucket_name = row[BUCKET_COLUMN_NAME]
+    row_key = row["key"]
+    if row_sequencer < last_written_row_sequencer:
+        logger.info(f"Skip row for '{bucket_name}/{row_key}' because was found row with most highest "
+                    f"sequencer value")
+        logger.debug(f"row_sequencer < last_written_row_by_key_sequencer: "
+                     f"{row_sequencer} < {last_written_row_sequencer}")
+        return False
+    elif row_sequencer == last_written_row_sequencer:
+        if row["version"] == last_written_version:
+            logging.debug("Found duplicated row")
+        elif skip_duplicated_versions_at_same_time:
+            duplicated_version_at_same_time_rows[(bucket_name, row_key)] = row
+            logging.info(f"Skip object {bucket_name}/{row_key}")
+            return False
+        else:
+            raise Exception("Multiple version with at same event time ingested detect")
+    return True
 
-    return [f'{"_".join([value, extra_name_suffix])}.csv' for value in split_files.keys()]
+
+def _write_duplicated_version_at_same_time_rows(duplicated_version_at_same_time_rows: dict):
+    """Writes the (bucket name, key) -> row dict of skipped duplicated versions, sorted by bucket name and key so
+    in memory and external sort paths write the same file."""
+    with open('duplicated_version_at_same_time.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=["bucketname", "key", "version", "sequencer"])
+        writer.writerows(duplicated_version_at_same_time_rows[bucket_name_key]
+                         for bucket_name_key in sorted(duplicated_version_at_same_time_rows))
 
 
 def parse_athena_csv_for_restore(file_path: str, extra_name_suffix: str = "",
-                                 skip_duplicated_versions_at_same_time: bool = False):
+                                 skip_duplicated_versions_at_same_time: bool = False,
+                                 max_rows_in_memory: int = 0, spill_dir: str = None):
     """
         Splits a CSV file based on column that contain bucket name and for each object key ensure that exist only row
         that contain last recent version based on sequencer value if exist.
         This value is hex value and highest mean more recent version.
         If exist 2 rows with same key and different version without sequencer value, mean that have error in import
         existing objects job.
+        If max_rows_in_memory is greater than 0 rows are deduplicated with an external sort that keeps at most
+        max_rows_in_memory rows in memory, see parse_athena_rows_for_restore_external_sort.
         # For more information refer:
         https://aws.amazon.com/it/blogs/storage/manage-event-ordering-and-duplicate-events-with-amazon-s3-event-notifications/
     """
-    split_files = {}
+    with open(file_path, 'r') as infile:
+        return parse_athena_rows_for_restore(csv.DictReader(infile), extra_name_suffix=extra_name_suffix,
+                                             skip_duplicated_versions_at_same_time=
+                                             skip_duplicated_versions_at_same_time,
+                                             max_rows_in_memory=max_rows_in_memory, spill_dir=spill_dir)
+
+
+def build_restore_index(reader: Iterable[dict], skip_duplicated_versions_at_same_time: bool,
+                        duplicated_version_at_same_time_rows: dict) -> Dict[str, Dict[str, tuple]]:
+    """
+    Returns the version to restore of each key as a bucket name -> key -> (sequencer, version) index.
+    The sequencer is parsed once for each row and only the columns needed by manifests are kept, rows of a key seen
+    again are compared with _select_row_to_write.
+    """
+    if BUCKET_COLUMN_NAME not in reader.fieldnames:
+        raise ValueError(f"Split column '{BUCKET_COLUMN_NAME}' not found in CSV headers.")
+
+    records_by_bucket_name_key = {}
+    for row in reader:
+        bucket_name = row[BUCKET_COLUMN_NAME]
+        records = records_by_bucket_name_key.get(bucket_name)
+        if records is None:
+            records = records_by_bucket_name_key[bucket_name] = {}
+        row_key = row["key"]
+        row_sequencer = get_sequencer_value(row)
+        selected = records.get(row_key)
+        if selected is not None and not _select_row_to_write(row, row_sequencer, selected[1], selected[0],
+                                                             skip_duplicated_versions_at_same_time,
+                                                             duplicated_version_at_same_time_rows):
+            # Skip this row
+            continue
+        records[row_key] = (row_sequencer, row["version"])
+    return records_by_bucket_name_key
+
+
+def parse_athena_rows_for_restore(reader: Iterable[dict], extra_name_suffix: str = "",
+                                  skip_duplicated_versions_at_same_time: bool = False,
+                                  max_rows_in_memory: int = 0, spill_dir: str = None):
+    """
+        Same as parse_athena_csv_for_restore but read rows from a csv.DictReader like object (iterable of dict with
+        fieldnames attribute), e.g. a reader of query results streamed from S3 or AthenaQueryResultsReader.
+    """
+    if max_rows_in_memory > 0:
+        return parse_athena_rows_for_restore_external_sort(
+            reader, extra_name_suffix=extra_name_suffix,
+            skip_duplicated_versions_at_same_time=skip_duplicated_versions_at_same_time,
+            max_rows_in_memory=max_rows_in_memory, spill_dir=spill_dir)
+
     duplicated_version_at_same_time_rows = {}
-    row_to_write_by_bucket_name_key = {}
+    records_by_bucket_name_key = build_restore_index(reader, skip_duplicated_versions_at_same_time,
+                                                     duplicated_version_at_same_time_rows)
+
+    # Rows are sequences in MANIFEST_RESTORE_FIELDNAMES order
+    with PartitionedCsvWriter(lambda v: get_manifest_file_name(v, extra_name_suffix)) as writer:
+        for bucket_name, records in records_by_bucket_name_key.items():
+            writer.writerows(bucket_name, ((bucket_name, key, version) for key, (_, version) in records.items()))
+
+    _write_duplicated_version_at_same_time_rows(duplicated_version_at_same_time_rows)
+
+    return writer.paths
+
+
+def _spill_sorted_run(rows: list, spill_dir: str) -> str:
+    """Sorts rows in memory and writes them to a new run file, returns the run file path."""
+    rows.sort()
+    with tempfile.NamedTemporaryFile('w', dir=spill_dir, suffix='.csv', newline='', delete=False) as f:
+        csv.writer(f).writerows(rows)
+    return f.name
+
+
+def _read_sorted_run(run_path: str):
+    with open(run_path, 'r', newline='') as f:
+        for bucket_name, key, row_index, version, sequencer in csv.reader(f):
+            yield bucket_name, key, int(row_index), version, sequencer
+
+
+def _merge_sorted_runs(run_paths: List[str], spill_dir: str, max_merge_fan_in: int) -> List[str]:
+    """Merges run files until they are at most max_merge_fan_in, so the final merge never exceeds open files limit."""
+    while len(run_paths) > max_merge_fan_in:
+        merged_run_paths = []
+        for i in range(0, len(run_paths), max_merge_fan_in):
+            group = run_paths[i:i + max_merge_fan_in]
+            with tempfile.NamedTemporaryFile('w', dir=spill_dir, suffix='.csv', newline='', delete=False) as f:
+                csv.writer(f).writerows(heapq.merge(*[_read_sorted_run(p) for p in group]))
+            for p in group:
+                os.remove(p)
+            merged_run_paths.append(f.name)
+        run_paths = merged_run_paths
+    return run_paths
+
+
+def parse_athena_csv_for_restore_external_sort(file_path: str, extra_name_suffix: str = "",
+                                               skip_duplicated_versions_at_same_time: bool = False,
+                                               max_rows_in_memory: int = 1_000_000, spill_dir: str = None,
+                                               max_merge_fan_in: int = 64):
+    """Same as parse_athena_rows_for_restore_external_sort but read rows from a CSV file."""
     with open(file_path, 'r') as infile:
-        reader = csv.DictReader(infile)
+        return parse_athena_rows_for_restore_external_sort(
+            csv.DictReader(infile), extra_name_suffix=extra_name_suffix,
+            skip_duplicated_versions_at_same_time=skip_duplicated_versions_at_same_time,
+            max_rows_in_memory=max_rows_in_memory, spill_dir=spill_dir, max_merge_fan_in=max_merge_fan_in)
+
+
+def parse_athena_rows_for_restore_external_sort(reader: Iterable[dict], extra_name_suffix: str = "",
+                                                skip_duplicated_versions_at_same_time: bool = False,
+                                                max_rows_in_memory: int = 1_000_000, spill_dir: str = None,
+                                                max_merge_fan_in: int = 64):
+    """
+        Same as parse_athena_rows_for_restore but with memory bounded by max_rows_in_memory.
+        Input is read in chunks of max_rows_in_memory rows, each chunk is sorted by bucket name and key and spilled
+        to a run file in spill_dir (system temp folder if not set), then runs are k-way merged and rows of the same
+        bucket/key are deduplicated with the same sequencer rules of the in memory path.
+        Rows of the same bucket/key are merged in input file order (row index is part of sort key) so duplicated
+        versions are detected exactly as the in memory path. Manifest rows are written sorted by key.
+    """
+    duplicated_version_at_same_time_rows = {}
+    with tempfile.TemporaryDirectory(dir=spill_dir, prefix='pitr-sort-') as runs_dir:
+        run_paths = []
         if BUCKET_COLUMN_NAME not in reader.fieldnames:
             raise ValueError(f"Split column '{BUCKET_COLUMN_NAME}' not found in CSV headers.")
 
-        for row in reader:
-            bucket_name = row[BUCKET_COLUMN_NAME]
-            row_key = row["key"]
-            row_sequencer = get_sequencer_value(row)
-            if bucket_name not in row_to_write_by_bucket_name_key:
-                # Create a new file for this split value
-                row_to_write_by_bucket_name_key[bucket_name] = {}
-            rows_to_write = row_to_write_by_bucket_name_key[bucket_name]
-            if row_key in rows_to_write:
-                last_written_row_with_same_key = rows_to_write[row_key]
-                last_written_row_with_same_key_sequencer = get_sequencer_value(last_written_row_with_same_key)
-                if row_sequencer < last_written_row_with_same_key_sequencer:
-                    logger.info(f"Skip row for '{bucket_name}/{row_key}' because was found row with most highest "
-                                f"sequencer value")
-                    logger.debug(f"row_sequencer < last_written_row_by_key_sequencer: "
-                                 f"{row_sequencer} < {last_written_row_with_same_key_sequencer}")
-                    # Skip this row
-                    continue
-                elif row_sequencer == last_written_row_with_same_key_sequencer:
-                    if row["version"] == last_written_row_with_same_key["version"]:
-                        logging.debug("Found duplicated row")
-                    elif row_sequencer == 0:
-                        if skip_duplicated_versions_at_same_time:
-                            duplicated_version_at_same_time_rows[row_key] = row
-                            logging.info(f"Skip object {bucket_name}/{row_key}")
-                            continue
-                        else:
-                            raise Exception("Multiple version with at same event time ingested detect")
-                    elif row["version"] != last_written_row_with_same_key["version"]:
-                        if skip_duplicated_versions_at_same_time:
-                            duplicated_version_at_same_time_rows[row_key] = row
-                            logging.info(f"Skip object {bucket_name}/{row_key}")
-                            continue
-                        else:
-                            raise Exception("Multiple version with at same event time ingested detect")
-            # If execution reach this line, mean that we need write this row
-            row_to_write_by_bucket_name_key[bucket_name][row_key] = row
-
-        for bucket_name in row_to_write_by_bucket_name_key.keys():
-            f = split_files[bucket_name] = open(f'{"_".join([bucket_name, extra_name_suffix])}.csv', 'w', newline='')
-            writer = csv.DictWriter(f, fieldnames=['bucketname', 'key', 'version'])
-            rows = [{
-                        'bucketname': v['bucketname'],
-                        'key': v['key'],
-                        'version': v['version']
-                     } for _, v in row_to_write_by_bucket_name_key[bucket_name].items()]
-            writer.writerows(rows)
-            f.close()
-
-        with open('duplicated_version_at_same_time.csv', 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=["bucketname", "key", "version", "sequencer"])
-            writer.writerows([v for _, v in duplicated_version_at_same_time_rows.items()])
-
-    return [f'{"_".join([value, extra_name_suffix])}.csv' for value in split_files.keys()]
-
-
-def upload_to_s3(bucket: str, prefix: str, file_paths: list):
-    """Uploads files to S3."""
-    for file_path in file_paths:
-        s3_key = f'{prefix}{os.path.basename(file_path)}'
+        rows = []
+        for row_index, row in enumerate(reader):
+            rows.append((row[BUCKET_COLUMN_NAME], row["key"], row_index, row["version"],
+                         row.get(SEQUENCER_COLUMN_NAME) or ""))
+            if len(rows) >= max_rows_in_memory:
+                run_paths.append(_spill_sorted_run(rows, runs_dir))
+                rows = []
+        if rows:
+            run_paths.append(_spill_sorted_run(rows, runs_dir))
+        del rows
+
+        logger.info(f"Spilled {len(run_paths)} sorted runs, merging...")
+        run_paths = _merge_sorted_runs(run_paths, runs_dir, max_merge_fan_in)
+
+        merged_rows = heapq.merge(*[_read_sorted_run(p) for p in run_paths])
+        # Runs are sorted by bucket name, so only one manifest is written at a time
+        # Rows are sequences in MANIFEST_RESTORE_FIELDNAMES order
+        with PartitionedCsvWriter(lambda v: get_manifest_file_name(v, extra_name_suffix), max_open_files=1) as writer:
+            for (bucket_name, row_key), key_rows in groupby(merged_rows, key=lambda r: (r[0], r[1])):
+                version_to_write = None
+                version_to_write_sequencer = 0
+                for _, _, _, version, sequencer in key_rows:
+                    row = {'bucketname': bucket_name, 'key': row_key, 'version': version, 'sequencer': sequencer}
+                    row_sequencer = get_sequencer_value(row)
+                    if _select_row_to_write(row, row_sequencer, version_to_write, version_to_write_sequencer,
+                                            skip_duplicated_versions_at_same_time,
+                                            duplicated_version_at_same_time_rows):
+                        version_to_write = version
+                        version_to_write_sequencer = row_sequencer
+                writer.writerow(bucket_name, (bucket_name, row_key, version_to_write))
+
+    _write_duplicated_version_at_same_time_rows(duplicated_version_at_same_time_rows)
+
+    return writer.paths
+
+
+def upload_file_to_s3(bucket: str, s3_key: str, file_path: str) -> Dict[str, str]:
+    """
+    Uploads a file to S3 and returns ETag and VersionId (if bucket is versioned) of the uploaded object.
+    Files up to 5 GiB are uploaded with a single PutObject, so ETag comes from response without a HeadObject.
+    """
+    if os.path.getsize(file_path) <= PUT_OBJECT_MAX_SIZE:
+        with open(file_path, 'rb') as f:
+            response = s3_client.put_object(Bucket=bucket, Key=s3_key, Body=f)
+    else:
         s3_client.upload_file(file_path, bucket, s3_key)
-        logger.info(f"Uploaded {file_path} to s3://{bucket}/{s3_key}")
+        response = s3_client.head_object(Bucket=bucket, Key=s3_key)
+    logger.info(f"Uploaded {file_path} to s3://{bucket}/{s3_key}")
+    return {'ETag': response['ETag'], **({'VersionId': response['VersionId']} if response.get('VersionId') else {})}
+
+
+def upload_to_s3(bucket: str, prefix: str, file_paths: list, max_workers: int = 10,
+                 on_upload: Callable[[str, Dict[str, str]], None] = None) -> Dict[str, Dict[str, str]]:
+    """
+    Uploads files to S3 in parallel, returns ETag and VersionId of uploaded objects by file path.
+    If set, on_upload is called with file path and uploaded object as soon as each upload completes.
+    """
+    uploaded_objects = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(upload_file_to_s3, bucket, f'{prefix}{os.path.basename(file_path)}', file_path): file_path
+            for file_path in file_paths
+        }
+        for future in as_completed(futures):
+            uploaded_objects[futures[future]] = future.result()
+            if on_upload:
+                on_upload(futures[future], uploaded_objects[futures[future]])
+    return uploaded_objects
 
 
 def start_s3_batch_operation(manifest_s3_uri: str, destination_bucket: str, iam_role_arn: str, action: str,
                              report_bucket_arn: str,
-                             batch_delete_lambda_function_arn: str = None, confirmation_required: bool = False):
-    """Starts an S3 Batch Operations job using a Lambda function."""
+                             batch_delete_lambda_function_arn: str = None, confirmation_required: bool = False,
+                             manifest_etag: str = None, manifest_version_id: str = None, account_id: str = None,
+                             priority: int = 10, report_prefix: str = BATCH_REPORT_PREFIX, description: str = None):
+    """
+    Starts an S3 Batch Operations job using a Lambda function.
+    If manifest_etag is set the manifest isn't read with HeadObject and if account_id is set it isn't resolved with
+    GetCallerIdentity, so callers that start many jobs can resolve them once.
+    """
     destination_bucket_arn = f"arn:aws:s3:::{destination_bucket}"
     operation = {}
     manifest_fields = []
@@ -269,13 +560,16 @@ def start_s3_batch_operation(manifest_s3_uri: str, destination_bucket: str, iam_
     else:
         raise_error("Invalid action")
 
-    manifest_bucket_key = manifest_s3_uri.replace('s3://', '').split('/')
-    manifest_s3 = s3_client.head_object(Bucket=manifest_bucket_key[0], Key='/'.join(manifest_bucket_key[1:]))
+    if manifest_etag:
+        manifest_s3 = {'ETag': manifest_etag, **({'VersionId': manifest_version_id} if manifest_version_id else {})}
+    else:
+        manifest_bucket_key = manifest_s3_uri.replace('s3://', '').split('/')
+        manifest_s3 = s3_client.head_object(Bucket=manifest_bucket_key[0], Key='/'.join(manifest_bucket_key[1:]))
     if not manifest_s3:
         raise_error("Invalid manifest file")
 
     response = s3control_client.create_job(
-        AccountId=boto3.client('sts').get_caller_identity()['Account'],  # Get current account ID
+        AccountId=account_id or get_account_id(),  # Get current account ID
         ConfirmationRequired=confirmation_required,
         Operation=operation,
         Report={
@@ -283,7 +577,7 @@ def start_s3_batch_operation(manifest_s3_uri: str, destination_bucket: str, iam_
             'Format': 'Report_CSV_20180820',
             'Enabled': True,
             "ReportScope": "AllTasks",
-            'Prefix': 'batch-operations-report',
+            'Prefix': report_prefix,
         },
         Manifest={
             'Spec': {
@@ -296,13 +590,161 @@ def start_s3_batch_operation(manifest_s3_uri: str, destination_bucket: str, iam_
                 **({"ObjectVersionId": manifest_s3.get('VersionId')} if 'VersionId' in manifest_s3 else {})
             }
         },
-        Priority=10,
+        Priority=priority,
         RoleArn=iam_role_arn,
-        Description=f'{action} with PITR bucket {destination_bucket}'
+        Description=description or f'{action} with PITR bucket {destination_bucket}'
     )
     return response['JobId']
 
 
+def render_unload_query(action: str, athena_query: str, unload_location: str) -> str:
+    """
+    Wraps the action query in an UNLOAD statement that writes manifest ready CSV objects partitioned by bucket name
+    to unload_location. For restore action the row with highest sequencer of each key is selected in SQL, with ties
+    broken by version id. Keys are written as they are in events table, already URL encoded by S3 events.
+    """
+    query_path = f"{QUERIES_FOLDER}/{ACTION_CONFIGURATION[action]['athena_unload_query_name']}"
+    with open(query_path, 'r') as f:
+        unload_query = f.read()
+    unload_query = unload_query.replace("$QUERY", f"\n{athena_query}\n")
+    unload_query = unload_query.replace("$UNLOAD_LOCATION", unload_location)
+    return unload_query
+
+
+def list_unloaded_manifests(bucket: str, prefix: str) -> List[tuple]:
+    """
+    Lists objects written by an UNLOAD partitioned by bucket name under s3://bucket/prefix.
+    Returns a list of (bucket name, manifest S3 URI, manifest ETag) tuples, a bucket can have more than one manifest.
+    """
+    manifests = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            partition = obj['Key'][len(prefix):].split('/')[0]
+            if not partition.startswith(UNLOAD_PARTITION_PREFIX) or obj['Size'] == 0:
+                continue
+            manifests.append((partition[len(UNLOAD_PARTITION_PREFIX):], f"s3://{bucket}/{obj['Key']}", obj['ETag']))
+    return manifests
+
+
+def get_account_id() -> str:
+    return boto3.client('sts').get_caller_identity()['Account']
+
+
+def start_batch_operations(manifests: List[tuple], action: str, s3_temp_bucket: str, restore_iam_role_arn: str,
+                           batch_lambda_delete_arn: str, confirmation_required: bool,
+                           buckets_to_skip: List[str], buckets_to_restore: List[str],
+                           max_workers: int = 10, journal: PitrJournal = None,
+                           job_priority: int = 10) -> List[Dict[str, Any]]:
+    """
+    Starts one S3 Batch Operations job for each (bucket name, manifest S3 URI, manifest ETag) tuple, ETag can be
+    None. Jobs are created in parallel with max_workers threads and account id is resolved once.
+    Jobs of manifest shards (see s3.manifest_shards) write their report under a prefix of their bucket and shard.
+    Manifests with a job already recorded in journal are skipped and new jobs are recorded as soon as created.
+    Returns a summary with job id or error of each manifest, journaled jobs included, that is also written to
+    batch_operations_{action}.json.
+    """
+    journal = journal or PitrJournal()
+    batch_operation_action = ACTION_CONFIGURATION[action]["s3_batch_action"]
+    account_id = get_account_id()
+    journaled_jobs = journal.action(action)["jobs"]
+    summary = []
+    manifests_to_start = []
+    for bucket_name, manifest_s3_uri, manifest_etag in manifests:
+        if manifest_s3_uri in journaled_jobs:
+            logger.info(f"Batch operation {journaled_jobs[manifest_s3_uri]} already created for bucket: "
+                        f"{bucket_name}, skip it.")
+            # Jobs created before resume are kept in summary, so it lists every job of the run
+            summary.append({'bucket': bucket_name, 'manifest': manifest_s3_uri, 'action': batch_operation_action,
+                            'shard': parse_shard_file_name(manifest_s3_uri)[1],
+                            'job_id': journaled_jobs[manifest_s3_uri]})
+            continue
+        if bucket_name in buckets_to_skip:
+            # Skip bucket
+            continue
+        if len(buckets_to_restore) > 0 and bucket_name not in buckets_to_restore:
+            # User chooses to restore specific buckets, but this bucket isn't included. Skip it.
+            continue
+        manifests_to_start.append((bucket_name, manifest_s3_uri, manifest_etag))
+
+    def start(bucket_name: str, manifest_s3_uri: str, manifest_etag: str):
+        logger.info(f"Start batch operation for restore old version in bucket: {bucket_name}")
+        shard = parse_shard_file_name(manifest_s3_uri)[1]
+        return start_s3_batch_operation(manifest_s3_uri, bucket_name, restore_iam_role_arn,
+                                        report_bucket_arn=f"arn:aws:s3:::{s3_temp_bucket}",
+                                        action=batch_operation_action,
+                                        batch_delete_lambda_function_arn=batch_lambda_delete_arn,
+                                        confirmation_required=confirmation_required,
+                                        manifest_etag=manifest_etag, account_id=account_id,
+                                        priority=job_priority,
+                                        report_prefix=BATCH_REPORT_PREFIX if shard is None else
+                                        f"{BATCH_REPORT_PREFIX}/{bucket_name}/shard{shard:04d}",
+                                        description=None if shard is None else
+                                        f'{batch_operation_action} with PITR bucket {bucket_name} shard {shard}')
+
+    journaled_count = len(summary)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(start, *manifest): manifest for manifest in manifests_to_start}
+        for future in as_completed(futures):
+            bucket_name, manifest_s3_uri, _ = futures[future]
+            result = {'bucket': bucket_name, 'manifest': manifest_s3_uri, 'action': batch_operation_action,
+                      'shard': parse_shard_file_name(manifest_s3_uri)[1]}
+            try:
+                result['job_id'] = future.result()
+                journal.record_job(action, manifest_s3_uri, result['job_id'])
+                logger.info(f"Batch operation {result['job_id']} created for bucket: {bucket_name}")
+            except Exception as e:
+                result['error'] = str(e)
+                logger.error(f"Error creating batch operation for bucket {bucket_name}: {e}")
+            summary.append(result)
+
+    failed = [r for r in summary if 'error' in r]
+    logger.info(f"Batch operations for {action}: {len(summary) - len(failed) - journaled_count} created, "
+                f"{journaled_count} already created, {len(failed)} failed")
+    with open(f'batch_operations_{action}.json', 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def upload_manifests_and_start_batch_operations(split_files: List[str], action: str, s3_temp_bucket: str,
+                                                restore_iam_role_arn: str, batch_lambda_delete_arn: str,
+                                                confirmation_required: bool, buckets_to_skip: List[str],
+                                                buckets_to_restore: List[str], max_workers: int = 10,
+                                                journal: PitrJournal = None, manifest_shards: int = 1,
+                                                shard_by: str = "lines", shard_min_lines: int = 0,
+                                                job_priority: int = 10, shard_prefix_length: int = 0):
+    """
+    Uploads local manifests written by split of query results and starts a batch operation for each bucket.
+    With manifest_shards greater than 1, manifests with at least shard_min_lines lines are sharded by lines or key
+    range (see shard_manifest) and a batch operation is started for each shard.
+    Uploads and job creations run in parallel with max_workers threads, manifests uploaded according to journal
+    aren't uploaded again.
+    """
+    journal = journal or PitrJournal()
+    s3_bucket_batch_operation_manifest_uri = f"s3://{s3_temp_bucket}/{MANIFESTS_PREFIX}"
+    if manifest_shards > 1:
+        split_files = [shard for split_file in split_files
+                       for shard in shard_manifest(split_file, manifest_shards, shard_by, shard_min_lines,
+                                                   shard_prefix_length)]
+    uploaded_objects = dict(journal.action(action)["uploaded_manifests"])
+    split_files_to_upload = [split_file for split_file in split_files if split_file not in uploaded_objects]
+    logger.info(f"Uploading {len(split_files_to_upload)} split files to {s3_bucket_batch_operation_manifest_uri}...")
+    uploaded_objects.update(upload_to_s3(s3_temp_bucket, MANIFESTS_PREFIX, split_files_to_upload,
+                                         max_workers=max_workers,
+                                         on_upload=lambda f, o: journal.record_upload(action, f, o)))
+    logger.info("Prepare batch manifests operation complete.")
+
+    # Clean up local files
+    # for split_file in split_files:
+    #     os.remove(split_file)
+    manifests = [(os.path.basename(parse_shard_file_name(split_file)[0]).replace(f"_{action}.csv", ""),
+                  f"{s3_bucket_batch_operation_manifest_uri}{os.path.basename(split_file)}",
+                  uploaded_objects[split_file]['ETag']) for split_file in split_files]
+    return start_batch_operations(manifests, action, s3_temp_bucket, restore_iam_role_arn, batch_lambda_delete_arn,
+                                  confirmation_required, buckets_to_skip, buckets_to_restore,
+                                  max_workers=max_workers, journal=journal, job_priority=job_priority)
+
+
 def do_action(
         athena_database: str = typer.Option(..., help="The Athena database to query."),
         athena_table: str = typer.Option(..., help="The Athena table to query."),
@@ -316,20 +758,71 @@ def do_action(
                                                                               "with duplicated version at same time"),
         buckets_to_skip=typer.Option('', help="Comma separated list of buckets to skip."),
         buckets_to_restore=typer.Option('', help="Comma separated list of buckets to restore. "
-                                                  "If not used restore all buckets.")
+                                                  "If not used restore all buckets."),
+        max_rows_in_memory: int = typer.Option(0, help="If greater than 0, remove duplicated keys with an on disk "
+                                                       "external sort that keeps at most this number of rows in "
+                                                       "memory."),
+        spill_dir: str = typer.Option(None, help="Folder used for external sort runs, default system temp folder."),
+        results_source: str = typer.Option("download", help="How query results are read: 'download' the result "
+                                                            "file, 's3-stream' the result object body or "
+                                                            "'query-results' pages of GetQueryResults."),
+        unload_manifests: bool = typer.Option(False, help="If true Athena UNLOAD writes manifests partitioned by "
+                                                          "bucket name, skipping download and split of results. "
+                                                          "Restore requires "
+                                                          "--skip-duplicated-versions-at-same-time."),
+        submit_max_workers: int = typer.Option(10, help="Max parallel manifest uploads and batch job creations."),
+        query_cache_path: str = typer.Option(None, help="Local index of successful queries, if set a previous "
+                                                        "execution of same query on same table version is reused."),
+        result_reuse_max_age: int = typer.Option(0, help="If greater than 0, Athena reuses results of same query "
+                                                         "run in last minutes."),
+        crawler_name: str = typer.Option(None, help="Glue crawler of table, its last crawl is part of table "
+                                                    "version of query cache."),
+        query_timeout: int = typer.Option(0, help="If greater than 0, seconds to wait for Athena query before "
+                                                  "stop, the query keeps running and can be resumed."),
+        date_partition_key: str = typer.Option(None, help="Date partition key of table, if set queries read only "
+                                                          "partitions needed for snapshot end time."),
+        date_partition_format: str = typer.Option("yyyy-MM-dd", help="Java date format of date partition values."),
+        window_start_time: str = typer.Option(None, help="If set, objects without events since this time aren't "
+                                                         "restored or deleted, only partitions since then are read "
+                                                         "to find changed objects. Their state at snapshot end time "
+                                                         "is read from all partitions until then. "
+                                                         "Allowed format: 2025-05-30T04:00:00Z"),
+        manifest_shards: int = typer.Option(1, help="If greater than 1, manifests of a bucket are sharded in at "
+                                                    "most this number of parts, each one with its own batch job."),
+        shard_by: str = typer.Option("lines", help=f"How manifests are sharded, allowed values: "
+                                                   f"{', '.join(SHARD_BY_VALUES)}."),
+        shard_min_lines: int = typer.Option(1_000_000, help="Min number of lines of a manifest to shard it."),
+        shard_prefix_length: int = typer.Option(0, min=0, help="With shard by prefix, if greater than 0 key "
+                                                               "ranges are cut only between key prefixes of this "
+                                                               "length."),
+        job_priority: int = typer.Option(10, help="Priority of batch jobs."),
+        journal: PitrJournal = None
 ):
     """
     Runs an Athena query from a file, exports results to CSV, splits the CSV by a column,
     and uploads the split files to an S3 temp location, start glue jons.
+    Stages completed according to journal are skipped: a successful query is reused, existing local manifests
+    aren't split again and uploaded manifests and created jobs are skipped.
     """
+    journal = journal or PitrJournal()
+    action_journal = journal.action(action)
     # Read query from file
     query_path = f"{QUERIES_FOLDER}/{ACTION_CONFIGURATION[action]['athena_query_name']}"
-    s3_query_result_prefix = f"results/"
+    s3_query_result_prefix = "results/"
     s3_query_result_uri = f"s3://{s3_temp_bucket}/{s3_query_result_prefix}"
-    s3_bucket_manifest_prefix = f"manifests/"
-    s3_bucket_batch_operation_manifest_uri = f"s3://{s3_temp_bucket}/{s3_bucket_manifest_prefix}"
-    buckets_to_skip = buckets_to_skip.split(',') or []
-    buckets_to_restore = buckets_to_restore.split(',') or []
+    s3_bucket_manifest_prefix = MANIFESTS_PREFIX
+    buckets_to_skip = [b for b in buckets_to_skip.split(',') if b]
+    buckets_to_restore = [b for b in buckets_to_restore.split(',') if b]
+    if results_source not in QUERY_RESULTS_SOURCES:
+        raise_error(f"Invalid results source '{results_source}', allowed values: {', '.join(QUERY_RESULTS_SOURCES)}")
+    if shard_by not in SHARD_BY_VALUES:
+        raise_error(f"Invalid shard by '{shard_by}', allowed values: {', '.join(SHARD_BY_VALUES)}")
+    if unload_manifests and manifest_shards > 1:
+        logger.warning("With unload manifests Athena writes manifests, they aren't sharded.")
+    if unload_manifests and action == 'restore' and not skip_duplicated_versions_at_same_time:
+        # The download path fails on keys with multiple versions at same time, UNLOAD can't
+        raise_error("Unload manifests require --skip-duplicated-versions-at-same-time for restore: keys with "
+                    "multiple versions at same time restore one of them.")
 
     try:
         with open(query_path, 'r') as f:
@@ -341,73 +834,96 @@ def do_action(
     # Substitute variables in query
     athena_query = athena_query.replace("$TABLE_NAME", athena_table)
     athena_query = athena_query.replace("$SNAPSHOT_END_TIME", snapshot_end_time)
+    athena_query = render_date_filters(athena_query, date_partition_key, date_partition_format, snapshot_end_time,
+                                       window_start_time)
+
+    # A journaled query is reused unless it failed or was cancelled
+    query_execution_id = action_journal.get('query_execution_id')
+    reuse_journaled_query = (bool(query_execution_id) and
+                             action_journal.get('query_state') not in ['FAILED', 'CANCELLED'])
+
+    if unload_manifests:
+        # Athena writes one or more manifests for each bucket, client side split isn't needed. UNLOAD fails on a
+        # non-empty location, a new query writes to a new prefix since a failed one may have written files.
+        s3_unload_prefix = action_journal.get('unload_prefix') if reuse_journaled_query else None
+        s3_unload_prefix = s3_unload_prefix or f"{s3_bucket_manifest_prefix}unload/{action}-{int(time.time())}/"
+        journal.update_action(action, unload_prefix=s3_unload_prefix)
+        athena_query = render_unload_query(action, athena_query, f"s3://{s3_temp_bucket}/{s3_unload_prefix}")
 
     # 1. Run Athena Query
-    logger.info("Running Athena query...")
-    query_execution_id = run_athena_query(athena_database, athena_query, s3_query_result_uri)
-    logger.info(f"Query Execution ID: {query_execution_id}")
+    query_cache = None
+    table_version = None
+    if query_cache_path and not unload_manifests:
+        query_cache = QueryResultCache(query_cache_path)
+        table_version = get_table_version(athena_database, athena_table, crawler_name)
+
+    cached_query_execution_id = query_cache.get(athena_query, table_version) if query_cache else None
+    if reuse_journaled_query:
+        logger.info(f"Reusing Query Execution ID from journal: {query_execution_id}")
+    elif cached_query_execution_id and get_query_state(cached_query_execution_id) == 'SUCCEEDED':
+        query_execution_id = cached_query_execution_id
+        journal.update_action(action, query_execution_id=query_execution_id, query_state=None, split_files=None)
+        logger.info(f"Reusing Query Execution ID from query cache: {query_execution_id}")
+    else:
+        logger.info("Running Athena query...")
+        query_execution_id = run_athena_query(athena_database, athena_query, s3_query_result_uri,
+                                              result_reuse_max_age=0 if unload_manifests else result_reuse_max_age)
+        journal.update_action(action, query_execution_id=query_execution_id, query_state=None, split_files=None)
+        logger.info(f"Query Execution ID: {query_execution_id}")
 
     # 2. Wait for query completion
     logger.info("Waiting for query completion...")
-    state = wait_for_query_completion(query_execution_id)
+    state = wait_for_query_completion(query_execution_id, timeout=query_timeout or None)
+    journal.update_action(action, query_state=state)
     logger.info(f"Query state: {state}")
-
-    if state == 'SUCCEEDED':
+    if query_cache and state == 'SUCCEEDED':
+        query_cache.put(athena_query, table_version, query_execution_id)
+
+    if state == 'SUCCEEDED' and unload_manifests:
+        manifests = list_unloaded_manifests(s3_temp_bucket, s3_unload_prefix)
+        logger.info(f"Athena unloaded {len(manifests)} manifests to s3://{s3_temp_bucket}/{s3_unload_prefix}")
+        start_batch_operations(manifests, action, s3_temp_bucket, restore_iam_role_arn, batch_lambda_delete_arn,
+                               confirmation_required, buckets_to_skip, buckets_to_restore,
+                               max_workers=submit_max_workers, journal=journal, job_priority=job_priority)
+    elif state == 'SUCCEEDED':
         # Determine the output file key
         # Athena adds .csv and .metadata files with the query execution ID as the name
-        output_key = f"{s3_query_result_uri.split('s3://')[1]}{query_execution_id}.csv"
         local_csv_file = f'athena_results_{action}.csv'
+        key_name = '/'.join(get_query_output_location(query_execution_id).split('s3://')[1].split('/')[1:])
+        journal.update_action(action, results_location=f"s3://{s3_temp_bucket}/{key_name}")
 
-        # Download the result file
-        logger.info(f"Downloading results from s3://{s3_query_result_uri.split('s3://')[1]}{query_execution_id}.csv...")
-        key_name = '/'.join(s3_query_result_uri.split('s3://')[1].split('/')[1:]) + f"{query_execution_id}.csv"
-
-        try:
-            download_s3_file(s3_temp_bucket, key_name, local_csv_file)
-            logger.info(f"Downloaded to {local_csv_file}")
-        except Exception as e:
-            logger.error(f"Error downloading file from S3: {e}")
-            return
-
-        # 3. Split the CSV file
+        # 3. Split the query results
         try:
-            if action == 'restore':
-                logger.info(f"Splitting CSV file by column '{BUCKET_COLUMN_NAME} and remove duplicated key'...")
-                split_files = parse_athena_csv_for_restore(local_csv_file, extra_name_suffix=action,
-                                                           skip_duplicated_versions_at_same_time=
-                                                           skip_duplicated_versions_at_same_time)
+            split_files = action_journal.get('split_files')
+            if split_files and all(os.path.exists(split_file) for split_file in split_files):
+                logger.info("Reusing split files from journal")
             else:
-                logger.info(f"Splitting CSV file by column '{BUCKET_COLUMN_NAME}'...")
-                split_files = split_csv_file(local_csv_file, BUCKET_COLUMN_NAME, extra_name_suffix=action)
+                logger.info(f"Reading results of s3://{s3_temp_bucket}/{key_name} with source '{results_source}'...")
+                with open_query_results(results_source, query_execution_id, s3_temp_bucket, key_name,
+                                        local_csv_file) as reader:
+                    if action == 'restore':
+                        logger.info(f"Splitting CSV file by column '{BUCKET_COLUMN_NAME} and remove duplicated "
+                                    f"key'...")
+                        split_files = parse_athena_rows_for_restore(reader, extra_name_suffix=action,
+                                                                    skip_duplicated_versions_at_same_time=
+                                                                    skip_duplicated_versions_at_same_time,
+                                                                    max_rows_in_memory=max_rows_in_memory,
+                                                                    spill_dir=spill_dir)
+                    else:
+                        logger.info(f"Splitting CSV file by column '{BUCKET_COLUMN_NAME}'...")
+                        split_files = split_csv_rows(reader, BUCKET_COLUMN_NAME, extra_name_suffix=action)
+                # Manifests written again must be uploaded again
+                journal.update_action(action, split_files=split_files, uploaded_manifests={})
             logger.info(f"Split into files: {split_files}")
 
-            # 4. Upload split files to S3
-            logger.info(f"Uploading split files to {s3_bucket_batch_operation_manifest_uri}...")
-            upload_to_s3(s3_temp_bucket, s3_bucket_manifest_prefix, split_files)
-            logger.info("Prepare batch manifests operation complete.")
-
-            # Clean up local files
-            # os.remove(local_csv_file)
-            # for split_file in split_files:
-            #     os.remove(split_file)
-            for bucket_to_restore in split_files:
-                bucket_name = bucket_to_restore.replace(f"_{action}.csv", "")
-                if bucket_name in buckets_to_skip:
-                    # Skip bucket
-                    continue
-                if len(buckets_to_restore) > 0 and bucket_name not in buckets_to_restore:
-                    # User chooses to restore specific buckets, but this bucket isn't included. Skip it.
-                    continue
-                logger.info(f"Start batch operation for restore old version in bucket: {bucket_name}")
-                manifest_s3_uri = f"{s3_bucket_batch_operation_manifest_uri}{bucket_to_restore}"
-                batch_operation_action = ACTION_CONFIGURATION[action]["s3_batch_action"]
-                # name contains action split for get bucket name
-                bucket_to_restore = bucket_to_restore.split('_')[0]
-                start_s3_batch_operation(manifest_s3_uri, bucket_to_restore, restore_iam_role_arn,
-                                         report_bucket_arn=f"arn:aws:s3:::{s3_temp_bucket}",
-                                         action=batch_operation_action,
-                                         batch_delete_lambda_function_arn=batch_lambda_delete_arn,
-                                         confirmation_required=confirmation_required)
+            # 4. Upload split files to S3 and start batch operations
+            upload_manifests_and_start_batch_operations(split_files, action, s3_temp_bucket, restore_iam_role_arn,
+                                                        batch_lambda_delete_arn, confirmation_required,
+                                                        buckets_to_skip, buckets_to_restore,
+                                                        max_workers=submit_max_workers, journal=journal,
+                                                        manifest_shards=manifest_shards, shard_by=shard_by,
+                                                        shard_min_lines=shard_min_lines, job_priority=job_priority,
+                                                        shard_prefix_length=shard_prefix_length)
 
         except ValueError as e:
             logger.error(f"Error splitting CSV: {e}")
@@ -433,22 +949,96 @@ def pitr(
 
         crawler_name: str = typer.Option(None, help="Glue crawler name, if not provided skip start crawler before "
                                                     "run queries."),
-        crawler_polling_interval: int = typer.Option(10, help="Crawler status polling interval"),
+        crawler_polling_interval: int = typer.Option(10, min=1, help="Max crawler status polling interval, polls "
+                                                                     "start after 1 second with exponential "
+                                                                     "backoff"),
         crawler_timeout: int = typer.Option(900, help="Timeout in seconds before mark as filed crawler execution"),
         dry_run: bool = typer.Option(False, help="Timeout in seconds before mark as filed crawler execution"),
         skip_duplicated_versions_at_same_time: bool = typer.Option(False, help="If true skip restore of object "
                                                                               "with duplicated version at same time"),
         buckets_to_skip=typer.Option('', help="Comma separated list of buckets to skip."),
         buckets_to_restore=typer.Option('', help="Comma separated list of buckets to restore. "
-                                                "If not used restore all buckets.")
+                                                "If not used restore all buckets."),
+        max_rows_in_memory: int = typer.Option(0, help="If greater than 0, remove duplicated keys with an on disk "
+                                                       "external sort that keeps at most this number of rows in "
+                                                       "memory."),
+        spill_dir: str = typer.Option(None, help="Folder used for external sort runs, default system temp folder."),
+        results_source: str = typer.Option("download", help="How query results are read: 'download' the result "
+                                                            "file, 's3-stream' the result object body or "
+                                                            "'query-results' pages of GetQueryResults."),
+        unload_manifests: bool = typer.Option(False, help="If true Athena UNLOAD writes manifests partitioned by "
+                                                          "bucket name, skipping download and split of results. "
+                                                          "Restore requires "
+                                                          "--skip-duplicated-versions-at-same-time."),
+        submit_max_workers: int = typer.Option(10, help="Max parallel manifest uploads and batch job creations."),
+        journal_path: str = typer.Option("pitr_journal.json", help="Local journal of run stages used by resume."),
+        query_cache_path: str = typer.Option(None, help="Local index of successful queries, if set a previous "
+                                                        "execution of same query on same table version is reused. "
+                                                        "Table version doesn't change when new events are added to "
+                                                        "existing partitions: use it only when no events arrived "
+                                                        "since the cached run, e.g. re-running a failed restore."),
+        result_reuse_max_age: int = typer.Option(0, help="If greater than 0, Athena reuses results of same query "
+                                                         "run in last minutes."),
+        query_timeout: int = typer.Option(0, help="If greater than 0, seconds to wait for Athena query before "
+                                                  "stop, the query keeps running and can be resumed."),
+        partition_mode: str = typer.Option("crawler", help=f"How new events partitions are added before queries, "
+                                                           f"allowed values: {', '.join(PARTITION_MODES)}. "
+                                                           f"crawler runs crawler-name, register adds only new "
+                                                           f"partitions, projection configures partition projection "
+                                                           f"on table."),
+        date_partition_key: str = typer.Option(None, help="Date partition key of table, if set queries read only "
+                                                          "partitions needed for snapshot end time."),
+        date_partition_format: str = typer.Option("yyyy-MM-dd", help="Java date format of date partition values."),
+        window_start_time: str = typer.Option(None, help="If set, objects without events since this time aren't "
+                                                         "restored or deleted, only partitions since then are read "
+                                                         "to find changed objects. Their state at snapshot end time "
+                                                         "is read from all partitions until then. "
+                                                         "Allowed format: 2025-05-30T04:00:00Z"),
+        manifest_shards: int = typer.Option(1, help="If greater than 1, manifests of a bucket are sharded in at "
+                                                    "most this number of parts, each one with its own batch job."),
+        shard_by: str = typer.Option("lines", help=f"How manifests are sharded, allowed values: "
+                                                   f"{', '.join(SHARD_BY_VALUES)}."),
+        shard_min_lines: int = typer.Option(1_000_000, help="Min number of lines of a manifest to shard it."),
+        shard_prefix_length: int = typer.Option(0, min=0, help="With shard by prefix, if greater than 0 key "
+                                                               "ranges are cut only between key prefixes of this "
+                                                               "length."),
+        job_priority: int = typer.Option(10, help="Priority of batch jobs."),
+        resume: bool = typer.Option(False, help="Resume run of journal, skipping completed stages: crawler, "
+                                                "successful queries, split, uploaded manifests and created jobs.")
 ):
     if not time_validation_regex.match(snapshot_end_time):
         raise_error("Invalid snapshot_end_time, use allowed format: 2025-05-30T04:00:00Z ", exit=True)
-
-    if crawler_name:
-        start_crawler_glue(crawler_name,
-                           polling_interval=crawler_polling_interval,
-                           timeout=crawler_timeout)
+    if window_start_time and not time_validation_regex.match(window_start_time):
+        raise_error("Invalid window_start_time, use allowed format: 2025-05-30T04:00:00Z ", exit=True)
+    if partition_mode not in PARTITION_MODES:
+        raise_error(f"Invalid partition mode '{partition_mode}', allowed values: {', '.join(PARTITION_MODES)}")
+    if partition_mode == "projection" and not date_partition_key:
+        raise_error("date-partition-key it's required by partition projection")
+
+    journal = PitrJournal.open(journal_path, resume, athena_database=athena_database, athena_table=athena_table,
+                               s3_temp_bucket=s3_temp_bucket, snapshot_end_time=snapshot_end_time,
+                               unload_manifests=unload_manifests, date_partition_key=date_partition_key,
+                               window_start_time=window_start_time)
+
+    if partition_mode != "crawler" and journal.crawler_completed:
+        logger.info(f"Partitions already updated according to journal, skip {partition_mode}.")
+    elif partition_mode != "crawler":
+        try:
+            if partition_mode == "register":
+                register_new_partitions(glue_client, s3_client, athena_database, athena_table, date_partition_key)
+            else:
+                configure_partition_projection(glue_client, s3_client, athena_database, athena_table,
+                                               date_partition_key, date_partition_format)
+        except (ValueError, ClientError) as e:
+            raise_error(f"Error updating partitions of {athena_database}.{athena_table}: {e}")
+        journal.set_crawler_completed()
+    elif crawler_name and journal.crawler_completed:
+        logger.info(f"Crawler '{crawler_name}' already completed according to journal, skip it.")
+    elif crawler_name:
+        if start_crawler_glue(crawler_name,
+                              polling_interval=crawler_polling_interval,
+                              timeout=crawler_timeout):
+            journal.set_crawler_completed()
     do_action(
         athena_database=athena_database,
         athena_table=athena_table,
@@ -460,7 +1050,25 @@ def pitr(
         confirmation_required=dry_run,
         skip_duplicated_versions_at_same_time=skip_duplicated_versions_at_same_time,
         buckets_to_skip=buckets_to_skip,
-        buckets_to_restore=buckets_to_restore
+        buckets_to_restore=buckets_to_restore,
+        max_rows_in_memory=max_rows_in_memory,
+        spill_dir=spill_dir,
+        results_source=results_source,
+        unload_manifests=unload_manifests,
+        submit_max_workers=submit_max_workers,
+        query_cache_path=query_cache_path,
+        result_reuse_max_age=result_reuse_max_age,
+        query_timeout=query_timeout,
+        date_partition_key=date_partition_key,
+        date_partition_format=date_partition_format,
+        window_start_time=window_start_time,
+        manifest_shards=manifest_shards,
+        shard_by=shard_by,
+        shard_min_lines=shard_min_lines,
+        shard_prefix_length=shard_prefix_length,
+        job_priority=job_priority,
+        crawler_name=crawler_name,
+        journal=journal
     )
     if not skip_delete_objects:
         do_action(
@@ -472,11 +1080,80 @@ def pitr(
             restore_iam_role_arn=restore_iam_role_arn,
             batch_lambda_delete_arn=batch_lambda_delete_arn,
             confirmation_required=dry_run,
+            skip_duplicated_versions_at_same_time=skip_duplicated_versions_at_same_time,
             buckets_to_skip=buckets_to_skip,
-            buckets_to_restore=buckets_to_restore
+            buckets_to_restore=buckets_to_restore,
+            max_rows_in_memory=max_rows_in_memory,
+            spill_dir=spill_dir,
+            results_source=results_source,
+            unload_manifests=unload_manifests,
+            submit_max_workers=submit_max_workers,
+            query_cache_path=query_cache_path,
+            result_reuse_max_age=result_reuse_max_age,
+            query_timeout=query_timeout,
+            date_partition_key=date_partition_key,
+            date_partition_format=date_partition_format,
+            window_start_time=window_start_time,
+            manifest_shards=manifest_shards,
+            shard_by=shard_by,
+            shard_min_lines=shard_min_lines,
+            shard_prefix_length=shard_prefix_length,
+            job_priority=job_priority,
+            crawler_name=crawler_name,
+            journal=journal
         )
 
 
+def _latest_version_event(bucket_name: str, key: str, latest_version: dict) -> Dict[str, Any]:
+    event_time_iso = latest_version['LastModified'].isoformat(timespec='seconds').replace('+00:00', 'Z')
+    return {
+        "eventTime": event_time_iso,
+        "bucketName": bucket_name,
+        "key": key,
+        "version": latest_version.get("VersionId", "null"),
+        "eventName": "Object Created",
+        "sourceIPAddress": "10.202.9.225"
+    }
+
+
+def get_scan_prefix(key: str, prefix_depth: int) -> str:
+    """Returns the first prefix_depth folders of key, keys with fewer folders return their own folder."""
+    folders = key.split('/')[:-1]
+    return ''.join(f"{folder}/" for folder in folders[:prefix_depth])
+
+
+def get_latest_s3_versions_by_prefix(s3_client: boto3.client, bucket_name: str, prefix: str,
+                                     keys: set) -> List[Dict[str, Any]]:
+    """
+    Fetches the latest version of each key in keys with a single paginated list_object_versions of prefix.
+    Only IsLatest entries of requested keys are kept, other keys under prefix are ignored. With empty prefix
+    (keys in bucket root) only root objects are listed.
+    Returns a list with the same data of get_latest_s3_version for each found key.
+    """
+    results = []
+    pending_keys = set(keys)
+    list_args = {'Bucket': bucket_name, 'Prefix': prefix, **({} if prefix else {'Delimiter': '/'})}
+    try:
+        paginator = s3_client.get_paginator('list_object_versions')
+        for page in paginator.paginate(**list_args):
+            for ver in page.get("Versions", []) + page.get("DeleteMarkers", []):
+                if ver.get('IsLatest') and ver['Key'] in pending_keys:
+                    pending_keys.discard(ver['Key'])
+                    results.append(_latest_version_event(bucket_name, ver['Key'], ver))
+            if not pending_keys:
+                break
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchBucket':
+            logger.error(f"Bucket '{bucket_name}' not found. Skipping {len(keys)} keys under '{prefix}'.")
+        else:
+            logger.error(f"AWS error processing {bucket_name}/{prefix}: {e}")
+        return results
+
+    for key in pending_keys:
+        logger.warning(f"No versions found for {bucket_name}/{key}. Skipping.")
+    return results
+
+
 def get_latest_s3_version(s3_client: boto3.client, bucket_name: str, key: str) -> Dict[str, Any] | None:
     """
     Fetches the latest version information for a given S3 object.
@@ -503,15 +1180,7 @@ def get_latest_s3_version(s3_client: boto3.client, bucket_name: str, key: str) -
             latest_version = all_versions[0]
 
         if latest_version:
-            event_time_iso = latest_version['LastModified'].isoformat(timespec='seconds').replace('+00:00', 'Z')
-            return {
-                "eventTime": event_time_iso,
-                "bucketName": bucket_name,
-                "key": key,
-                "version": latest_version.get("VersionId", "null"),
-                "eventName": "Object Created",
-                "sourceIPAddress": "10.202.9.225"
-            }
+            return _latest_version_event(bucket_name, key, latest_version)
         else:
             logger.warning(f"No versions found for {bucket_name}/{key}. Skipping.")
             return None
@@ -527,97 +1196,187 @@ def get_latest_s3_version(s3_client: boto3.client, bucket_name: str, key: str) -
         return None
 
 
+def _object_hash(bucket_name: str, key: str) -> int:
+    """128 bit hash of bucket/key, used to dedup millions of keys without keeping key strings in memory."""
+    return int.from_bytes(hashlib.blake2b(f"{bucket_name}/{key}".encode('utf-8'), digest_size=16).digest(), 'big')
+
+
+def read_ingest_input_objects(input_csv: str) -> Iterator[tuple]:
+    """Streams (row index, bucket name, key) of rows of the ingest input CSV, keys are URL decoded."""
+    with open(input_csv, mode='r', newline='', encoding='utf-8') as infile:
+        reader = csv.DictReader(infile)
+        for row_index, row in enumerate(reader):
+            bucket_name = row.get("bucketName")
+            key = unquote(row.get("key") or "")
+
+            if not bucket_name or not key:
+                logger.warning(f"Skipping row due to missing bucketName or key: {row}")
+                continue
+            yield row_index, bucket_name, key
+
+
+def _write_ingest_checkpoint(checkpoint_path: str, rows_done: int, output_offset: int):
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({"rows_done": rows_done, "output_offset": output_offset}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def stream_latest_s3_versions(s3_client: boto3.client, input_csv: str, output_json: str, max_workers: int = 10,
+                              max_in_flight: int = 1000, resume: bool = False, checkpoint_interval: int = 1000) -> int:
+    """
+    Streaming pipeline of pitr ingest in 'key' scan mode.
+
+    Input rows are read one at a time and deduplicated with a set of 128 bit hashes of bucket/key, at most
+    max_in_flight lookups are submitted at the same time and results are written to output_json in input order as
+    soon as they are ready, so memory doesn't depend on number of keys.
+    Every checkpoint_interval results a checkpoint with the number of input rows done and output file offset is
+    written to {output_json}.checkpoint. With resume, output is truncated to checkpoint offset and rows already done
+    are only used to rebuild dedup set.
+    Returns number of entries written.
+    """
+    checkpoint_path = f"{output_json}.checkpoint"
+    rows_done = 0
+    output_offset = 0
+    if resume and os.path.exists(checkpoint_path) and os.path.exists(output_json):
+        with open(checkpoint_path, 'r') as f:
+            checkpoint = json.load(f)
+        rows_done, output_offset = checkpoint["rows_done"], checkpoint["output_offset"]
+        logger.info(f"Resuming from checkpoint: {rows_done} input rows done, output offset {output_offset}")
+
+    seen_objects = set()
+    in_flight = deque()
+    written = 0
+    last_checkpoint = 0
+
+    # boto3 clients are thread-safe for *concurrent* calls, but not for *modification*.
+    # Here, we are only making calls, so a single client instance passed to multiple threads is generally fine.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            open(output_json, 'r+' if output_offset else 'w', encoding='utf-8') as outfile:
+        outfile.seek(output_offset)
+        outfile.truncate()
+
+        def write_first_in_flight():
+            nonlocal written, last_checkpoint
+            row_index, obj_path, future = in_flight.popleft()
+            try:
+                result = future.result()
+                if result:
+                    outfile.write(json.dumps(result) + '\n')
+                    written += 1
+            except Exception as exc:
+                logger.error(f'{obj_path} generated an exception: {exc}')
+
+            if written - last_checkpoint >= checkpoint_interval:
+                outfile.flush()
+                _write_ingest_checkpoint(checkpoint_path, row_index + 1, outfile.tell())
+                last_checkpoint = written
+                logger.info(f"Processed {row_index + 1} input rows, written {written} entries...")
+
+        rows_read = rows_done
+        for row_index, bucket_name, key in read_ingest_input_objects(input_csv):
+            rows_read = row_index + 1
+            object_hash = _object_hash(bucket_name, key)
+            if object_hash in seen_objects:
+                continue
+            seen_objects.add(object_hash)
+            if row_index < rows_done:
+                # Already processed before checkpoint
+                continue
+
+            if len(in_flight) >= max_in_flight:
+                write_first_in_flight()
+            in_flight.append((row_index, f"{bucket_name}/{key}",
+                              executor.submit(get_latest_s3_version, s3_client, bucket_name, key)))
+
+        while in_flight:
+            write_first_in_flight()
+
+        outfile.flush()
+        _write_ingest_checkpoint(checkpoint_path, max(rows_read, rows_done), outfile.tell())
+
+    logger.info(f"Identified {len(seen_objects)} unique bucketName/key pairs.")
+    return written
+
+
+def scan_latest_s3_versions_by_prefix(s3_client: boto3.client, input_csv: str, output_json: str,
+                                      max_workers: int = 10, prefix_depth: int = 1) -> int:
+    """
+    Pitr ingest in 'prefix' scan mode: keys are grouped by bucket and common prefix and versions are listed once
+    for each group, results are written to output_json as soon as a group is done.
+    Returns number of entries written.
+    """
+    keys_by_prefix: Dict[tuple, set] = {}
+    for _, bucket_name, key in read_ingest_input_objects(input_csv):
+        keys_by_prefix.setdefault((bucket_name, get_scan_prefix(key, prefix_depth)), set()).add(key)
+
+    written = 0
+    logger.info(f"Starting parallel S3 version scans of {len(keys_by_prefix)} prefixes with {max_workers} "
+                f"workers...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            open(output_json, 'w', encoding='utf-8') as outfile:
+        futures = {
+            executor.submit(get_latest_s3_versions_by_prefix, s3_client, bucket_name, prefix, keys):
+                f"{bucket_name}/{prefix}"
+            for (bucket_name, prefix), keys in keys_by_prefix.items()
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            try:
+                for entry in future.result():
+                    outfile.write(json.dumps(entry) + '\n')
+                    written += 1
+            except Exception as exc:
+                logger.error(f'{futures[future]} generated an exception: {exc}')
+            if i % 100 == 0:
+                logger.info(f"Processed {i}/{len(keys_by_prefix)} prefixes...")
+    return written
+
+
 def pitr_ingest_existing_objects_with_multiple_versions_at_same_time(
         input_csv: str = typer.Argument(..., help="Path to the input CSV file."),
         output_json: str = typer.Option(None, help="Path to the output JSON file."),
         max_workers: int = typer.Option(10, help="Maximum number of parallel workers for S3 API calls."),
-
+        scan_mode: str = typer.Option("key", help="'key' lists versions of each key, 'prefix' groups keys by "
+                                                  "bucket and common prefix and lists versions once per group."),
+        prefix_depth: int = typer.Option(1, help="With 'prefix' scan mode, number of key folders used for group "
+                                                 "keys."),
+        max_in_flight: int = typer.Option(1000, help="With 'key' scan mode, max number of lookups submitted and "
+                                                     "not yet written."),
+        resume: bool = typer.Option(False, help="With 'key' scan mode, resume from checkpoint of a previous run "
+                                                "with same input and output."),
+        checkpoint_interval: int = typer.Option(1000, help="With 'key' scan mode, number of written entries "
+                                                           "between checkpoints."),
 ):
     """
      Reads a CSV, finds the latest S3 object version for each unique bucketName/key pair,
      and outputs the results to a JSON file.
      """
     s3_client = AWSHelper.get_client('s3')
-    processed_data: List[Dict[str, Any]] = []
 
     if not output_json:
         output_json = f"{''.join(input_csv.split('.')[0])}-pitr-events"
+    if scan_mode not in ["key", "prefix"]:
+        raise_error(f"Invalid scan mode '{scan_mode}', allowed values: key, prefix")
 
     logger.info(f"Starting to process CSV file: {input_csv}")
-
-    unique_objects: Dict[str, Dict[str, str]] = {}
     try:
-        with open(input_csv, mode='r', newline='', encoding='utf-8') as infile:
-            reader = csv.DictReader(infile)
-            for row in reader:
-                bucket_name = row.get("bucketName")
-                key = unquote(row.get("key"))
-
-                if not bucket_name or not key:
-                    logger.warning(f"Skipping row due to missing bucketName or key: {row}")
-                    continue
-
-                unique_key = f"{bucket_name}/{key}"
-                if unique_key not in unique_objects:
-                    unique_objects[unique_key] = {"bucketName": bucket_name, "key": key}
-
-        logger.info(f"Identified {len(unique_objects)} unique bucketName/key pairs.")
-
+        if scan_mode == "prefix":
+            written = scan_latest_s3_versions_by_prefix(s3_client, input_csv, output_json, max_workers=max_workers,
+                                                        prefix_depth=prefix_depth)
+        else:
+            logger.info(f"Starting parallel S3 version lookups with {max_workers} workers...")
+            written = stream_latest_s3_versions(s3_client, input_csv, output_json, max_workers=max_workers,
+                                                max_in_flight=max_in_flight, resume=resume,
+                                                checkpoint_interval=checkpoint_interval)
     except FileNotFoundError:
         logger.error(f"Error: Input CSV file not found at {input_csv}")
         raise typer.Exit(code=1)
     except Exception as e:
-        logger.error(f"An error occurred while reading CSV: {e}")
+        logger.error(f"An error occurred while processing CSV: {e}")
         raise typer.Exit(code=1)
 
-    # Use ThreadPoolExecutor for parallel S3 calls
-    # boto3 clients are thread-safe for calls, but each thread needs its own client
-    # or you can share one if it's not being modified. For simple gets, sharing is fine.
-    # However, it's generally safer and clearer to create a new client for each worker in a thread pool.
-    # boto3 docs suggest creating a client per thread for most use cases,
-    # or using Session to explicitly manage thread-safety.
-    # For this pattern, recreating client in the worker function is often preferred.
-
-    # We will pass the bucket_name and key to the worker function.
-    # The worker function itself will create a boto3 client if needed,
-    # or we can create one per thread with a callable initializer for the pool.
-    # For simplicity and robust threading, let's pass the client to the worker.
-    # Note: boto3 clients are thread-safe for *concurrent* calls, but not for *modification*.
-    # Here, we are only making calls, so a single client instance passed to multiple threads is generally fine.
-    # If you encounter issues with a shared client in a high-concurrency scenario, consider
-    # instantiating `boto3.client("s3")` inside `get_latest_s3_version`.
-
-    logger.info(f"Starting parallel S3 version lookups with {max_workers} workers...")
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {
-            executor.submit(get_latest_s3_version, s3_client, obj["bucketName"], obj["key"]):
-                f"{obj['bucketName']}/{obj['key']}"
-            for obj in unique_objects.values()
-        }
-
-        for i, future in enumerate(as_completed(futures), 1):
-            obj_path = futures[future]
-            try:
-                result = future.result()
-                if result:
-                    processed_data.append(result)
-            except Exception as exc:
-                logger.error(f'{obj_path} generated an exception: {exc}')
-
-            if i % 100 == 0:
-                logger.info(f"Processed {i}/{len(unique_objects)} objects...")
-
-    logger.info(f"Finished processing S3 versions. Writing {len(processed_data)} entries to {output_json}")
-
-    try:
-        with open(output_json, 'w', encoding='utf-8') as outfile:
-            for entry in processed_data:
-                outfile.write(json.dumps(entry) + '\n')
-
-        logger.info("Processing complete.")
-    except Exception as e:
-        logger.error(f"An error occurred while writing output JSON: {e}")
-        raise typer.Exit(code=1)
+    logger.info(f"Finished processing S3 versions. Written {written} entries to {output_json}")
+    logger.info("Processing complete.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import typer
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class PitrJournal:
+    """
+    Local journal of a pitr run, used to resume a failed run without repeating completed stages.
+
+    For each action (restore, delete) the journal records query execution id and state, results location, local
+    manifests, uploaded manifests with their ETag and created batch jobs. The journal is saved to path after every
+    update, writing a temporary file and replacing the previous one, so a crash never leaves a partial journal.
+    Without path the journal is kept only in memory.
+    """
+
+    def __init__(self, path: Optional[str] = None, data: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self.data = data or {"parameters": {}, "crawler_completed": False, "actions": {}}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path: str, resume: bool, **parameters) -> 'PitrJournal':
+        """
+        Opens journal at path. With resume the existing journal is loaded and parameters must match parameters of
+        the journaled run, otherwise a new journal is created.
+        """
+        if resume and os.path.exists(path):
+            with open(path, 'r') as f:
+                journal = cls(path, json.load(f))
+            different_parameters = [k for k, v in parameters.items() if journal.data["parameters"].get(k) != v]
+            if different_parameters:
+                logger.error(f"Can't resume run of journal {path}, parameters changed: {different_parameters}")
+                raise typer.Exit(code=1)
+            logger.info(f"Resuming run of journal {path}")
+            return journal
+        if resume:
+            logger.warning(f"Journal {path} not found, starting a new run.")
+        journal = cls(path)
+        journal.data["parameters"] = parameters
+        journal.save()
+        return journal
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @property
+    def crawler_completed(self) -> bool:
+        return self.data["crawler_completed"]
+
+    def set_crawler_completed(self):
+        with self._lock:
+            self.data["crawler_completed"] = True
+            self.save()
+
+    def action(self, action: str) -> Dict[str, Any]:
+        """Returns journal of an action: query_execution_id, query_state, results_location, unload_prefix,
+        split_files, uploaded_manifests and jobs."""
+        return self.data["actions"].setdefault(action, {"uploaded_manifests": {}, "jobs": {}})
+
+    def update_action(self, action: str, **values):
+        with self._lock:
+            self.action(action).update(values)
+            self.save()
+
+    def record_upload(self, action: str, split_file: str, uploaded_object: Dict[str, str]):
+        with self._lock:
+            self.action(action)["uploaded_manifests"][split_file] = uploaded_object
+            self.save()
+
+    def record_job(self, action: str, manifest_s3_uri: str, job_id: str):
+        with self._lock:
+            self.action(action)["jobs"][manifest_s3_uri] = job_id
+            self.save()
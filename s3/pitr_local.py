@@ -0,0 +1,232 @@
+"""
+Local PITR planner.
+
+Runs the logic of get_files_to_restore.sql and get_files_to_delete.sql in a single streaming pass over local exports
+of S3 EventBridge events, without Glue crawler and Athena. Results go through the same dedup/split stage of
+do_action, so manifests are the same produced by pitr command and can be uploaded to start batch operations.
+
+Supported inputs (optionally gzip compressed, with .gz extension):
+    - JSON lines of EventBridge events ("detail-type", "time", "detail": {"bucket": ..., "object": ...})
+    - JSON lines written by pitr-ingest-existing-objects-with-multiple-versions-at-same-time
+    - CSV with the columns of the Athena events table (bucketname, key, version, eventname, eventtime, sequencer)
+"""
+import csv
+import gzip
+import json
+from typing import Dict, Iterable, Iterator, List
+
+import typer
+
+from s3.manifest_shards import SHARD_BY_VALUES
+from s3.pitr import (parse_athena_rows_for_restore, split_csv_rows, upload_manifests_and_start_batch_operations,
+                     raise_error, time_validation_regex, BUCKET_COLUMN_NAME, SEQUENCER_COLUMN_NAME)
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+OBJECT_CREATED = "Object Created"
+OBJECT_DELETED = "Object Deleted"
+EVENT_FIELDNAMES = [BUCKET_COLUMN_NAME, 'key', 'version', 'eventname', 'eventtime', SEQUENCER_COLUMN_NAME]
+RESTORE_FIELDNAMES = [BUCKET_COLUMN_NAME, 'key', 'version', SEQUENCER_COLUMN_NAME]
+DELETE_FIELDNAMES = [BUCKET_COLUMN_NAME, 'key']
+
+
+class RowsReader:
+    """Wraps an iterable of dict rows exposing fieldnames like csv.DictReader."""
+
+    def __init__(self, fieldnames: List[str], rows: Iterable[dict]):
+        self.fieldnames = fieldnames
+        self._rows = rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+def _open_text(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', newline='', encoding='utf-8')
+    return open(path, 'r', newline='', encoding='utf-8')
+
+
+def normalize_event(event: dict) -> dict:
+    """Returns an event as a row of the Athena events table."""
+    if 'detail' in event:
+        detail = event['detail']
+        s3_object = detail.get('object', {})
+        return {
+            BUCKET_COLUMN_NAME: detail.get('bucket', {}).get('name', ''),
+            'key': s3_object.get('key', ''),
+            'version': s3_object.get('version-id', ''),
+            'eventname': event.get('detail-type', ''),
+            'eventtime': event.get('time', ''),
+            SEQUENCER_COLUMN_NAME: s3_object.get('sequencer', '')
+        }
+    if 'bucketName' in event:
+        return {
+            BUCKET_COLUMN_NAME: event['bucketName'],
+            'key': event.get('key', ''),
+            'version': event.get('version', ''),
+            'eventname': event.get('eventName', ''),
+            'eventtime': event.get('eventTime', ''),
+            SEQUENCER_COLUMN_NAME: event.get('sequencer', '')
+        }
+    return {column: event.get(column) or '' for column in EVENT_FIELDNAMES}
+
+
+def read_events(paths: List[str]) -> Iterator[dict]:
+    """Streams events of local exports as rows of the Athena events table."""
+    for path in paths:
+        logger.info(f"Reading events from {path}")
+        with _open_text(path) as f:
+            if path.removesuffix('.gz').endswith('.csv'):
+                for row in csv.DictReader(f):
+                    yield normalize_event(row)
+            else:
+                for line in f:
+                    if line.strip():
+                        yield normalize_event(json.loads(line))
+
+
+class LocalPitrPlanner:
+    """
+    Streaming engine with the same semantics of PITR queries.
+
+    Events are consumed once and for each bucket/key only the state needed by queries is kept:
+        - rows with the last event time before or at snapshot end time (versionAtTS)
+        - last event time and versions with that time (latestVersion)
+        - last event before or at snapshot end time and last event (StateAtSnapshot and CurrentState)
+    Event times are compared as strings, like in Athena queries.
+    """
+
+    def __init__(self, snapshot_end_time: str):
+        self.snapshot_end_time = snapshot_end_time
+        # (bucket name, key) -> [snapshot time, snapshot rows, latest time, latest versions, snapshot event,
+        #                        latest event]
+        self._state: Dict[tuple, list] = {}
+        self.events_count = 0
+
+    def add(self, event: dict):
+        self.events_count += 1
+        state_key = (event[BUCKET_COLUMN_NAME], event['key'])
+        event_time = event['eventtime']
+        row = (event['version'], event['eventname'], event[SEQUENCER_COLUMN_NAME])
+        state = self._state.get(state_key)
+        if state is None:
+            state = self._state[state_key] = [None, [], None, set(), None, None]
+
+        if event_time <= self.snapshot_end_time:
+            if state[0] is None or event_time > state[0]:
+                state[0] = event_time
+                state[1] = [row]
+            elif event_time == state[0]:
+                state[1].append(row)
+            if state[4] is None or event_time >= state[4][1]:
+                state[4] = (event['eventname'], event_time)
+
+        if state[2] is None or event_time > state[2]:
+            state[2] = event_time
+            state[3] = {event['version']}
+        elif event_time == state[2]:
+            state[3].add(event['version'])
+        if state[5] is None or event_time >= state[5][1]:
+            state[5] = (event['eventname'], event_time)
+
+    def add_all(self, events: Iterable[dict]):
+        for event in events:
+            self.add(event)
+        logger.info(f"Processed {self.events_count} events for {len(self._state)} objects")
+
+    def files_to_restore(self) -> Iterator[dict]:
+        """Same rows of get_files_to_restore.sql."""
+        latest_versions = set()
+        for state in self._state.values():
+            latest_versions.update(state[3])
+
+        for (bucket_name, key), state in self._state.items():
+            if key == '':
+                continue
+            for version, event_name, sequencer in state[1]:
+                if event_name != OBJECT_DELETED and version not in latest_versions:
+                    yield {BUCKET_COLUMN_NAME: bucket_name, 'key': key, 'version': version,
+                           SEQUENCER_COLUMN_NAME: sequencer}
+
+    def files_to_delete(self) -> Iterator[dict]:
+        """Same rows of get_files_to_delete.sql."""
+        for (bucket_name, key), state in self._state.items():
+            snapshot_event, latest_event = state[4], state[5]
+            if latest_event[0] != OBJECT_CREATED or latest_event[1] <= self.snapshot_end_time:
+                continue
+            if snapshot_event is None or snapshot_event[0] == OBJECT_DELETED:
+                yield {BUCKET_COLUMN_NAME: bucket_name, 'key': key}
+
+
+def pitr_local(
+        events_paths: List[str] = typer.Argument(..., help="Local exports of S3 events (.json, .jsonl or .csv, "
+                                                           "optionally .gz)."),
+        snapshot_end_time: str = typer.Option(..., help="End time to restore window. "
+                                                        "Allowed format: 2025-05-30T04:00:00Z"),
+        skip_delete_objects: bool = typer.Option(False, help="Don't plan delete of objects created after snapshot"),
+        skip_duplicated_versions_at_same_time: bool = typer.Option(False, help="If true skip restore of object "
+                                                                              "with duplicated version at same time"),
+        max_rows_in_memory: int = typer.Option(0, help="If greater than 0, remove duplicated keys with an on disk "
+                                                       "external sort that keeps at most this number of rows in "
+                                                       "memory."),
+        spill_dir: str = typer.Option(None, help="Folder used for external sort runs, default system temp folder."),
+        s3_temp_bucket: str = typer.Option(None, help="If set, manifests are uploaded to this bucket and batch "
+                                                      "operations are started, otherwise only local manifests "
+                                                      "are written."),
+        restore_iam_role_arn: str = typer.Option(None, help="IAM role used for batch operations"),
+        batch_lambda_delete_arn: str = typer.Option(None, help="ARN of lambda for delete in batch operation"),
+        dry_run: bool = typer.Option(False, help="If true batch operations require confirmation before start"),
+        buckets_to_skip: str = typer.Option('', help="Comma separated list of buckets to skip."),
+        buckets_to_restore: str = typer.Option('', help="Comma separated list of buckets to restore. "
+                                                        "If not used restore all buckets."),
+        submit_max_workers: int = typer.Option(10, help="Max parallel manifest uploads and batch job creations."),
+        manifest_shards: int = typer.Option(1, help="If greater than 1, manifests of a bucket are sharded in at "
+                                                    "most this number of parts, each one with its own batch job."),
+        shard_by: str = typer.Option("lines", help=f"How manifests are sharded, allowed values: "
+                                                   f"{', '.join(SHARD_BY_VALUES)}."),
+        shard_min_lines: int = typer.Option(1_000_000, help="Min number of lines of a manifest to shard it."),
+        shard_prefix_length: int = typer.Option(0, min=0, help="With shard by prefix, if greater than 0 key "
+                                                               "ranges are cut only between key prefixes of this "
+                                                               "length."),
+        job_priority: int = typer.Option(10, help="Priority of batch jobs.")
+):
+    """
+    Plans a PITR from local exports of S3 events, without Glue crawler and Athena.
+    Writes the same manifests of pitr command in the current folder and optionally starts batch operations.
+    """
+    if not time_validation_regex.match(snapshot_end_time):
+        raise_error("Invalid snapshot_end_time, use allowed format: 2025-05-30T04:00:00Z ", exit=True)
+    if s3_temp_bucket and not restore_iam_role_arn:
+        raise_error("restore-iam-role-arn it's required to start batch operations")
+
+    planner = LocalPitrPlanner(snapshot_end_time)
+    planner.add_all(read_events(events_paths))
+
+    manifests_by_action = {
+        "restore": parse_athena_rows_for_restore(RowsReader(RESTORE_FIELDNAMES, planner.files_to_restore()),
+                                                 extra_name_suffix="restore",
+                                                 skip_duplicated_versions_at_same_time=
+                                                 skip_duplicated_versions_at_same_time,
+                                                 max_rows_in_memory=max_rows_in_memory, spill_dir=spill_dir)
+    }
+    if not skip_delete_objects:
+        manifests_by_action["delete"] = split_csv_rows(RowsReader(DELETE_FIELDNAMES, planner.files_to_delete()),
+                                                       BUCKET_COLUMN_NAME, extra_name_suffix="delete")
+
+    for action, split_files in manifests_by_action.items():
+        logger.info(f"Manifests for {action}: {split_files}")
+        if s3_temp_bucket:
+            upload_manifests_and_start_batch_operations(split_files, action, s3_temp_bucket, restore_iam_role_arn,
+                                                        batch_lambda_delete_arn, dry_run,
+                                                        [b for b in buckets_to_skip.split(',') if b],
+                                                        [b for b in buckets_to_restore.split(',') if b],
+                                                        max_workers=submit_max_workers,
+                                                        manifest_shards=manifest_shards, shard_by=shard_by,
+                                                        shard_min_lines=shard_min_lines, job_priority=job_priority,
+                                                        shard_prefix_length=shard_prefix_length)
+
+
+if __name__ == "__main__":
+    typer.run(pitr_local)
@@ -0,0 +1,249 @@
+"""
+Partition maintenance of the PITR events table, alternative to a full Glue crawler run.
+
+Events table is expected partitioned by S3 prefixes, one level for each partition key, in Hive style
+(bucketname=my-bucket/dt=2025-05-30/) or with values only (my-bucket/2025-05-30/). The date partition key holds
+dates formatted with a zero padded big endian format (e.g. yyyy-MM-dd), so values can be compared as strings.
+
+Modes:
+    - register: lists partition prefixes of table location and adds missing partitions with BatchCreatePartition.
+      Under each parent prefix (e.g. account/region/bucket), dates before its last registered one aren't listed
+      again, parents without registered partitions are listed in full.
+    - projection: configures partition projection on the table, date key as date type and other keys as enum with
+      values found in table location. Athena computes partitions from query filters, no registration is needed.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+PARTITION_MODES = ["crawler", "register", "projection"]
+BATCH_CREATE_PARTITION_MAX_SIZE = 100
+# Java DateTimeFormatter patterns used by partition projection and their strftime equivalent
+JAVA_TO_STRFTIME_FORMAT = {"yyyy": "%Y", "MM": "%m", "dd": "%d", "HH": "%H"}
+
+
+def to_strftime_format(java_format: str) -> str:
+    for java_pattern, strftime_pattern in JAVA_TO_STRFTIME_FORMAT.items():
+        java_format = java_format.replace(java_pattern, strftime_pattern)
+    return java_format
+
+
+def format_partition_date(time: str, java_format: str, offset: timedelta = timedelta(0)) -> str:
+    """Returns the date partition value of a time in format 2025-05-30T04:00:00Z, plus offset."""
+    return (datetime.strptime(time, "%Y-%m-%dT%H:%M:%SZ") + offset).strftime(to_strftime_format(java_format))
+
+
+def render_date_filters(query: str, date_partition_key: Optional[str], date_partition_format: str,
+                        snapshot_end_time: str, window_start_time: Optional[str] = None) -> str:
+    """
+    Substitutes date filters placeholders of queries, so Athena reads only partitions needed by each subquery:
+        - $DATE_FILTER_UNTIL_SNAPSHOT: events at or before snapshot end time
+        - $DATE_FILTER_SINCE_SNAPSHOT: events after snapshot end time
+        - $DATE_FILTER_WINDOW: any event
+        - $WINDOW_KEYS_FILTER: keys of versionAtTS with events in latestVersion, used by restore query
+    Without date_partition_key placeholders are removed. With window_start_time the filters of events after
+    snapshot end time and of any event exclude partitions before it, so objects without events in the window are
+    ignored. Events at or before snapshot end time are never filtered by window_start_time: they are the state of
+    objects at snapshot, an object without events there would be deleted and not restored.
+
+    Partitions are expected by delivery time (as CloudTrail does), that is at or after event time: lower bounds
+    read a superset of the events, the upper bound at snapshot end time is padded by one day so events delivered
+    after midnight are read. Filters only prune partitions, queries keep the exact filters on event time.
+    """
+    until_filter = since_filter = window_filter = window_keys_filter = ""
+    if date_partition_key:
+        snapshot_date = format_partition_date(snapshot_end_time, date_partition_format)
+        until_date = format_partition_date(snapshot_end_time, date_partition_format, timedelta(days=1))
+        since_date = snapshot_date
+        if window_start_time:
+            window_start_date = format_partition_date(window_start_time, date_partition_format)
+            window_filter = f"AND \"{date_partition_key}\" >= '{window_start_date}'"
+            window_keys_filter = ("and exists (select 1 from latestVersion lv "
+                                  "where lv.bucketname = versionAtTS.bucketname and lv.key = versionAtTS.key)")
+            since_date = max(snapshot_date, window_start_date)
+        until_filter = f"AND \"{date_partition_key}\" <= '{until_date}'"
+        since_filter = f"AND \"{date_partition_key}\" >= '{since_date}'"
+
+    query = query.replace("$DATE_FILTER_UNTIL_SNAPSHOT", until_filter)
+    query = query.replace("$DATE_FILTER_SINCE_SNAPSHOT", since_filter)
+    query = query.replace("$WINDOW_KEYS_FILTER", window_keys_filter)
+    return query.replace("$DATE_FILTER_WINDOW", window_filter)
+
+
+def _split_s3_uri(uri: str) -> Tuple[str, str]:
+    bucket, _, prefix = uri.removeprefix("s3://").partition('/')
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    return bucket, prefix
+
+
+def _partition_value(partition_prefix: str, prefix: str) -> Tuple[str, bool]:
+    """Returns value of a partition prefix and if it's in Hive style."""
+    name = partition_prefix[len(prefix):].rstrip('/')
+    if '=' in name:
+        return name.split('=', 1)[1], True
+    return name, False
+
+
+def list_child_prefixes(s3_client, bucket: str, prefix: str, start_after: Optional[str] = None,
+                        max_prefixes: Optional[int] = None) -> List[str]:
+    """Lists prefixes of next level under prefix, in lexicographic order."""
+    list_args = {'Bucket': bucket, 'Prefix': prefix, 'Delimiter': '/'}
+    if start_after:
+        list_args['StartAfter'] = start_after
+    prefixes = []
+    for page in s3_client.get_paginator('list_objects_v2').paginate(**list_args):
+        prefixes.extend(p['Prefix'] for p in page.get('CommonPrefixes', []))
+        if max_prefixes and len(prefixes) >= max_prefixes:
+            return prefixes[:max_prefixes]
+    return prefixes
+
+
+def list_partitions(s3_client, location: str, partition_keys: List[str], date_partition_key: Optional[str] = None,
+                    since_dates: Optional[Dict[Tuple[str, ...], str]] = None,
+                    max_workers: int = 10) -> Dict[Tuple[str, ...], str]:
+    """
+    Lists partitions of a table location, walking one prefix level for each partition key.
+    With date_partition_key and since_dates, a dict of values of the keys before the date key -> date, dates before
+    the date of their parent aren't listed. Parents missing in since_dates are listed in full.
+    Returns a dict of partition values tuple -> partition S3 URI.
+    """
+    since_dates = since_dates or {}
+    bucket, root_prefix = _split_s3_uri(location)
+    # (values, prefix) of partitions found until current level
+    level = [((), root_prefix)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for partition_key in partition_keys:
+            def list_level(item):
+                values, prefix = item
+                start_after = None
+                since_date = since_dates.get(values) if partition_key == date_partition_key else None
+                if since_date:
+                    # Hive style is detected from first child, StartAfter is exclusive and "k=v" < "k=v/"
+                    first_child = list_child_prefixes(s3_client, bucket, prefix, max_prefixes=1)
+                    if first_child and _partition_value(first_child[0], prefix)[1]:
+                        start_after = f"{prefix}{partition_key}={since_date}"
+                    else:
+                        start_after = f"{prefix}{since_date}"
+                return [(values + (_partition_value(child, prefix)[0],), child)
+                        for child in list_child_prefixes(s3_client, bucket, prefix, start_after=start_after)]
+
+            level = [child for children in executor.map(list_level, level) for child in children]
+            logger.info(f"Found {len(level)} prefixes for partition key '{partition_key}'")
+    return {values: f"s3://{bucket}/{prefix}" for values, prefix in level}
+
+
+def get_registered_partitions(glue_client, database: str, table: str) -> set:
+    paginator = glue_client.get_paginator('get_partitions')
+    partitions = set()
+    for page in paginator.paginate(DatabaseName=database, TableName=table, ExcludeColumnSchema=True):
+        partitions.update(tuple(p['Values']) for p in page['Partitions'])
+    return partitions
+
+
+def register_new_partitions(glue_client, s3_client, database: str, table: str,
+                            date_partition_key: Optional[str] = None, max_workers: int = 10) -> int:
+    """
+    Adds partitions found in table location and missing in Glue catalog with BatchCreatePartition.
+    With date_partition_key, under each parent prefix only dates from its last registered one are listed.
+    Returns the number of created partitions.
+    """
+    glue_table = glue_client.get_table(DatabaseName=database, Name=table)['Table']
+    partition_keys = [k['Name'] for k in glue_table.get('PartitionKeys', [])]
+    if not partition_keys:
+        raise ValueError(f"Table {database}.{table} isn't partitioned")
+    if date_partition_key and date_partition_key not in partition_keys:
+        raise ValueError(f"Date partition key '{date_partition_key}' isn't a partition key of {database}.{table}: "
+                         f"{partition_keys}")
+
+    registered = get_registered_partitions(glue_client, database, table)
+    # Last registered date of each parent, parents added later (e.g. a new bucket) have none and are listed in full
+    since_dates = {}
+    if date_partition_key:
+        date_index = partition_keys.index(date_partition_key)
+        for values in registered:
+            parent = values[:date_index]
+            since_dates[parent] = max(since_dates.get(parent, ''), values[date_index])
+    logger.info(f"{len(registered)} partitions already registered, listing new partitions"
+                f"{f' since last registered date of {len(since_dates)} parents' if since_dates else ''}...")
+
+    found = list_partitions(s3_client, glue_table['StorageDescriptor']['Location'], partition_keys,
+                            date_partition_key, since_dates, max_workers)
+    new_partitions = [(values, location) for values, location in sorted(found.items()) if values not in registered]
+
+    storage_descriptor = glue_table['StorageDescriptor']
+    created = 0
+    for i in range(0, len(new_partitions), BATCH_CREATE_PARTITION_MAX_SIZE):
+        batch = new_partitions[i:i + BATCH_CREATE_PARTITION_MAX_SIZE]
+        response = glue_client.batch_create_partition(
+            DatabaseName=database,
+            TableName=table,
+            PartitionInputList=[{'Values': list(values),
+                                 'StorageDescriptor': {**storage_descriptor, 'Location': location}}
+                                for values, location in batch]
+        )
+        errors = [e for e in response.get('Errors', [])
+                  if e['ErrorDetail']['ErrorCode'] != 'AlreadyExistsException']
+        for error in errors:
+            logger.error(f"Error creating partition {error['PartitionValues']}: {error['ErrorDetail']}")
+        created += len(batch) - len(response.get('Errors', []))
+    logger.info(f"Registered {created} new partitions of {database}.{table}")
+    return created
+
+
+def configure_partition_projection(glue_client, s3_client, database: str, table: str, date_partition_key: str,
+                                   date_partition_format: str = "yyyy-MM-dd", max_workers: int = 10) -> Dict[str, str]:
+    """
+    Enables partition projection on table: date_partition_key as date from the earliest date found in table
+    location to NOW, other keys as enum with values found in table location. Keys other than the date one must come
+    before it in the prefixes layout.
+    Returns the table parameters set.
+    """
+    glue_table = glue_client.get_table(DatabaseName=database, Name=table)['Table']
+    partition_keys = [k['Name'] for k in glue_table.get('PartitionKeys', [])]
+    if date_partition_key not in partition_keys or partition_keys[-1] != date_partition_key:
+        raise ValueError(f"Partition projection needs date partition key '{date_partition_key}' as last partition "
+                         f"key of {database}.{table}: {partition_keys}")
+
+    location = glue_table['StorageDescriptor']['Location']
+    bucket, _ = _split_s3_uri(location)
+    enum_keys = partition_keys[:-1]
+    parents = list_partitions(s3_client, location, enum_keys, max_workers=max_workers)
+
+    def first_date(parent_uri: str) -> Tuple[Optional[str], bool]:
+        _, prefix = _split_s3_uri(parent_uri)
+        children = list_child_prefixes(s3_client, bucket, prefix, max_prefixes=1)
+        return _partition_value(children[0], prefix) if children else (None, False)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        first_dates = [d for d in executor.map(first_date, parents.values()) if d[0]]
+    if not first_dates:
+        raise ValueError(f"No date partitions found in {location}")
+    hive_style = first_dates[0][1]
+
+    parameters = {
+        'projection.enabled': 'true',
+        f'projection.{date_partition_key}.type': 'date',
+        f'projection.{date_partition_key}.range': f"{min(d[0] for d in first_dates)},NOW",
+        f'projection.{date_partition_key}.format': date_partition_format,
+        f'projection.{date_partition_key}.interval': '1',
+        f'projection.{date_partition_key}.interval.unit': 'HOURS' if 'HH' in date_partition_format else 'DAYS',
+        'storage.location.template': location.rstrip('/') + '/' + '/'.join(
+            f"{k}=${{{k}}}" if hive_style else f"${{{k}}}" for k in partition_keys) + '/'
+    }
+    for i, key in enumerate(enum_keys):
+        parameters[f'projection.{key}.type'] = 'enum'
+        parameters[f'projection.{key}.values'] = ','.join(sorted({values[i] for values in parents}))
+
+    # UpdateTable accepts only TableInput fields
+    table_input = {k: v for k, v in glue_table.items()
+                   if k in ['Name', 'Description', 'Owner', 'Retention', 'StorageDescriptor', 'PartitionKeys',
+                            'TableType', 'Parameters']}
+    table_input['Parameters'] = {**glue_table.get('Parameters', {}), **parameters}
+    glue_client.update_table(DatabaseName=database, TableInput=table_input)
+    logger.info(f"Partition projection configured on {database}.{table}: {parameters}")
+    return parameters
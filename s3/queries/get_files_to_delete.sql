@@ -3,7 +3,7 @@ WITH StateAtSnapshot AS (
     FROM (
         SELECT bucketname, key, eventname, eventtime, ROW_NUMBER() OVER (PARTITION BY bucketname, key ORDER BY eventtime DESC) as rn
         FROM "$TABLE_NAME"
-        WHERE eventtime <= '$SNAPSHOT_END_TIME'
+        WHERE eventtime <= '$SNAPSHOT_END_TIME' $DATE_FILTER_UNTIL_SNAPSHOT
     ) AS sub
     WHERE rn = 1
 ),
@@ -12,6 +12,7 @@ CurrentState AS (
     FROM (
         SELECT bucketname, key, eventname, eventtime, ROW_NUMBER() OVER (PARTITION BY bucketname, key ORDER BY eventtime DESC) as rn
         FROM "$TABLE_NAME"
+        WHERE eventtime > '$SNAPSHOT_END_TIME' $DATE_FILTER_SINCE_SNAPSHOT
     ) AS sub
     WHERE rn = 1
 )
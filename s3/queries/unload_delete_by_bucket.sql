@@ -0,0 +1,9 @@
+UNLOAD (
+    -- Keys of S3 events are already URL encoded, as required by Batch Operations CSV manifests, so they are
+    -- written as they are, like the download path does, and never contain commas.
+    -- The partition column must be the last one
+    SELECT bucketname AS bucket, key, bucketname
+    FROM ($QUERY)
+)
+TO '$UNLOAD_LOCATION'
+WITH (format = 'TEXTFILE', field_delimiter = ',', compression = 'NONE', partitioned_by = ARRAY['bucketname'])
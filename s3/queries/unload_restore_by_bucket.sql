@@ -0,0 +1,19 @@
+UNLOAD (
+    WITH ranked AS (
+        SELECT bucketname, key, version,
+               -- highest sequencer first, versions with the same sequencer ordered by version id
+               row_number() OVER (PARTITION BY bucketname, key
+                                  ORDER BY lpad(upper(coalesce(sequencer, '')), 64, '0') DESC, version) AS rn
+        FROM ($QUERY)
+    )
+    -- one version for each key, as --skip-duplicated-versions-at-same-time of the download path: keys with
+    -- multiple versions with the same sequencer restore one of them.
+    -- Keys of S3 events are already URL encoded, as required by Batch Operations CSV manifests, so they are
+    -- written as they are, like the download path does, and never contain commas.
+    -- The partition column must be the last one
+    SELECT bucketname AS bucket, key, version, bucketname
+    FROM ranked
+    WHERE rn = 1
+)
+TO '$UNLOAD_LOCATION'
+WITH (format = 'TEXTFILE', field_delimiter = ',', compression = 'NONE', partitioned_by = ARRAY['bucketname'])
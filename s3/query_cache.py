@@ -0,0 +1,57 @@
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class QueryResultCache:
+    """
+    Local index of successful Athena query executions.
+
+    Entries are keyed on hash of rendered query text and table version (e.g. last crawl time), so a query is reused
+    only while the table isn't updated. The index is a JSON file saved after every update.
+    """
+
+    def __init__(self, path: str, max_age_seconds: Optional[int] = None):
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(query: str, table_version: str) -> str:
+        return hashlib.sha256(f"{table_version}\n{query}".encode('utf-8')).hexdigest()
+
+    def get(self, query: str, table_version: str) -> Optional[str]:
+        """Returns query execution id of a previous successful execution of query on table_version, if any."""
+        entry = self.entries.get(self.key(query, table_version))
+        if not entry:
+            return None
+        if self.max_age_seconds and time.time() - entry["created"] > self.max_age_seconds:
+            return None
+        return entry["query_execution_id"]
+
+    def put(self, query: str, table_version: str, query_execution_id: str):
+        self.entries[self.key(query, table_version)] = {
+            "query_execution_id": query_execution_id,
+            "table_version": table_version,
+            "created": int(time.time())
+        }
+        self.save()
+
+    def remove(self, query: str, table_version: str):
+        self.entries.pop(self.key(query, table_version), None)
+        self.save()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -1,58 +1,228 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
 import typer
 from botocore.exceptions import ClientError
+from s3.inventory_reader import build_inventory_index
 from s3.versioning import check_bucket_versioning
 from utils.aws import AWSHelper
 from utils.logger import get_logger
+from utils.retry import call_with_retry, THROTTLING_ERROR_CODES
 
 logger = get_logger(__name__)
 
+# Max number of keys accepted by a single DeleteObjects request
+DELETE_OBJECTS_BATCH_SIZE = 1000
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
-def restore_all_deleted_objects(bucket_name: str):
-    s3_client = AWSHelper.get_client("s3")
+
+def parse_time(value: Optional[str], option_name: str) -> Optional[datetime]:
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, TIME_FORMAT).replace(tzinfo=timezone.utc)
+    except ValueError:
+        logger.error(f"Invalid {option_name} '{value}', use allowed format: 2025-05-30T04:00:00Z")
+        raise typer.Exit(code=1)
+
+
+def is_marker_to_restore(marker: Dict, since: Optional[datetime] = None, until: Optional[datetime] = None) -> bool:
     """
-    Scans an S3 bucket, finds all objects with a delete marker,
-    and restores them by deleting the marker itself.
+    Returns True for delete markers that are the current version of their object and were created in [since, until).
+    Older delete markers are part of the history of the object, removing them wouldn't restore it.
     """
-    # Step 1: Verify versioning is active. It's the core requirement.
-    if not check_bucket_versioning(s3_client, bucket_name):
-        raise typer.Exit(code=1)
+    if not marker.get('IsLatest'):
+        return False
+    last_modified = marker['LastModified']
+    return (since is None or last_modified >= since) and (until is None or last_modified < until)
 
-    logger.info(f"Starting restoration process for bucket: '{bucket_name}'")
-    restored_count = 0
-    markers_found = 0
 
-    try:
-        # Paginator is the right way to handle large buckets efficiently.
-        paginator = s3_client.get_paginator('list_object_versions')
-        pages = paginator.paginate(Bucket=bucket_name, MaxKeys=200) # Smaller page size for better feedback
+def list_prefix_shards(s3_client, bucket_name: str, prefix: str = "", delimiter: str = "/") -> List[str]:
+    """
+    Lists the next level prefixes under prefix, used to scan its keyspace in parallel.
+    Objects at that level aren't under any of them, they must be scanned listing prefix with delimiter.
+    """
+    prefixes = []
+    paginator = s3_client.get_paginator('list_object_versions')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter=delimiter):
+        prefixes.extend(p['Prefix'] for p in page.get('CommonPrefixes', []))
+    return prefixes
 
-        for page in pages:
-            # The 'DeleteMarkers' field may not exist on a page if there are none.
-            if 'DeleteMarkers' in page:
-                delete_markers = page['DeleteMarkers']
-                markers_found += len(delete_markers)
 
-                for marker in delete_markers:
-                    key = marker['Key']
-                    version_id = marker['VersionId']
+def iter_delete_markers(s3_client, bucket_name: str, prefix: str = "", delimiter: str = None) -> Iterator[Dict]:
+    """Yields the delete markers under prefix, page by page."""
+    list_args = {'Bucket': bucket_name, 'Prefix': prefix, 'MaxKeys': DELETE_OBJECTS_BATCH_SIZE}
+    if delimiter:
+        list_args['Delimiter'] = delimiter
+    for page in s3_client.get_paginator('list_object_versions').paginate(**list_args):
+        # The 'DeleteMarkers' field may not exist on a page if there are none.
+        yield from page.get('DeleteMarkers', [])
 
-                    logger.info(f"Found delete marker for object '{key}' (VersionId: {version_id})")
-                    logger.info(f"  -> Restoring object by removing its delete marker...")
 
-                    # To "restore" the object, we simply delete the "delete marker" version.
-                    s3_client.delete_object(
-                        Bucket=bucket_name,
-                        Key=key,
-                        VersionId=version_id
-                    )
+def delete_markers_batch(s3_client, bucket_name: str, markers: List[Dict], max_attempts: int = 8,
+                         base_delay: float = 0.5, max_delay: float = 20) -> int:
+    """
+    Removes a batch of at most 1000 delete markers with a single DeleteObjects call, returns the removed ones.
+    Keys reported with a throttling error code (e.g. SlowDown, InternalError) are sent again with the backoff of
+    call_with_retry, they are counted as failed after max_attempts attempts.
+    """
+    removed = 0
+    failed = []
+    pending = markers
+    for attempt in range(max_attempts):
+        response = call_with_retry(
+            s3_client.delete_objects,
+            Bucket=bucket_name,
+            Delete={
+                'Objects': [{'Key': marker['Key'], 'VersionId': marker['VersionId']} for marker in pending],
+                'Quiet': True
+            }
+        )
+        # In quiet mode the response only reports the keys that couldn't be deleted
+        errors = response.get('Errors', [])
+        removed += len(pending) - len(errors)
+        retryable = {(error['Key'], error.get('VersionId')) for error in errors
+                     if error.get('Code') in THROTTLING_ERROR_CODES}
+        if attempt == max_attempts - 1:
+            retryable = set()
+        failed.extend(error for error in errors if (error['Key'], error.get('VersionId')) not in retryable)
+        if not retryable:
+            break
+        pending = [marker for marker in pending if (marker['Key'], marker['VersionId']) in retryable]
+        delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+        logger.debug(f"{len(pending)} delete markers of bucket '{bucket_name}' throttled, "
+                     f"retry {attempt + 1}/{max_attempts - 1} in {delay:.2f} seconds")
+        time.sleep(delay)
+
+    for error in failed:
+        logger.error(f"Failed to restore object '{error['Key']}' (VersionId: {error.get('VersionId')}): "
+                     f"{error.get('Code')} - {error.get('Message')}")
+    return removed
+
+
+def restore_all_deleted_objects(
+        bucket_name: str,
+        prefix: str = typer.Option("", "--prefix", help="Restore only objects under this prefix."),
+        since: str = typer.Option(None, "--since", help="Restore only objects deleted at or after this time, "
+                                                         "format: 2025-05-30T04:00:00Z"),
+        until: str = typer.Option(None, "--until", help="Restore only objects deleted before this time, "
+                                                         "format: 2025-05-30T04:00:00Z"),
+        inventory_bucket: str = typer.Option(None, "--inventory-bucket",
+                                             help="Read delete markers from the latest S3 Inventory report saved in "
+                                                  "this bucket instead of listing object versions."),
+        inventory_prefix: str = typer.Option("inventory", "--inventory-prefix",
+                                             help="The prefix of inventory reports in the inventory bucket."),
+        inventory_id: str = typer.Option("aws-script", "--inventory-id", help="The id of inventory configuration."),
+        inventory_index_path: str = typer.Option(None, "--inventory-index-path",
+                                                 help="Path of the SQLite index of the inventory report, reused if "
+                                                      "built from the same report, default "
+                                                      "inventory_{bucket_name}.sqlite3"),
+        max_workers: int = typer.Option(10, "--max-workers", help="Max number of prefixes, or inventory files, "
+                                                                  "scanned in parallel."),
+        dry_run: bool = typer.Option(False, "--dry-run", help="Only count the delete markers, without removing them."),
+):
+    """
+    Scans an S3 bucket, finds all objects with a delete marker,
+    and restores them by deleting the marker itself.
+
+    Only delete markers that are the latest version of their object are removed, optionally only the ones under
+    prefix and created between since and until, e.g. to undo the deletes of a bad deploy in a single folder.
+    The keyspace is split by the next level prefixes under prefix, which are scanned in parallel. Delete markers are
+    removed in batches of 1000 with DeleteObjects.
+
+    With --inventory-bucket, versions aren't listed: delete markers are queried from a local index of the latest
+    inventory report of the bucket (see inventory-index), that must include all versions and the LastModifiedDate
+    field (as configured by add-inventory-configuration). Delete markers created after the report are not found.
+    """
+    since_time = parse_time(since, "--since")
+    until_time = parse_time(until, "--until")
+    s3_client = AWSHelper.get_client("s3")
+    # Step 1: Verify versioning is active. It's the core requirement.
+    if not check_bucket_versioning(bucket_name):
+        raise typer.Exit(code=1)
 
-                    logger.info(f"  -> Successfully restored object '{key}'.")
-                    restored_count += 1
+    logger.info(f"Starting {'dry run of ' if dry_run else ''}restoration process for bucket: '{bucket_name}'")
+    lock = threading.Lock()
+    counters = {'markers_scanned': 0, 'markers_found': 0, 'restored': 0}
+    start = time.monotonic()
+
+    def restore_shard(markers: Iterator[Dict]):
+        batch = []
+        scanned = 0
+        for marker in markers:
+            scanned += 1
+            if not is_marker_to_restore(marker, since_time, until_time):
+                continue
+            logger.debug(f"Found delete marker for object '{marker['Key']}' (VersionId: {marker['VersionId']})")
+            batch.append(marker)
+            if len(batch) == DELETE_OBJECTS_BATCH_SIZE:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+        with lock:
+            counters['markers_scanned'] += scanned
+
+    def flush(batch: List[Dict]):
+        # To "restore" the objects, we simply delete their "delete marker" versions.
+        restored = 0 if dry_run else delete_markers_batch(s3_client, bucket_name, batch)
+        with lock:
+            counters['markers_found'] += len(batch)
+            counters['restored'] += restored
+            if dry_run:
+                logger.info(f"Found {counters['markers_found']} delete markers")
+            else:
+                logger.info(f"Found {counters['markers_found']} delete markers, "
+                            f"restored {counters['restored']} objects")
 
+    try:
+        if inventory_bucket:
+            with build_inventory_index(s3_client, bucket_name, inventory_bucket, inventory_prefix, inventory_id,
+                                       inventory_index_path, max_workers) as index:
+                # Markers are already filtered by the index query, batches are removed in parallel
+                in_flight = deque()
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    batch = []
+                    for marker in index.iter_delete_markers(prefix, since_time, until_time):
+                        batch.append(marker)
+                        if len(batch) == DELETE_OBJECTS_BATCH_SIZE:
+                            if len(in_flight) >= max_workers * 2:
+                                in_flight.popleft().result()
+                            in_flight.append(executor.submit(flush, batch))
+                            batch = []
+                    if batch:
+                        in_flight.append(executor.submit(flush, batch))
+                    for future in in_flight:
+                        future.result()
+            counters['markers_scanned'] = counters['markers_found']
+        else:
+            prefixes = list_prefix_shards(s3_client, bucket_name, prefix)
+            logger.info(f"Scanning {len(prefixes)} prefixes under '{prefix}' and objects at its level "
+                        f"with {max_workers} workers")
+            shards = [iter_delete_markers(s3_client, bucket_name, prefix, "/")]
+            shards.extend(iter_delete_markers(s3_client, bucket_name, shard_prefix) for shard_prefix in prefixes)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(restore_shard, markers) for markers in shards]
+                for future in futures:
+                    future.result()
+
+    except typer.Exit:
+        raise
+    except ValueError as e:
+        logger.error(f"Cannot read the inventory report: {e}")
+        raise typer.Exit(code=1)
     except ClientError as e:
         if e.response['Error']['Code'] == 'AccessDenied':
             logger.error("ACCESS DENIED. Check your IAM permissions.")
             logger.error("Required permissions: 's3:ListBucketVersions' and 's3:DeleteObjectVersion'.")
+            if inventory_bucket:
+                logger.error(f"Reading inventory reports requires 's3:ListBucket' and 's3:GetObject' on "
+                             f"'{inventory_bucket}'.")
         else:
             logger.error(f"An unexpected AWS error occurred: {e}")
         raise typer.Exit(code=1)
@@ -61,12 +231,17 @@ def restore_all_deleted_objects(bucket_name: str):
         raise typer.Exit(code=1)
 
     # --- Final Summary ---
+    elapsed = time.monotonic() - start
+    markers_found = counters['markers_found']
     logger.info("--- Process Completed ---")
+    logger.info(f"Scanned {counters['markers_scanned']} delete markers.")
     if markers_found == 0:
-        logger.info("✅ No deleted objects (delete markers) were found in the bucket.")
+        logger.info("✅ No deleted objects (delete markers) matching the filters were found in the bucket.")
+    elif dry_run:
+        logger.info(f"Found a total of {markers_found} delete markers, that would be removed.")
     else:
         logger.info(f"Found a total of {markers_found} delete markers.")
-        logger.info(f"✅ Successfully restored {restored_count} objects.")
+        logger.info(f"✅ Successfully restored {counters['restored']} objects in {elapsed:.1f} seconds.")
 
 
 if __name__ == "__main__":
@@ -77,4 +252,4 @@ if __name__ == "__main__":
     which effectively restores the previous version of the object.
     """)
 
-    app.command()(restore_all_deleted_objects)
\ No newline at end of file
+    app.command()(restore_all_deleted_objects)
@@ -1,27 +1,80 @@
 """
-AWS S3 Batch Operations Pending Job Cleaner.
+AWS S3 Batch Operations Pending Job Cleaner and Job Watcher.
 
-This script identifies and cancels pending S3 Batch Operations jobs
+The cleaner identifies and cancels pending S3 Batch Operations jobs
 created before a specified date. It is designed to be used by DevOps engineers
 to clean up stale or forgotten jobs, preventing unnecessary resource consumption
 or accidental execution.
 
+The watcher tracks a set of jobs (e.g. jobs started by pitr) until they end, reporting progress,
+and merges failed tasks of their completion reports in a single CSV.
+
 Maintained by the team at https://github.com/epsilonline/aws-scripts
 """
 
+import codecs
+import csv
+import json
 import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
 
 import typer
 from botocore.exceptions import ClientError, NoCredentialsError
 
 from utils.aws import AWSHelper
 from utils.logger import setup_logging
+from utils.retry import call_with_retry
+from utils.waiter import Waiter, WaitTimeoutError
 
 # --- Globals ---
 APP_NAME = "s3-batch-cleaner"
 logger = logging.getLogger(APP_NAME)
 
+TERMINAL_JOB_STATUSES = ['Complete', 'Failed', 'Cancelled']
+# Jobs in these statuses don't progress without an action, e.g. confirmation of jobs created with
+# ConfirmationRequired
+WAITING_JOB_STATUSES = ['Suspended']
+FAILURES_CSV_FIELDNAMES = ['JobId', 'Bucket', 'Key', 'VersionId', 'TaskStatus', 'ErrorCode', 'HTTPStatusCode',
+                           'ResultMessage']
+
+
+def list_jobs(s3_control_client, account_id: str, job_statuses: List[str]) -> Iterator[Dict[str, Any]]:
+    """Yields jobs with one of job_statuses page by page, so callers can process a page while the next is listed."""
+    # The list_jobs operation does not support an automatic paginator.
+    # We must handle pagination manually using the NextToken.
+    next_token = None
+    while True:
+        logger.debug(f"Requesting a page of jobs... (NextToken: {'Yes' if next_token else 'No'})")
+        list_jobs_args = {
+            'AccountId': account_id,
+            'JobStatuses': job_statuses
+        }
+        if next_token:
+            list_jobs_args['NextToken'] = next_token
+
+        response = call_with_retry(s3_control_client.list_jobs, **list_jobs_args)
+        yield from response.get("Jobs", [])
+
+        next_token = response.get('NextToken')
+        if not next_token:
+            logger.debug("No NextToken found in response. Reached the last page.")
+            return
+
+
+def cancel_job(s3_control_client, account_id: str, job_id: str):
+    call_with_retry(
+        s3_control_client.update_job_status,
+        AccountId=account_id,
+        JobId=job_id,
+        RequestedJobStatus='Cancelled',
+        StatusUpdateReason='Cancelled by automated cleanup script (aws-scripts/s3_batch_cancel_pending_jobs)'
+    )
+
 
 def clean_batch_operation_pending_jobs(
         before_date_str: str = typer.Option(
@@ -31,6 +84,17 @@ def clean_batch_operation_pending_jobs(
             help="Date in YYYY-MM-DD format. Jobs created before this date will be cancelled.",
             prompt="Enter the cutoff date (YYYY-MM-DD)",
         ),
+        job_statuses: List[str] = typer.Option(
+            ['Suspended'],
+            "--status",
+            "-s",
+            help="Status of jobs to cancel, can be repeated.",
+        ),
+        max_workers: int = typer.Option(
+            10,
+            "--max-workers",
+            help="Max parallel job cancellations, throttled requests are retried with backoff.",
+        ),
         dry_run: bool = typer.Option(
             False,
             "--dry-run",
@@ -44,7 +108,11 @@ def clean_batch_operation_pending_jobs(
         ),
 ):
     """
-    Scans for and cancels PENDING S3 Batch Operations jobs created before a specified date.
+    Scans for and cancels S3 Batch Operations jobs (by default PENDING ones, with status Suspended) created before a
+    specified date.
+
+    Jobs are listed page by page and matches are cancelled while listing continues, by a pool of max-workers
+    threads.
 
     This tool requires IAM permissions for 's3:ListJobs' and 's3:UpdateJobStatus'.
     """
@@ -57,11 +125,13 @@ def clean_batch_operation_pending_jobs(
     try:
         # Parse and validate the date input. Make it timezone-aware (UTC) for correct comparison.
         cutoff_date = datetime.strptime(before_date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
-        logger.info(f"Targeting pending jobs created before: {cutoff_date.strftime('%Y-%m-%d %H:%M:%S %Z')}")
+        logger.info(f"Targeting {', '.join(job_statuses)} jobs created before: "
+                    f"{cutoff_date.strftime('%Y-%m-%d %H:%M:%S %Z')}")
     except ValueError:
         logger.error(f"Invalid date format: '{before_date_str}'. Please use YYYY-MM-DD.")
         raise typer.Exit(code=1)
 
+    aws_account_id = None
     try:
         s3_control_client = AWSHelper.get_client('s3control')
         sts_client = AWSHelper.get_client('sts')
@@ -71,71 +141,64 @@ def clean_batch_operation_pending_jobs(
 
         jobs_to_cancel_count = 0
         total_jobs_scanned = 0
+        cancelled_count = 0
+        failed_count = 0
+        start = time.monotonic()
 
-        # --- CORRECTED PAGINATION LOGIC ---
-        # The list_jobs operation does not support an automatic paginator.
-        # We must handle pagination manually using the NextToken.
-        next_token = None
-        while True:
-            logger.debug(f"Requesting a page of jobs... (NextToken: {'Yes' if next_token else 'No'})")
-
-            # Prepare arguments for the API call
-            list_jobs_args = {
-                'AccountId': aws_account_id,
-                'JobStatuses': ['Suspended']
-            }
-            if next_token:
-                list_jobs_args['NextToken'] = next_token
-
-            response = s3_control_client.list_jobs(**list_jobs_args)
-            jobs_in_page = response.get("Jobs", [])
-
-            if not jobs_in_page and not next_token:
-                logger.info("No pending jobs found in the account.")
-                break
-
-            total_jobs_scanned += len(jobs_in_page)
+        def cancel(job_id: str) -> bool:
+            try:
+                cancel_job(s3_control_client, aws_account_id, job_id)
+                logger.info(f"SUCCESS: Job '{job_id}' has been cancelled.")
+                return True
+            except ClientError as e:
+                error_code = e.response.get("Error", {}).get("Code")
+                logger.error(f"FAILED to cancel job '{job_id}'. Reason: {error_code} - {e}")
+                return False
 
-            for job in jobs_in_page:
+        # Submitted cancellations are bounded, so listing waits for the pool instead of queuing all jobs in memory
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for job in list_jobs(s3_control_client, aws_account_id, job_statuses):
+                total_jobs_scanned += 1
                 job_id = job.get('JobId')
                 creation_time = job.get('CreationTime')
 
                 logger.debug(f"Scanning job '{job_id}' created at {creation_time.isoformat()}")
 
-                if creation_time < cutoff_date:
-                    jobs_to_cancel_count += 1
-                    logger.info(
-                        f"MATCH: Job '{job_id}' (Created: {creation_time.strftime('%Y-%m-%d')}) is a candidate for cancellation.")
-
-                    if not dry_run:
-                        try:
-                            logger.info(f"Attempting to cancel job '{job_id}'...")
-                            s3_control_client.update_job_status(
-                                AccountId=aws_account_id,
-                                JobId=job_id,
-                                RequestedJobStatus='Cancelled',
-                                StatusUpdateReason='Cancelled by automated cleanup script (aws-scripts/s3_batch_cancel_pending_jobs)'
-                            )
-                            logger.info(f"SUCCESS: Job '{job_id}' has been cancelled.")
-                        except ClientError as e:
-                            error_code = e.response.get("Error", {}).get("Code")
-                            logger.error(f"FAILED to cancel job '{job_id}'. Reason: {error_code} - {e}")
+                if creation_time >= cutoff_date:
+                    continue
+                jobs_to_cancel_count += 1
+                logger.info(
+                    f"MATCH: Job '{job_id}' (Created: {creation_time.strftime('%Y-%m-%d')}) is a candidate for cancellation.")
+                if dry_run:
+                    logger.info(f"[DRY RUN] Would have cancelled job '{job_id}'.")
+                    continue
+
+                if len(in_flight) >= max_workers * 2:
+                    if in_flight.popleft().result():
+                        cancelled_count += 1
                     else:
-                        logger.info(f"[DRY RUN] Would have cancelled job '{job_id}'.")
+                        failed_count += 1
+                in_flight.append(executor.submit(cancel, job_id))
 
-            # Check if there are more pages to fetch
-            next_token = response.get('NextToken')
-            if not next_token:
-                logger.debug("No NextToken found in response. Reached the last page.")
-                break  # Exit the loop if there are no more results
-        # --- END OF CORRECTED PAGINATION LOGIC ---
+            for future in in_flight:
+                if future.result():
+                    cancelled_count += 1
+                else:
+                    failed_count += 1
+        elapsed = time.monotonic() - start
 
         logger.info("--- Scan complete ---")
-        logger.info(f"Total pending jobs scanned: {total_jobs_scanned}")
+        if total_jobs_scanned == 0:
+            logger.info(f"No {', '.join(job_statuses)} jobs found in the account.")
+        logger.info(f"Total jobs scanned: {total_jobs_scanned}")
         if dry_run:
             logger.info(f"Jobs that would be cancelled: {jobs_to_cancel_count}")
         else:
-            logger.info(f"Jobs processed for cancellation: {jobs_to_cancel_count}")
+            logger.info(f"Jobs processed for cancellation: {jobs_to_cancel_count}, cancelled: {cancelled_count}, "
+                        f"failed: {failed_count}")
+            logger.info(f"Cancelled {cancelled_count / elapsed if elapsed else 0:.1f} jobs per second "
+                        f"in {elapsed:.1f} seconds")
 
     except NoCredentialsError:
         logger.error("AWS credentials not found. Please configure your environment (e.g., via `aws configure`).")
@@ -153,6 +216,196 @@ def clean_batch_operation_pending_jobs(
         raise typer.Exit(code=1)
 
 
+def describe_jobs(s3_control_client, account_id: str, job_ids: List[str], max_workers: int = 10) \
+        -> Dict[str, Dict[str, Any]]:
+    """Describes jobs in parallel retrying throttling errors, returns job descriptions by job id."""
+    def describe(job_id: str) -> Dict[str, Any]:
+        return call_with_retry(s3_control_client.describe_job, AccountId=account_id, JobId=job_id)['Job']
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(job_ids, executor.map(describe, job_ids)))
+
+
+def get_job_progress(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns status, tasks and rate of a job description. Rate is computed on time spent in active status,
+    ETA is None if the job isn't progressing.
+    """
+    progress_summary = job.get('ProgressSummary', {})
+    total = progress_summary.get('TotalNumberOfTasks', 0)
+    succeeded = progress_summary.get('NumberOfTasksSucceeded', 0)
+    failed = progress_summary.get('NumberOfTasksFailed', 0)
+    elapsed = progress_summary.get('Timers', {}).get('ElapsedTimeInActiveSeconds', 0)
+    done = succeeded + failed
+    tasks_per_second = done / elapsed if elapsed else 0
+    eta = None
+    if job['Status'] not in TERMINAL_JOB_STATUSES and tasks_per_second:
+        eta = (total - done) / tasks_per_second
+    return {'status': job['Status'], 'total': total, 'succeeded': succeeded, 'failed': failed,
+            'tasks_per_second': tasks_per_second, 'eta': eta}
+
+
+def format_eta(seconds: float | None) -> str:
+    if seconds is None:
+        return "n/a"
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s"
+
+
+def sum_jobs_progress(progresses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Sums progresses of jobs (see get_job_progress): number of jobs, jobs by status and tasks. Rate is the sum of
+    rates of running jobs.
+    """
+    total = {'jobs': len(progresses), 'statuses': {}, 'total': 0, 'succeeded': 0, 'failed': 0,
+             'tasks_per_second': 0}
+    for progress in progresses:
+        total['statuses'][progress['status']] = total['statuses'].get(progress['status'], 0) + 1
+        for k in ['total', 'succeeded', 'failed']:
+            total[k] += progress[k]
+        if progress['status'] not in TERMINAL_JOB_STATUSES:
+            total['tasks_per_second'] += progress['tasks_per_second']
+    remaining = total['total'] - total['succeeded'] - total['failed']
+    total['eta'] = (remaining / total['tasks_per_second'] if total['tasks_per_second']
+                    else (0 if remaining <= 0 else None))
+    return total
+
+
+def log_jobs_progress(jobs: Dict[str, Dict[str, Any]], job_buckets: Optional[Dict[str, str]] = None):
+    """
+    Logs progress of each job, of jobs of each bucket (e.g. jobs of manifest shards) and total progress.
+    job_buckets is a dict of job id -> bucket name, jobs missing in it aren't aggregated by bucket.
+    """
+    progresses = {}
+    for job_id, job in jobs.items():
+        progress = progresses[job_id] = get_job_progress(job)
+        logger.info(f"Job {job_id} [{progress['status']}] {job.get('Description', '')}: "
+                    f"{progress['succeeded']} succeeded, {progress['failed']} failed of {progress['total']} tasks, "
+                    f"{progress['tasks_per_second']:.1f} tasks/s, ETA {format_eta(progress['eta'])}")
+
+    progresses_by_bucket = {}
+    for job_id, progress in progresses.items():
+        if job_buckets and job_id in job_buckets:
+            progresses_by_bucket.setdefault(job_buckets[job_id], []).append(progress)
+    for bucket_name, bucket_progresses in sorted(progresses_by_bucket.items()):
+        bucket_progress = sum_jobs_progress(bucket_progresses)
+        done = bucket_progress['succeeded'] + bucket_progress['failed']
+        percent = done / bucket_progress['total'] * 100 if bucket_progress['total'] else 0
+        logger.info(f"Bucket {bucket_name}: {bucket_progress['jobs']} jobs {bucket_progress['statuses']}, "
+                    f"{done}/{bucket_progress['total']} tasks ({percent:.1f}%), {bucket_progress['failed']} failed, "
+                    f"{bucket_progress['tasks_per_second']:.1f} tasks/s, ETA {format_eta(bucket_progress['eta'])}")
+
+    total = sum_jobs_progress(list(progresses.values()))
+    logger.info(f"Total: {total['succeeded']} succeeded, {total['failed']} failed of {total['total']} tasks, "
+                f"{total['tasks_per_second']:.1f} tasks/s, ETA {format_eta(total['eta'])}")
+
+
+def read_job_buckets_from_summaries(summary_paths: List[str]) -> Dict[str, str]:
+    """Reads job id -> bucket name of batch operations summaries written by pitr (batch_operations_{action}.json)."""
+    job_buckets = {}
+    for summary_path in summary_paths:
+        with open(summary_path, 'r') as f:
+            job_buckets.update((job['job_id'], job['bucket']) for job in json.load(f) if job.get('job_id'))
+    return job_buckets
+
+
+def merge_failure_reports(s3_client, jobs: Dict[str, Dict[str, Any]], output_path: str,
+                          max_workers: int = 10) -> int:
+    """
+    Merges failed tasks of completion reports of jobs in a single CSV, with the job id as first column.
+    Completion report files are listed in the report manifest {prefix}/job-{job id}/manifest.json, only files of
+    failed tasks are read and they are streamed from S3. Returns the number of failed tasks written.
+    """
+    lock = threading.Lock()
+    failed_tasks = 0
+
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(FAILURES_CSV_FIELDNAMES)
+
+        def merge(job_id: str):
+            nonlocal failed_tasks
+            report = jobs[job_id].get('Report', {})
+            if not report.get('Enabled'):
+                logger.warning(f"Job {job_id} has no completion report, skip it.")
+                return
+            report_bucket = report['Bucket'].split(':::')[-1]
+            manifest_key = '/'.join(p for p in [report.get('Prefix', '').strip('/'), f"job-{job_id}",
+                                                "manifest.json"] if p)
+            try:
+                report_manifest = json.load(s3_client.get_object(Bucket=report_bucket, Key=manifest_key)['Body'])
+            except ClientError as e:
+                logger.error(f"Error reading completion report s3://{report_bucket}/{manifest_key}: {e}")
+                return
+            for result in report_manifest.get('Results', []):
+                if result.get('TaskExecutionStatus') != 'failed':
+                    continue
+                body = s3_client.get_object(Bucket=result['Bucket'], Key=result['Key'])['Body']
+                for row in csv.reader(codecs.getreader('utf-8')(body)):
+                    with lock:
+                        writer.writerow([job_id] + row)
+                        failed_tasks += 1
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(merge, jobs))
+    return failed_tasks
+
+
+def batch_jobs_watch(
+        job_ids: List[str] = typer.Option(None, "--job-id", help="Id of a job to watch, can be repeated."),
+        summaries: List[str] = typer.Option(None, "--summary",
+                                            help="Batch operations summary written by pitr "
+                                                 "(batch_operations_{action}.json), can be repeated."),
+        interval: int = typer.Option(30, min=1, help="Max seconds between polls, polls start after 5 seconds "
+                                                     "with exponential backoff."),
+        timeout: int = typer.Option(0, help="If greater than 0, stop watching after this number of seconds."),
+        max_workers: int = typer.Option(10, help="Max parallel job descriptions and report downloads."),
+        failures_csv: str = typer.Option("batch_operations_failures.csv",
+                                         help="CSV where failed tasks of completion reports are merged."),
+        verbose: bool = typer.Option(False, "--verbose", "-v", help="Enable verbose (DEBUG) logging."),
+):
+    """
+    Watches S3 Batch Operations jobs until they end, reporting tasks succeeded/failed, tasks per second and ETA of
+    each job, of jobs of each bucket of summaries (e.g. jobs of manifest shards) and in total, then merges failed
+    tasks of their completion reports in a CSV.
+    Watch stops also when all running jobs wait for confirmation (Suspended).
+
+    This tool requires IAM permissions for 's3:DescribeJob' and 's3:GetObject' on report bucket.
+    """
+    setup_logging(verbose)
+    job_buckets = read_job_buckets_from_summaries(summaries or [])
+    job_ids = list(dict.fromkeys((job_ids or []) + list(job_buckets)))
+    if not job_ids:
+        logger.error("No job to watch, use --job-id or --summary.")
+        raise typer.Exit(code=1)
+
+    s3_control_client = AWSHelper.get_client('s3control')
+    aws_account_id = AWSHelper.get_client('sts').get_caller_identity()['Account']
+    logger.info(f"Watching {len(job_ids)} jobs...")
+
+    def is_done(jobs: Dict[str, Dict[str, Any]]) -> bool:
+        return all(job['Status'] in TERMINAL_JOB_STATUSES + WAITING_JOB_STATUSES for job in jobs.values())
+
+    waiter = Waiter(initial_delay=min(5, interval), max_delay=interval, timeout=timeout or None)
+    try:
+        jobs = waiter.wait(lambda: describe_jobs(s3_control_client, aws_account_id, job_ids, max_workers),
+                           is_done, on_poll=lambda polled_jobs: log_jobs_progress(polled_jobs, job_buckets))
+    except WaitTimeoutError as e:
+        logger.warning(f"Jobs not completed: {e}")
+        jobs = e.last_result
+    log_jobs_progress(jobs, job_buckets)
+
+    waiting_jobs = [job_id for job_id, job in jobs.items() if job['Status'] in WAITING_JOB_STATUSES]
+    if waiting_jobs:
+        logger.warning(f"Jobs waiting for confirmation: {waiting_jobs}")
+
+    ended_jobs = {job_id: job for job_id, job in jobs.items() if job['Status'] in TERMINAL_JOB_STATUSES}
+    if ended_jobs:
+        failed_tasks = merge_failure_reports(AWSHelper.get_client('s3'), ended_jobs, failures_csv, max_workers)
+        logger.info(f"Merged {failed_tasks} failed tasks of {len(ended_jobs)} ended jobs in {failures_csv}")
+
+
 if __name__ == "__main__":
     app = typer.Typer()
     app.command()(clean_batch_operation_pending_jobs)
\ No newline at end of file
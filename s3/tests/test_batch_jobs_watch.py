@@ -0,0 +1,88 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+from s3 import s3_batch_operations
+from s3.s3_batch_operations import batch_jobs_watch
+from utils.aws import AWSHelper
+
+
+def job_description(job_id: str, status: str, total: int, succeeded: int, failed: int) -> dict:
+    return {'JobId': job_id, 'Status': status, 'Report': {'Enabled': False},
+            'ProgressSummary': {'TotalNumberOfTasks': total, 'NumberOfTasksSucceeded': succeeded,
+                                'NumberOfTasksFailed': failed, 'Timers': {'ElapsedTimeInActiveSeconds': 10}}}
+
+
+class FakeS3ControlClient:
+
+    def __init__(self, jobs: dict, throttled_calls: int = 0):
+        self.jobs = jobs
+        self.throttled_calls = throttled_calls
+        self.describe_calls = 0
+
+    def describe_job(self, AccountId: str, JobId: str) -> dict:
+        self.describe_calls += 1
+        if self.describe_calls <= self.throttled_calls:
+            raise ClientError({'Error': {'Code': 'TooManyRequestsException', 'Message': 'Rate exceeded'}},
+                              'DescribeJob')
+        return {'Job': self.jobs[JobId]}
+
+
+class FakeStsClient:
+
+    def get_caller_identity(self):
+        return {'Account': '000000000000'}
+
+
+class BatchJobsWatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.s3_control_client = FakeS3ControlClient({
+            'job-1': job_description('job-1', 'Complete', 100, 90, 10),
+            'job-2': job_description('job-2', 'Complete', 50, 50, 0),
+            'job-3': job_description('job-3', 'Complete', 10, 10, 0),
+        })
+        for patch in [mock.patch.dict(AWSHelper._clients, {'s3control': self.s3_control_client,
+                                                           'sts': FakeStsClient()}),
+                      mock.patch.object(AWSHelper, '_initialized', True)]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def watch(self, summaries: list, job_ids: list = None):
+        batch_jobs_watch(job_ids=job_ids or [], summaries=summaries, interval=1, timeout=0, max_workers=2,
+                         failures_csv=os.path.join(self.tmp.name, 'failures.csv'), verbose=False)
+
+    def test_jobs_of_summaries_are_aggregated_by_bucket(self):
+        summary_path = os.path.join(self.tmp.name, 'batch_operations_restore.json')
+        with open(summary_path, 'w') as f:
+            json.dump([{'bucket': 'bucket-a', 'manifest': 's3://temp/bucket-a_restore.shard0000.csv', 'shard': 0,
+                        'job_id': 'job-1'},
+                       {'bucket': 'bucket-a', 'manifest': 's3://temp/bucket-a_restore.shard0001.csv', 'shard': 1,
+                        'job_id': 'job-2'},
+                       {'bucket': 'bucket-b', 'manifest': 's3://temp/bucket-b_restore.csv', 'shard': None,
+                        'error': 'TooManyRequestsException'}], f)
+
+        with self.assertLogs(s3_batch_operations.logger, level='INFO') as logs:
+            self.watch([summary_path], job_ids=['job-3'])
+        output = "\n".join(logs.output)
+        self.assertIn("Bucket bucket-a: 2 jobs {'Complete': 2}, 150/150 tasks (100.0%), 10 failed", output)
+        self.assertNotIn("Bucket bucket-b", output)
+        self.assertIn("Total: 150 succeeded, 10 failed of 160 tasks", output)
+
+    def test_throttled_job_descriptions_are_retried(self):
+        self.s3_control_client.throttled_calls = 3
+        with mock.patch('utils.retry.random.uniform', return_value=0), \
+                self.assertLogs(s3_batch_operations.logger, level='INFO') as logs:
+            self.watch([], job_ids=['job-1', 'job-2'])
+        self.assertEqual(self.s3_control_client.describe_calls, 5)
+        self.assertIn("Total: 140 succeeded, 10 failed of 150 tasks", "\n".join(logs.output))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from botocore.exceptions import EndpointConnectionError
+
+from s3 import bucket_audit
+from s3.versioning import check_buckets_versioning
+from utils.aws import AWSHelper
+
+
+class FakeS3Client:
+    """S3 client of a region, get_bucket_versioning of unreachable buckets fails with a connection error."""
+
+    def __init__(self, buckets: list, unreachable: set):
+        self.buckets = buckets
+        self.unreachable = unreachable
+
+    def list_buckets(self):
+        return {'Buckets': self.buckets}
+
+    def get_bucket_versioning(self, Bucket: str):
+        if Bucket in self.unreachable:
+            raise EndpointConnectionError(endpoint_url=f"https://{Bucket}.s3.eu-west-1.amazonaws.com")
+        return {'Status': 'Enabled'}
+
+    def get_bucket_lifecycle_configuration(self, Bucket: str):
+        return {'Rules': [{}]}
+
+    def get_bucket_notification_configuration(self, Bucket: str):
+        return {'EventBridgeConfiguration': {}}
+
+
+class BucketAuditTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        buckets = [{'Name': f"bucket-{i}", 'BucketRegion': 'eu-west-1'} for i in range(5)]
+        s3_client = FakeS3Client(buckets, unreachable={'bucket-2'})
+        clients = mock.patch.dict(AWSHelper._clients, {'s3': s3_client, 's3:eu-west-1': s3_client})
+        initialized = mock.patch.object(AWSHelper, '_initialized', True)
+        regions = mock.patch.dict(bucket_audit._bucket_regions, clear=True)
+        for patch in [clients, initialized, regions]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_audit_bucket_records_non_client_errors(self):
+        result = bucket_audit.audit_bucket('bucket-2', 'eu-west-1')
+        self.assertIn("Could not connect to the endpoint URL", result['error'])
+
+    def test_non_client_error_does_not_stop_audit(self):
+        output = os.path.join(self.tmp.name, 'audit.jsonl')
+        check_buckets_versioning(output=output, output_format="json", max_workers=4)
+        with open(output) as f:
+            results = {result['bucket']: result for result in map(json.loads, f)}
+        self.assertEqual(sorted(results), [f"bucket-{i}" for i in range(5)])
+        self.assertIn("Could not connect to the endpoint URL", results['bucket-2']['error'])
+        self.assertTrue(all(results[b]['versioning'] == 'Enabled' for b in results if b != 'bucket-2'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import json
+import os
+import tempfile
+import unittest
+
+from s3 import pitr
+from s3.benchmark_aws import install_local_clients, LocalS3ControlClient
+from s3.pitr_journal import PitrJournal
+
+
+class FailingS3ControlClient(LocalS3ControlClient):
+    """Fails job creations after the first fail_after ones, like a throttle while creating jobs."""
+
+    def __init__(self, fail_after: int):
+        super().__init__()
+        self.fail_after = fail_after
+
+    def create_job(self, **kwargs):
+        if len(self.jobs) >= self.fail_after:
+            raise Exception("TooManyRequestsException")
+        return super().create_job(**kwargs)
+
+
+class ResumeBatchOperationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.previous_path = os.getcwd()
+        self.previous_clients = {name: getattr(pitr, name) for name in ['s3_client', 'athena_client',
+                                                                        's3control_client', 'get_account_id']}
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        install_local_clients(self.tmp.name, os.path.join(self.tmp.name, 'results.csv'))
+        self.manifests = [(f"bucket-{i}", f"s3://temp/manifests/bucket-{i}_restore.csv", "etag") for i in range(4)]
+
+    def tearDown(self):
+        for name, client in self.previous_clients.items():
+            setattr(pitr, name, client)
+        os.chdir(self.previous_path)
+        self.tmp.cleanup()
+
+    def start(self, journal: PitrJournal):
+        return pitr.start_batch_operations(self.manifests, "restore", "temp", "role-arn", None, False, [], [],
+                                           max_workers=1, journal=journal)
+
+    def test_summary_lists_jobs_created_before_resume(self):
+        journal = PitrJournal.open('pitr_journal.json', False)
+        pitr.s3control_client = FailingS3ControlClient(fail_after=2)
+        summary = self.start(journal)
+        self.assertEqual(len([job for job in summary if 'job_id' in job]), 2)
+        first_run_jobs = set(journal.action("restore")["jobs"].values())
+
+        pitr.s3control_client = s3control_client = LocalS3ControlClient()
+        summary = self.start(PitrJournal.open('pitr_journal.json', True))
+        self.assertEqual(len(s3control_client.jobs), 2)
+
+        with open('batch_operations_restore.json') as f:
+            written_summary = json.load(f)
+        self.assertEqual(written_summary, summary)
+        self.assertEqual({job['manifest'] for job in written_summary}, {m[1] for m in self.manifests})
+        self.assertTrue(all(job.get('job_id') and 'error' not in job for job in written_summary))
+        self.assertEqual({job['job_id'] for job in written_summary},
+                         first_run_jobs | {job['JobId'] for job in s3control_client.jobs})
+        self.assertEqual({job['bucket'] for job in written_summary}, {m[0] for m in self.manifests})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from s3.pitr import QUERIES_FOLDER
+from s3.pitr_partitions import render_date_filters
+
+
+def read_query(name: str) -> str:
+    with open(f"{QUERIES_FOLDER}/{name}") as f:
+        return f.read()
+
+
+class RenderDateFiltersTest(unittest.TestCase):
+
+    def test_snapshot_state_is_not_filtered_by_window(self):
+        query = render_date_filters("$DATE_FILTER_UNTIL_SNAPSHOT|$DATE_FILTER_SINCE_SNAPSHOT|$DATE_FILTER_WINDOW",
+                                    "dt", "yyyy-MM-dd", "2025-05-30T04:00:00Z", "2025-05-20T00:00:00Z")
+        until_filter, since_filter, window_filter = query.split("|")
+        self.assertEqual(until_filter, "AND \"dt\" <= '2025-05-31'")
+        self.assertEqual(since_filter, "AND \"dt\" >= '2025-05-30'")
+        self.assertEqual(window_filter, "AND \"dt\" >= '2025-05-20'")
+
+    def test_window_keys_filter_only_with_window(self):
+        query = read_query("get_files_to_restore.sql")
+        without_window = render_date_filters(query, "dt", "yyyy-MM-dd", "2025-05-30T04:00:00Z")
+        with_window = render_date_filters(query, "dt", "yyyy-MM-dd", "2025-05-30T04:00:00Z", "2025-05-20T00:00:00Z")
+        self.assertNotIn("$", without_window.replace("$TABLE_NAME", "").replace("$SNAPSHOT_END_TIME", ""))
+        self.assertNotIn("exists", without_window)
+        self.assertIn("exists (select 1 from latestVersion", with_window)
+        # versionAtTS reads every partition until snapshot end time
+        version_at_ts = with_window[:with_window.index("latestVersion AS")]
+        self.assertNotIn("'2025-05-20'", version_at_ts)
+
+    def test_no_date_partition_key(self):
+        query = render_date_filters(read_query("get_files_to_delete.sql"), None, "yyyy-MM-dd",
+                                    "2025-05-30T04:00:00Z", "2025-05-20T00:00:00Z")
+        self.assertNotIn("$DATE_FILTER", query)
+
+
+if __name__ == "__main__":
+    unittest.main()
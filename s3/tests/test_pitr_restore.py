@@ -0,0 +1,71 @@
+import csv
+import os
+import random
+import tempfile
+import unittest
+
+from s3.pitr import parse_athena_rows_for_restore, BUCKET_COLUMN_NAME, SEQUENCER_COLUMN_NAME
+from s3.pitr_local import RowsReader
+
+FIELDNAMES = [BUCKET_COLUMN_NAME, 'key', 'version', SEQUENCER_COLUMN_NAME]
+
+
+def generate_rows(rnd: random.Random, buckets: int = 3, keys: int = 30, rows: int = 200) -> list:
+    """Rows of get_files_to_restore.sql results with the same keys in every bucket and few distinct sequencers,
+    so keys often have versions with the same sequencer in more than one bucket."""
+    return [{BUCKET_COLUMN_NAME: f"bucket-{rnd.randrange(buckets)}", 'key': f"folder/object-{rnd.randrange(keys)}",
+             'version': f"v{rnd.randrange(4)}", SEQUENCER_COLUMN_NAME: rnd.choice(["", "0A", "0B", "0C"])}
+            for _ in range(rows)]
+
+
+def read_outputs(paths: list) -> dict:
+    outputs = {}
+    for path in sorted(paths) + ['duplicated_version_at_same_time.csv']:
+        with open(path, newline='') as f:
+            outputs[path] = f.read()
+        os.remove(path)
+    return outputs
+
+
+class RestoreDedupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.previous_path = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.previous_path)
+        self.tmp.cleanup()
+
+    def test_external_sort_writes_same_manifests_and_duplicates_report(self):
+        rnd = random.Random(0)
+        for trial in range(50):
+            rows = generate_rows(rnd)
+            in_memory = read_outputs(parse_athena_rows_for_restore(
+                RowsReader(FIELDNAMES, rows), extra_name_suffix="restore", skip_duplicated_versions_at_same_time=True))
+            external_sort = read_outputs(parse_athena_rows_for_restore(
+                RowsReader(FIELDNAMES, rows), extra_name_suffix="restore", skip_duplicated_versions_at_same_time=True,
+                max_rows_in_memory=17, spill_dir=self.tmp.name))
+            self.assertEqual(in_memory.keys(), external_sort.keys(), f"trial {trial}")
+            for path in in_memory:
+                if path != 'duplicated_version_at_same_time.csv':
+                    # External sort writes manifest rows sorted by key
+                    in_memory[path] = sorted(in_memory[path].splitlines())
+                    external_sort[path] = sorted(external_sort[path].splitlines())
+            self.assertEqual(in_memory, external_sort, f"trial {trial}")
+
+    def test_duplicates_report_has_a_row_for_each_bucket(self):
+        rows = [{BUCKET_COLUMN_NAME: bucket_name, 'key': 'same-key', 'version': version, SEQUENCER_COLUMN_NAME: '0A'}
+                for bucket_name in ['bucket-b', 'bucket-a'] for version in ['v1', 'v2']]
+        for max_rows_in_memory in [0, 1]:
+            parse_athena_rows_for_restore(RowsReader(FIELDNAMES, rows), extra_name_suffix="restore",
+                                          skip_duplicated_versions_at_same_time=True,
+                                          max_rows_in_memory=max_rows_in_memory, spill_dir=self.tmp.name)
+            with open('duplicated_version_at_same_time.csv', newline='') as f:
+                self.assertEqual(list(csv.reader(f)), [['bucket-a', 'same-key', 'v2', '0A'],
+                                                       ['bucket-b', 'same-key', 'v2', '0A']])
+
+
+if __name__ == "__main__":
+    unittest.main()
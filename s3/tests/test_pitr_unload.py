@@ -0,0 +1,83 @@
+import csv
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from s3.pitr import (ACTION_CONFIGURATION, QUERIES_FOLDER, parse_athena_rows_for_restore, split_csv_rows,
+                     BUCKET_COLUMN_NAME)
+
+# Keys as written in events table by S3 events, already URL encoded
+RESTORE_ROWS = [
+    ('bucket-a', 'folder+1/report+%281%29.json', 'v1', '0055612FEA5B2F00AA'),
+    ('bucket-a', 'folder+1/report+%281%29.json', 'v2', '0055612FEA5B2F00AB'),
+    ('bucket-a', 'caf%C3%A9/a%2Cb+c.txt', 'v3', '0055612FEA5B2F00AC'),
+    ('bucket-b', '100%25+done/x%2By', 'v4', ''),
+    ('bucket-b', 'plain/key.json', 'v5', '0055612FEA5B2F00AD'),
+]
+
+
+def run_unload(action: str, rows: list, fieldnames: list) -> dict:
+    """
+    Runs the SELECT of the UNLOAD query of action on rows with SQLite and returns the lines Athena writes as TEXTFILE
+    by bucket name partition.
+    """
+    with open(f"{QUERIES_FOLDER}/{ACTION_CONFIGURATION[action]['athena_unload_query_name']}") as f:
+        unload_query = f.read()
+    select = unload_query[unload_query.index("UNLOAD (") + len("UNLOAD ("):unload_query.rindex(")\nTO '")]
+    connection = sqlite3.connect(":memory:")
+    connection.create_function("lpad", 3, lambda value, length, pad: value.rjust(length, pad)[-length:])
+    connection.execute(f"CREATE TABLE results ({', '.join(fieldnames)})")
+    connection.executemany(f"INSERT INTO results VALUES ({', '.join('?' * len(fieldnames))})", rows)
+    lines_by_bucket = {}
+    for *fields, partition in connection.execute(select.replace("$QUERY", "SELECT * FROM results")):
+        # TEXTFILE writes fields joined by the delimiter, without quoting
+        lines_by_bucket.setdefault(partition, []).append(",".join(fields))
+    return lines_by_bucket
+
+
+def read_manifests(paths: list) -> dict:
+    lines_by_bucket = {}
+    for path in paths:
+        with open(path, newline='') as f:
+            rows = list(csv.reader(f))
+        lines_by_bucket[rows[0][0]] = [",".join(row) for row in rows]
+    return lines_by_bucket
+
+
+class UnloadManifestsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.previous_path = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.previous_path)
+        self.tmp.cleanup()
+
+    def assertSameManifests(self, unloaded: dict, downloaded: dict):
+        self.assertEqual(sorted(unloaded), sorted(downloaded))
+        for bucket_name in unloaded:
+            self.assertEqual(sorted(unloaded[bucket_name]), sorted(downloaded[bucket_name]), bucket_name)
+
+    def test_restore_manifests_match_download_path(self):
+        fieldnames = [BUCKET_COLUMN_NAME, 'key', 'version', 'sequencer']
+        reader = csv.DictReader([",".join(fieldnames)] + [",".join(row) for row in RESTORE_ROWS])
+        downloaded = read_manifests(parse_athena_rows_for_restore(reader, extra_name_suffix="restore",
+                                                                  skip_duplicated_versions_at_same_time=True))
+        unloaded = run_unload("restore", RESTORE_ROWS, fieldnames)
+        self.assertSameManifests(unloaded, downloaded)
+        self.assertIn("bucket-a,folder+1/report+%281%29.json,v2", unloaded['bucket-a'])
+        self.assertIn("bucket-b,100%25+done/x%2By,v4", unloaded['bucket-b'])
+
+    def test_delete_manifests_match_download_path(self):
+        fieldnames = [BUCKET_COLUMN_NAME, 'key']
+        rows = sorted({row[:2] for row in RESTORE_ROWS})
+        reader = csv.DictReader([",".join(fieldnames)] + [",".join(row) for row in rows])
+        downloaded = read_manifests(split_csv_rows(reader, BUCKET_COLUMN_NAME, extra_name_suffix="delete"))
+        self.assertSameManifests(run_unload("delete", rows, fieldnames), downloaded)
+
+
+if __name__ == "__main__":
+    unittest.main()
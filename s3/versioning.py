@@ -1,6 +1,10 @@
+from contextlib import nullcontext
+
 import typer
 from botocore.exceptions import ClientError
 
+from s3.bucket_audit import OUTPUT_FORMATS, AuditWriter, audit_buckets
+from utils.bulk import bulk_apply
 from utils.logger import get_logger
 from utils.s3 import get_buckets_by_tag
 from utils.aws import AWSHelper
@@ -10,37 +14,34 @@ logger = get_logger(__name__)
 
 def set_bucket_versioning(bucket_name: str, status: str):
     """
-    Enables or disables versioning for a specific bucket.
+    Enables or disables versioning for a specific bucket, raises ClientError on failure.
 
     Args:
         bucket_name: The S3 bucket name.
         status: The versioning status ('Enabled' or 'Suspended').
     """
     s3_client = AWSHelper.get_client("s3")
-    try:
-        s3_client.put_bucket_versioning(
-            Bucket=bucket_name,
-            VersioningConfiguration={'Status': status}
-        )
-        message_action = "enabled" if status == "Enabled" else "disabled (suspended)"
-        typer.secho(f"👍 Versioning successfully {message_action} for bucket: {bucket_name}", fg=typer.colors.GREEN)
-    except ClientError as e:
-        typer.secho(f"👎 Failed to set versioning for {bucket_name}: {e}", fg=typer.colors.RED)
+    s3_client.put_bucket_versioning(
+        Bucket=bucket_name,
+        VersioningConfiguration={'Status': status}
+    )
 
 
 def enable_versioning(
     tag_key: str = typer.Option(..., "--tag-key", "-k", help="The tag key to select buckets."),
-    tag_value: str = typer.Option(..., "--tag-value", "-v", help="The tag value to select buckets.")
+    tag_value: str = typer.Option(..., "--tag-value", "-v", help="The tag value to select buckets."),
+    max_workers: int = typer.Option(20, "--max-workers", help="Max number of buckets updated in parallel."),
+    result_file: str = typer.Option(None, "--result-file", help="JSON Lines file with the outcome for each bucket.")
 ):
     """
-    Enables versioning on S3 buckets that match a specific tag.
+    Enables versioning on S3 buckets that match a specific tag, updating them in parallel.
     """
     typer.echo(f"▶️  Starting process to enable versioning...")
     buckets_to_update = get_buckets_by_tag(tag_key, tag_value)
 
     if buckets_to_update and typer.confirm(f"Are you sure you want to ENABLE versioning for {len(buckets_to_update)} buckets?"):
-        for bucket in buckets_to_update:
-            set_bucket_versioning(bucket, "Enabled")
+        bulk_apply(lambda bucket: set_bucket_versioning(bucket, "Enabled"), buckets_to_update, max_workers,
+                   "Enabling versioning", result_file)
         typer.echo("\n🎉 Process completed!")
     elif not buckets_to_update:
         typer.echo("🚫 No buckets to update. Operation finished.")
@@ -50,17 +51,19 @@ def enable_versioning(
 
 def disable_versioning(
     tag_key: str = typer.Option(..., "--tag-key", "-k", help="The tag key to select buckets."),
-    tag_value: str = typer.Option(..., "--tag-value", "-v", help="The tag value to select buckets.")
+    tag_value: str = typer.Option(..., "--tag-value", "-v", help="The tag value to select buckets."),
+    max_workers: int = typer.Option(20, "--max-workers", help="Max number of buckets updated in parallel."),
+    result_file: str = typer.Option(None, "--result-file", help="JSON Lines file with the outcome for each bucket.")
 ):
     """
-    Disables (suspends) versioning on S3 buckets that match a specific tag.
+    Disables (suspends) versioning on S3 buckets that match a specific tag, updating them in parallel.
     """
     typer.echo(f"▶️ Starting process to disable versioning...")
     buckets_to_update = get_buckets_by_tag(tag_key, tag_value)
 
     if buckets_to_update and typer.confirm(f"Are you sure you want to DISABLE (suspend) versioning for {len(buckets_to_update)} buckets?"):
-        for bucket in buckets_to_update:
-            set_bucket_versioning(bucket, "Suspended")
+        bulk_apply(lambda bucket: set_bucket_versioning(bucket, "Suspended"), buckets_to_update, max_workers,
+                   "Disabling versioning", result_file)
         typer.echo("\n🎉 Process completed!")
     elif not buckets_to_update:
         typer.echo("🚫 No buckets to update. Operation finished.")
@@ -68,34 +71,52 @@ def disable_versioning(
         typer.echo("🚫 Operation cancelled.")
 
 
-def check_buckets_versioning():
+def check_buckets_versioning(
+    output: str = typer.Option(None, "--output", "-o", help="File where the audit of each bucket is written."),
+    output_format: str = typer.Option("json", "--output-format", "-f",
+                                      help=f"Format of output file: {', '.join(OUTPUT_FORMATS)} (JSON Lines)."),
+    max_workers: int = typer.Option(20, "--max-workers", help="Max number of buckets audited in parallel.")
+):
+    """
+    Finds buckets with enabled versioning, auditing in parallel versioning, MFA delete, lifecycle and notification
+    settings of every bucket through a client of its region.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        typer.secho(f"Invalid output format '{output_format}', allowed values: {', '.join(OUTPUT_FORMATS)}",
+                    fg=typer.colors.RED)
+        raise typer.Exit(code=1)
     s3_client = AWSHelper.get_client("s3")
 
     buckets = s3_client.list_buckets()
+    buckets = [
+        bucket for bucket in buckets['Buckets']
+        if "website" not in bucket['Name'].lower() and "src" not in bucket['Name'].lower()
+        and "source" not in bucket['Name'].lower()
+    ]
 
     versioned_buckets = []
 
-    print("Finding buckets with enabled versioning..\n")
-    for bucket in buckets['Buckets']:
-
-        bucket_name = bucket['Name']
-
-        try:
-
-            if "website" not in bucket_name.lower() and "src" not in bucket_name.lower() and "source" not in bucket_name.lower():
-                versioning = s3_client.get_bucket_versioning(Bucket=bucket_name)
-
-                if 'Status' in versioning and versioning['Status'] == 'Enabled':
-                    versioned_buckets.append(bucket_name)
-        except Exception as e:
-            print(f"Cannot determine if versioning it's enabled for bucket '{bucket_name}': {str(e)}")
+    print(f"Finding buckets with enabled versioning among {len(buckets)} buckets..\n")
+    with (AuditWriter(output, output_format) if output else nullcontext()) as writer:
+        for audited, result in enumerate(audit_buckets(buckets, max_workers), start=1):
+            if writer:
+                writer.write(result)
+            if result['error']:
+                print(f"Cannot determine if versioning it's enabled for bucket '{result['bucket']}': "
+                      f"{result['error']}")
+            elif result['versioning'] == 'Enabled':
+                versioned_buckets.append(result['bucket'])
+            if audited % 100 == 0:
+                logger.info(f"Audited {audited}/{len(buckets)} buckets")
 
     if versioned_buckets:
         print("Buckets with enabled versioning:\n")
-        for bucket in versioned_buckets:
+        for bucket in sorted(versioned_buckets):
             print(bucket)
     else:
         print("No bucket found with enabled versioning\n")
+    if output:
+        print(f"\nAudit of {len(buckets)} buckets written to {output}")
 
 
 def check_bucket_versioning(bucket_name: str) -> bool:
@@ -1,3 +1,5 @@
+import threading
+
 import boto3
 import typer
 from botocore.session import Session
@@ -18,6 +20,8 @@ class AWSHelper:
     _clients: Dict[str, Boto3Client] = {}
     _profile: Optional[str] = None
     _initialized: bool = False
+    # Clients are created by worker threads too, but boto3 sessions aren't thread safe
+    _lock = threading.Lock()
 
     @staticmethod
     def configure(profile: Optional[str] = None):
@@ -53,19 +57,22 @@ class AWSHelper:
         return AWSHelper._session
 
     @staticmethod
-    def get_client(service_name: str) -> Boto3Client:
+    def get_client(service_name: str, region_name: Optional[str] = None) -> Boto3Client:
         """
         Lazy-loads and returns a specific service client from the class-level cache.
 
         Args:
             service_name: The name of the AWS service (e.g., 's3', 'ec2').
+            region_name: The region of the client. If None, the region of the profile is used.
 
         Returns:
             A boto3 client for the requested service.
         """
-        if service_name not in AWSHelper._clients:
-            # typer.secho(f"Client for '{service_name}' not found, creating new client...", fg=typer.colors.GREEN)
-            session = AWSHelper.get_session()
-            AWSHelper._clients[service_name] = session.client(service_name)
+        client_key = f"{service_name}:{region_name}" if region_name else service_name
+        if client_key not in AWSHelper._clients:
+            with AWSHelper._lock:
+                if client_key not in AWSHelper._clients:
+                    session = AWSHelper.get_session()
+                    AWSHelper._clients[client_key] = session.client(service_name, region_name=region_name)
 
-        return AWSHelper._clients[service_name]
\ No newline at end of file
+        return AWSHelper._clients[client_key]
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""
+Bulk apply of an operation to many resources, e.g. the buckets selected by a tag.
+
+Operations run in a bounded thread pool, throttling errors are retried with backoff, a progress bar shows the
+operations per second, and the outcome for each resource can be written to a JSON Lines result file.
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional
+
+import typer
+from botocore.exceptions import ClientError
+
+from utils.logger import get_logger
+from utils.retry import call_with_retry
+
+logger = get_logger(__name__)
+
+
+def bulk_apply(operation: Callable[[str], Any], resources: List[str], max_workers: int = 20,
+               label: str = "Applying", result_file: Optional[str] = None) -> List[Dict]:
+    """
+    Calls operation(resource) for every resource in parallel.
+
+    Args:
+        operation: Function applied to a resource, its return value is stored as result, it raises on failure.
+        resources: Resources, e.g. bucket names.
+        max_workers: Max number of operations running in parallel.
+        label: Label of the progress bar.
+        result_file: If set, path of a JSON Lines file with the outcome of each resource, written as they complete.
+    Returns:
+        Outcomes in completion order: dicts with resource, status (succeeded or failed), result and error.
+    """
+    outcomes = []
+    start = time.monotonic()
+
+    def apply(resource: str) -> Dict:
+        try:
+            result = call_with_retry(operation, resource)
+            return {'resource': resource, 'status': 'succeeded', 'result': result, 'error': None}
+        except ClientError as e:
+            return {'resource': resource, 'status': 'failed', 'result': None,
+                    'error': f"{e.response['Error']['Code']}: {e}"}
+        except Exception as e:
+            return {'resource': resource, 'status': 'failed', 'result': None, 'error': str(e)}
+
+    def show_rate(_) -> str:
+        elapsed = time.monotonic() - start
+        return f"{len(outcomes) / elapsed if elapsed else 0:.1f} ops/s"
+
+    output = open(result_file, 'w') if result_file else None
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+                typer.progressbar(length=len(resources), label=label, item_show_func=show_rate) as progress:
+            futures = [executor.submit(apply, resource) for resource in resources]
+            for future in as_completed(futures):
+                outcome = future.result()
+                outcomes.append(outcome)
+                if output:
+                    output.write(json.dumps(outcome, default=str) + "\n")
+                    output.flush()
+                progress.update(1)
+    finally:
+        if output:
+            output.close()
+
+    elapsed = time.monotonic() - start
+    failed = [outcome for outcome in outcomes if outcome['status'] == 'failed']
+    for outcome in failed:
+        typer.secho(f"👎 {outcome['resource']}: {outcome['error']}", fg=typer.colors.RED)
+    logger.info(f"{label}: {len(outcomes) - len(failed)} succeeded, {len(failed)} failed in {elapsed:.1f} seconds "
+                f"({len(outcomes) / elapsed if elapsed else 0:.1f} ops/s)")
+    if result_file:
+        logger.info(f"Results written to {result_file}")
+    return outcomes
@@ -0,0 +1,108 @@
+import csv
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+
+class _PartitionFile:
+    """
+    File like object of a partition. The csv writer of the partition writes to this object, that forwards to the
+    currently open handle, so the writer is created once even if the handle is closed and reopened by the pool.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.handle = None
+        self.opened = False
+
+    def write(self, s: str):
+        return self.handle.write(s)
+
+
+class PartitionedCsvWriter:
+    """
+    Writes CSV rows to one file for each partition value.
+
+    One csv writer is created for each partition and cached, while open file handles are kept in an LRU pool of at
+    most max_open_files entries. When the pool is full the least recently used handle is closed and it's reopened
+    in append mode on next write, so the number of partitions isn't bounded by the open files limit.
+    Handles are opened with a write buffer of buffer_size bytes.
+
+    Usage:
+        with PartitionedCsvWriter(lambda p: f"{p}.csv", fieldnames=['bucketname', 'key']) as writer:
+            writer.writerow(row['bucketname'], row)
+        print(writer.paths)
+    """
+
+    def __init__(self, path_for_partition: Callable[[str], str], fieldnames: Optional[List[str]] = None,
+                 max_open_files: int = 256, buffer_size: int = 64 * 1024):
+        """
+        Args:
+            path_for_partition: Function that returns the file path of a partition value.
+            fieldnames: If set rows are dicts written with csv.DictWriter (extra keys are ignored), otherwise rows
+                are sequences written with csv.writer.
+            max_open_files: Max number of file handles kept open at the same time.
+            buffer_size: Write buffer size in bytes of each open handle.
+        """
+        if max_open_files < 1:
+            raise ValueError("max_open_files must be greater than 0")
+        self.path_for_partition = path_for_partition
+        self.fieldnames = fieldnames
+        self.max_open_files = max_open_files
+        self.buffer_size = buffer_size
+        self._files: Dict[str, _PartitionFile] = {}
+        self._writers: Dict[str, object] = {}
+        self._open_files: OrderedDict[str, _PartitionFile] = OrderedDict()
+        self.reopen_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def partitions(self) -> List[str]:
+        """Partition values in order of first write."""
+        return list(self._files.keys())
+
+    @property
+    def paths(self) -> List[str]:
+        """File paths in order of first write."""
+        return [f.path for f in self._files.values()]
+
+    def _get_writer(self, partition: str):
+        partition_file = self._files.get(partition)
+        if partition_file is None:
+            partition_file = self._files[partition] = _PartitionFile(self.path_for_partition(partition))
+            if self.fieldnames:
+                self._writers[partition] = csv.DictWriter(partition_file, fieldnames=self.fieldnames,
+                                                          extrasaction='ignore')
+            else:
+                self._writers[partition] = csv.writer(partition_file)
+
+        if partition_file.handle is None:
+            if len(self._open_files) >= self.max_open_files:
+                _, lru_file = self._open_files.popitem(last=False)
+                lru_file.handle.close()
+                lru_file.handle = None
+            mode = 'a' if partition_file.opened else 'w'
+            if partition_file.opened:
+                self.reopen_count += 1
+            partition_file.handle = open(partition_file.path, mode, newline='', buffering=self.buffer_size)
+            partition_file.opened = True
+            self._open_files[partition] = partition_file
+        else:
+            self._open_files.move_to_end(partition)
+        return self._writers[partition]
+
+    def writerow(self, partition: str, row):
+        self._get_writer(partition).writerow(row)
+
+    def writerows(self, partition: str, rows):
+        self._get_writer(partition).writerows(rows)
+
+    def close(self):
+        for partition_file in self._open_files.values():
+            partition_file.handle.close()
+            partition_file.handle = None
+        self._open_files.clear()
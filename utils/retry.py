@@ -0,0 +1,43 @@
+import random
+import time
+from typing import Callable, Iterable, TypeVar
+
+from botocore.exceptions import ClientError
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar('T')
+
+# Error codes returned by AWS APIs when requests are throttled or the service is temporarily unavailable
+THROTTLING_ERROR_CODES = [
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottled', 'RequestThrottledException',
+    'TooManyRequests', 'TooManyRequestsException', 'RequestLimitExceeded', 'SlowDown', 'BandwidthLimitExceeded',
+    'ProvisionedThroughputExceededException', 'InternalError', 'ServiceUnavailable', 'ServiceUnavailableException',
+    'OperationAborted'
+]
+
+
+def is_throttling_error(error: Exception, retryable_error_codes: Iterable[str] = THROTTLING_ERROR_CODES) -> bool:
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in retryable_error_codes
+
+
+def call_with_retry(function: Callable[..., T], *args, max_attempts: int = 8, base_delay: float = 0.5,
+                    max_delay: float = 20, retryable_error_codes: Iterable[str] = THROTTLING_ERROR_CODES,
+                    sleep: Callable[[float], None] = time.sleep, **kwargs) -> T:
+    """
+    Calls function(*args, **kwargs) retrying throttling errors with exponential backoff and full jitter: before
+    attempt n it waits a random time between 0 and min(max_delay, base_delay * 2 ** n).
+    Other errors, and throttling errors after max_attempts attempts, are raised.
+    """
+    for attempt in range(max_attempts):
+        try:
+            return function(*args, **kwargs)
+        except ClientError as e:
+            if attempt == max_attempts - 1 or not is_throttling_error(e, retryable_error_codes):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            logger.debug(f"{e.response['Error']['Code']} calling {getattr(function, '__name__', function)}, "
+                         f"retry {attempt + 1}/{max_attempts - 1} in {delay:.2f} seconds")
+            sleep(delay)
@@ -0,0 +1,85 @@
+import random
+import time
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class WaitTimeoutError(TimeoutError):
+    """Raised when the deadline of a Waiter is reached before the awaited condition."""
+
+    def __init__(self, message: str, last_result=None):
+        super().__init__(message)
+        self.last_result = last_result
+
+
+class Waiter:
+    """
+    Polls a status until a condition is met, with exponential backoff and jitter.
+
+    First poll is done immediately, then delay starts from initial_delay and is multiplied by multiplier after every
+    poll up to max_delay. Each delay is randomized by +/- jitter (fraction of delay), so many waiters don't poll
+    at the same time. With timeout the waiter raises WaitTimeoutError when the deadline is reached; last sleep is
+    shortened to the deadline, so the wait never exceeds timeout.
+
+    After wait, attempts and elapsed seconds of last wait are available on the waiter.
+
+    Usage:
+        waiter = Waiter(initial_delay=0.25, max_delay=5, timeout=600)
+        response = waiter.wait(lambda: client.get_query_execution(QueryExecutionId=query_id),
+                               lambda r: r['QueryExecution']['Status']['State'] in ['SUCCEEDED', 'FAILED'])
+    """
+
+    def __init__(self, initial_delay: float = 0.25, max_delay: float = 10, multiplier: float = 2,
+                 jitter: float = 0.2, timeout: Optional[float] = None,
+                 sleep: Callable[[float], None] = time.sleep, clock: Callable[[], float] = time.monotonic):
+        if initial_delay <= 0 or max_delay < initial_delay:
+            raise ValueError("initial_delay must be greater than 0 and not greater than max_delay")
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.timeout = timeout
+        self._sleep = sleep
+        self._clock = clock
+        self.attempts = 0
+        self.elapsed = 0.0
+
+    def delays(self):
+        """Yields delays between polls."""
+        delay = self.initial_delay
+        while True:
+            yield delay * random.uniform(1 - self.jitter, 1 + self.jitter) if self.jitter else delay
+            delay = min(delay * self.multiplier, self.max_delay)
+
+    def wait(self, poll: Callable[[], T], is_done: Callable[[T], bool],
+             on_poll: Optional[Callable[[T], None]] = None) -> T:
+        """
+        Calls poll until is_done returns True for its result and returns that result.
+
+        Args:
+            poll: Function that returns current status.
+            is_done: Function that returns True if status is final.
+            on_poll: Optional function called with every status not final, e.g. for logging.
+        """
+        start = self._clock()
+        deadline = start + self.timeout if self.timeout is not None else None
+        self.attempts = 0
+        delays = self.delays()
+        while True:
+            result = poll()
+            self.attempts += 1
+            self.elapsed = self._clock() - start
+            if is_done(result):
+                return result
+            if on_poll:
+                on_poll(result)
+
+            delay = next(delays)
+            if deadline is not None:
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    raise WaitTimeoutError(f"Timeout reached after {self.elapsed:.1f} seconds "
+                                           f"and {self.attempts} polls", last_result=result)
+                delay = min(delay, remaining)
+            self._sleep(delay)